@@ -2,52 +2,83 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 import time
 import requests
-import csv
 from datetime import datetime
 from collections import deque
+from qos_metrics import Counter, Gauge, Histogram, start_http_server
+from qos_trace import TraceLog
+from telemetry_store import CSV_TIME_FORMAT, CsvLog, TelemetryStore, prepare_csv
 
 # Configuration
 RYU_STATS_URL = "http://127.0.0.1:8080/stats"
 DECISION_ENGINE_URL = "http://127.0.0.1:5000/metrics"
 LOG_JSON_FILE = "latest_metrics.json"
 LOG_CSV_FILE = "network_traffic.csv"
-
-# Queues for moving averages (last 3 samples)
-history_video_loss = deque(maxlen=3)
-
-# Queues for moving averages (last 10 samples)
-history_video_bps = deque(maxlen=10)
-history_dl_bps = deque(maxlen=10)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Written by video_qoe_probe.py on the video user; same default path as mininet_topo.py,
+# whatever the working directory (QOS_QOE_FILE overrides it, e.g. per scenario run)
+QOE_JSON_FILE = os.environ.get("QOS_QOE_FILE", os.path.join(SCRIPT_DIR, "latest_qoe.json"))
+QOE_MAX_AGE = 3.0  # Ignore QoE snapshots older than this (probe not running)
+TELEMETRY_NAME = "network"  # Rolled-up history: telemetry/network/{1s,1m,1h}
+CSV_HEADER = ["Timestamp", "Total(Mbps)", "Video(Mbps)", "Download(Mbps)", "Video_Loss_3sec_Avg(%)",
+              "Video_loss(%)", "Link_Delay(ms)", "Queue_Delay(ms)"]
+METRICS_PORT = 9101  # Prometheus scrape endpoint: http://<host>:9101/metrics
+
+# Metrics
+LOOP_TIME = Histogram('qos_collector_loop_seconds', 'Time to process one sample (poll, log, push)')
+RYU_POLL_TIME = Histogram('qos_collector_ryu_poll_seconds', 'GET /stats round trip to Ryu')
+ENGINE_POST_TIME = Histogram('qos_collector_engine_post_seconds', 'POST /metrics round trip to the decision engine')
+RATE_MBPS = Gauge('qos_collector_rate_mbps', 'Per-class rate after the bottleneck', ['class'])
+VIDEO_LOSS = Gauge('qos_collector_video_loss_percent', 'Video loss (raw sample and 3-sample moving average)', ['window'])
+DELAY_MS = Gauge('qos_collector_delay_ms', 'Measured one-way delay of the most delayed switch-to-switch link')
+QUEUE_DELAY_MS = Gauge('qos_collector_queue_delay_ms', 'Measured queueing delay of the most congested link')
+ERRORS = Counter('qos_collector_errors_total', 'Failed collection iterations')
 
 
 def init_files():
-    """Create CSV header and initialize JSON file."""
-    # Initialize JSON
+    """Initialize the JSON snapshot; keep appending to the CSV log (header only when new)."""
+    # Initialize JSON (latest sample only)
     with open(LOG_JSON_FILE, 'w') as f:
         json.dump([], f)
 
-    # Initialize CSV: always start fresh with header
-    with open(LOG_CSV_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["hh:mm:ss", "Total(Mbps)", "Video(Mbps)", "Download(Mbps)", "Video_Loss_3sec_Avg(%)", "Video_loss(%)", "Estimated_Delay(ms)"])
+    # CSV survives restarts; rotated to <file>.1 once it gets too large
+    if prepare_csv(LOG_CSV_FILE, CSV_HEADER):
+        print(f"[INIT] Files initialized (CSV Header Created).")
+    else:
+        print(f"[INIT] Files initialized (appending to {LOG_CSV_FILE}).")
 
-    print(f"[INIT] Files initialized (CSV Header Created).")
 
+def measured_delay(raw):
+    """
+    (delay_ms, queue_ms) of the probed link with the largest queue, or (None, None) before the
+    controller has probe samples. The bottleneck is whichever link queues: s2->s1 on the default
+    topology, one of the hops on chain/tree/leaf-spine.
+    """
+    links = raw.get('link_delay') or {}
+    if not links:
+        return None, None
+    worst = max(links.values(), key=lambda link: (link.get('queue_ms', 0), link.get('delay_ms', 0)))
+    return worst.get('delay_ms'), worst.get('queue_ms')
 
-def estimate_delay(traffic_load_mbps):
-    """Estimate delay based on traffic load (assuming 10 Mbps link)."""
-    LINK_CAPACITY = 10.0
-    base_delay = 5.0
 
-    if traffic_load_mbps >= LINK_CAPACITY:
-        return 500.0 + (traffic_load_mbps - LINK_CAPACITY) * 100
-    elif traffic_load_mbps > LINK_CAPACITY * 0.9:
-        util = traffic_load_mbps / LINK_CAPACITY
-        return base_delay + (100 * util * util)
-    else:
-        return base_delay + (traffic_load_mbps * 2)
+def csv_value(value, digits):
+    return '' if value is None else round(value, digits)
+
+
+def read_qoe():
+    """Return the receiver's latest QoE summary, or None if missing or stale."""
+    try:
+        with open(QOE_JSON_FILE, 'r') as f:
+            report = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - report.get("time", 0) > QOE_MAX_AGE:
+        return None
+    # Forward the summary only; per-stream rows stay in the file
+    return {k: report.get(k) for k in ("time", "video_loss_percent", "owd_ms", "jitter_ms",
+                                       "goodput_mbps", "stall_sec", "rebuffer_events")}
 
 
 def calculate_moving_average(value, queue):
@@ -56,79 +87,147 @@ def calculate_moving_average(value, queue):
     return sum(queue) / len(queue)
 
 
+class MetricsCollector:
+    """
+    Turns one Ryu /stats snapshot (bps counters) into the decision engine's metrics sample:
+    Mbps rates, loss percentage, moving averages, QoE. Also appends the CSV row and
+    rewrites the JSON snapshot. Used by the polling loop below and, in-process, by QoSController:
+    there no JSON snapshot, no QoE file (the engine keeps the /qoe pushes), no per-sample print,
+    and the CSV/telemetry rows stay buffered until write_logs().
+    """
+
+    def __init__(self, write_json=True, read_qoe_file=True, buffered=False, verbose=True):
+        self.write_json = write_json
+        self.read_qoe_file = read_qoe_file
+        self.verbose = verbose
+        # Queues for moving averages (last 3 samples)
+        self.history_video_loss = deque(maxlen=3)
+        # Queues for moving averages (last 10 samples)
+        self.history_video_bps = deque(maxlen=10)
+        self.history_dl_bps = deque(maxlen=10)
+        # Bounded history: 1 s / 1 min / 1 h rollups with per-tier retention
+        self.store = TelemetryStore(TELEMETRY_NAME, buffered=buffered)
+        self.csv_log = CsvLog(LOG_CSV_FILE, CSV_HEADER, buffered=buffered)
+
+    def write_logs(self):
+        """Write the buffered CSV rows and telemetry rollups."""
+        self.csv_log.write()
+        self.store.write()
+
+    def process(self, raw):
+        # --- Data processing (bps -> Mbps) ---
+        vid_rx = raw.get('video_bps', 0) / 1e6
+        vid_tx = raw.get('video_tx_bps', 0) / 1e6
+        dl_rx = raw.get('download_bps', 0) / 1e6
+
+        vid_loss_mbps = raw.get('video_loss', 0) / 1e6
+
+        # Calculate loss percentage
+        loss_percent = 0.0
+        if vid_tx > 0:
+            loss_percent = (vid_loss_mbps / vid_tx) * 100
+
+        total_load = vid_rx + dl_rx
+        delay, queue_delay = measured_delay(raw)
+
+        # Moving averages for recent video loss and bandwidth (3 and 10 samples)
+        avg_vid_loss = calculate_moving_average(loss_percent, self.history_video_loss)
+        avg_vid_bps = calculate_moving_average(vid_rx, self.history_video_bps)
+        avg_dl_bps = calculate_moving_average(dl_rx, self.history_dl_bps)
+
+        # --- Save CSV (raw data) ---
+        timestamp = datetime.now().strftime(CSV_TIME_FORMAT)
+        # Append new row
+        self.csv_log.append([
+            timestamp,
+            round(total_load, 2),
+            round(vid_rx, 2),
+            round(dl_rx, 2),
+            round(avg_vid_loss, 2),
+            round(loss_percent, 2),
+            csv_value(delay, 1),
+            csv_value(queue_delay, 1)
+        ])
+
+        # --- Build metrics sample ---
+        metrics_data = {
+            "timestamp": timestamp,
+            "video_mbps": round(vid_rx, 2),
+            "download_mbps": round(dl_rx, 2),
+            "video_tx_mbps": round(vid_tx, 2),                 # Offered (before the bottleneck)
+            "download_tx_mbps": round(raw.get('download_tx_bps', 0) / 1e6, 2),
+            "video_loss_percent_ma": round(avg_vid_loss, 2),  # Moving-average loss
+            "raw_loss_percent": round(loss_percent, 2),      # Instantaneous loss
+            "delay_ms": None if delay is None else round(delay, 1),  # Measured by the controller's probes
+            "queue_delay_ms": None if queue_delay is None else round(queue_delay, 1),
+            "video_mbps_10sec_avg": round(avg_vid_bps, 1),
+            "download_mbps_10sec_avg": round(avg_dl_bps, 1),
+            "trace_id": raw.get('trace_id'),
+        }
+
+        # Ground-truth QoE measured at the receiver (when the probe is running)
+        qoe = read_qoe() if self.read_qoe_file else None
+        if qoe:
+            metrics_data["qoe"] = qoe
+
+        self.store.add({
+            "total_mbps": total_load, "video_mbps": vid_rx, "download_mbps": dl_rx,
+            "video_tx_mbps": vid_tx, "video_loss_percent": loss_percent,
+            "delay_ms": delay, "queue_delay_ms": queue_delay,
+        })
+
+        # --- Save JSON ---
+        # JSON stores only the latest averaged data
+        if self.write_json:
+            with open(LOG_JSON_FILE, 'w') as f:
+                json.dump([metrics_data], f, indent=2)
+
+        RATE_MBPS.labels('video').set(vid_rx)
+        RATE_MBPS.labels('download').set(dl_rx)
+        VIDEO_LOSS.labels('raw').set(loss_percent)
+        VIDEO_LOSS.labels('3s').set(avg_vid_loss)
+        if delay is not None:
+            DELAY_MS.set(delay)
+            QUEUE_DELAY_MS.set(queue_delay)
+
+        if self.verbose:
+            print(f"[{timestamp}] Total Load:{total_load:.1f}M | Video(Mbps):{vid_rx:.1f} | Download(Mbps):{dl_rx:.1f}| VidLoss(MA):{avg_vid_loss:.1f}%")
+        return metrics_data
+
+
 def main():
+    trace = TraceLog()
     init_files()
-    print(f"--- Monitoring & Parsing Started ---")
+    start_http_server(METRICS_PORT)
+    collector = MetricsCollector()
+    print(f"--- Monitoring & Parsing Started (metrics on :{METRICS_PORT}/metrics) ---")
 
     while True:
         try:
             # 1. Collect statistics from Ryu
+            loop_start = time.perf_counter()
             res = requests.get(RYU_STATS_URL, timeout=1)
+            RYU_POLL_TIME.observe(time.perf_counter() - loop_start)
             if res.status_code == 200:
                 raw = res.json()
+                trace_id = raw.get('trace_id')
+                trace.record(trace_id, 'collector_recv')
 
-                # --- Data processing (bps -> Mbps) ---
-                vid_rx = raw.get('video_bps', 0) / 1e6
-                vid_tx = raw.get('video_tx_bps', 0) / 1e6
-                dl_rx = raw.get('download_bps', 0) / 1e6
-                dl_tx = raw.get('download_tx_bps', 0) / 1e6
-
-                vid_loss_mbps = raw.get('video_loss', 0) / 1e6
-
-                # Calculate loss percentage
-                loss_percent = 0.0
-                if vid_tx > 0:
-                    loss_percent = (vid_loss_mbps / vid_tx) * 100
-
-                total_load = vid_rx + dl_rx
-                delay = estimate_delay(total_load)
-
-                # Moving averages for recent video loss and bandwidth (3 and 10 samples)
-                avg_vid_loss = calculate_moving_average(loss_percent, history_video_loss)
-                avg_vid_bps = calculate_moving_average(vid_rx, history_video_bps)
-                avg_dl_bps = calculate_moving_average(dl_rx, history_dl_bps)
-
-                # --- 2. Save CSV (raw data) ---
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                # Append new row
-                with open(LOG_CSV_FILE, 'a', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([
-                        timestamp,
-                        round(total_load, 2),
-                        round(vid_rx, 2),
-                        round(dl_rx, 2),
-                        round(avg_vid_loss, 2),
-                        round(loss_percent, 2),
-                        round(delay, 1)
-                    ])
-
-                # --- 3. Save JSON ---
-                # JSON stores only the latest averaged data
-                metrics_data = {
-                    "timestamp": timestamp,
-                    "video_mbps": round(vid_rx, 2),
-                    "download_mbps": round(dl_rx, 2),
-                    "video_loss_percent_ma": round(avg_vid_loss, 2),  # Moving-average loss
-                    "raw_loss_percent": round(loss_percent, 2),      # Instantaneous loss
-                    "delay_ms": round(delay, 1),
-                    "video_mbps_10sec_avg": round(avg_vid_bps, 1),
-                    "download_mbps_10sec_avg": round(avg_dl_bps, 1),
-                }
-
-                with open(LOG_JSON_FILE, 'w') as f:
-                    json.dump([metrics_data], f, indent=2)
-
-                # --- 4. Send to Decision Engine ---
-                # Monitoring output
-                print(f"[{timestamp}] Total Load:{total_load:.1f}M | Video(Mbps):{vid_rx:.1f} | Download(Mbps):{dl_rx:.1f}| VidLoss(MA):{avg_vid_loss:.1f}% | Push to Engine...")
+                # 2. Rates, averages, CSV/JSON logs
+                metrics_data = collector.process(raw)
 
+                # 3. Send to Decision Engine
+                trace.record(trace_id, 'collector_post')
+                post_start = time.perf_counter()
                 requests.post(DECISION_ENGINE_URL, json=metrics_data, timeout=1)
+                ENGINE_POST_TIME.observe(time.perf_counter() - post_start)
+                LOOP_TIME.observe(time.perf_counter() - loop_start)
 
             time.sleep(1)
 
         except Exception as e:
             print(f"[ERROR] {e}")
+            ERRORS.inc()
             time.sleep(1)
 
 
@@ -1,10 +1,12 @@
 import requests
 import json
+import os
 import time
-import csv
 from datetime import datetime
-from flask import Flask, request, jsonify
 from collections import deque
+from qos_metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram
+from qos_trace import TraceLog, TRACE_HEADER
+from telemetry_store import CSV_TIME_FORMAT, CsvLog, TelemetryStore, prepare_csv
 
 # Configuration
 RYU_REST_URL = "http://127.0.0.1:8080/qos/qos-policies"
@@ -12,37 +14,61 @@ HEADERS = {'Content-Type': 'application/json'}
 LOG_CSV_FILE = "decision_engine_log.csv"
 BW_OPTIMIZE_VALUE = 0.5  # Mbps
 MAX_BANDWIDTH = 10.0  # Mbps
-
-app = Flask(__name__)
+QOE_MAX_AGE = 3.0  # Seconds a receiver QoE report stays usable
+TELEMETRY_NAME = "engine"  # Rolled-up history: telemetry/engine/{1s,1m,1h}
+CSV_HEADER = ["Timestamp", "Total(Mbps)", "Video(Mbps)", "Download(Mbps)", "QoS On Flag",
+              "DL_BW_Limit(Mbps)", "Video_Loss(%)", "Event_Message"]
+QUEUE_DELAY_LIMIT_MS = 50.0  # Measured bottleneck queueing delay that counts as congestion
+
+# Decision mode: "fsm" (QoSManager state machine) or "allocator" (AllocatorManager, needs NumPy)
+ENGINE_MODE = os.environ.get("QOS_ENGINE_MODE", "fsm")
+
+# --- Allocator mode ---
+CLASS_PRIORITY = {"video": 20, "download": 10}  # YANG priority per class (weight, guarantee and meter id)
+TARGET_UTILIZATION = 0.95  # Share of MAX_BANDWIDTH handed out; the rest keeps the bottleneck queue drained
+DEMAND_HEADROOM = 0.1      # Demand of a class = measured rate + 10 %
+SATURATED_SHARE = 0.95     # A class at this share of its limit is held back by its meter: demand unbounded
+ALLOC_MIN_CHANGE = 0.1     # Mbps; smaller limit changes are not pushed
+
+# --- Metrics (exposed on GET /metrics) ---
+STATE_CODES = {"IDLE": 0, "ACTIVE": 1}
+ENGINE_STATE = Gauge('qos_engine_state', 'QoSManager state (0: IDLE, 1: ACTIVE)')
+DL_LIMIT = Gauge('qos_engine_download_limit_mbps', 'Current download bandwidth limit')
+VIDEO_LOSS = Gauge('qos_engine_video_loss_percent', 'Video loss moving average seen by the engine')
+QUEUE_DELAY = Gauge('qos_engine_queue_delay_ms', 'Measured bottleneck queueing delay seen by the engine')
+TRANSITIONS = Counter('qos_engine_state_transitions_total', 'QoSManager state transitions', ['from', 'to'])
+SAMPLES = Counter('qos_engine_samples_total', 'Metric samples received')
+UPDATE_TIME = Histogram('qos_engine_update_seconds', 'Time spent in QoSManager.update (decision path)')
+PUSH_TIME = Histogram('qos_engine_push_seconds', 'push_to_ryu round trip')
+PUSH_FAILURES = Counter('qos_engine_push_failures_total', 'Failed policy pushes to Ryu')
 
 # --- File initialization helpers ---
 def init_csv():
-    """Create the CSV header from scratch."""
-    # Always start fresh (overwrite)
-    with open(LOG_CSV_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "hh:mm:ss",
-            "Total(Mbps)",
-            "Video(Mbps)",
-            "Download(Mbps)",
-            "QoS On Flag",
-            "DL_BW_Limit(Mbps)",
-            "Video_Loss(%)",
-            "Event_Message"
-        ])
+    """Create the CSV header if the log is new; otherwise keep appending (rotated when too large)."""
+    prepare_csv(LOG_CSV_FILE, CSV_HEADER)
     print(f"[INIT] Decision Engine Log initialized: {LOG_CSV_FILE}")
 
 
 # --- QoS state manager ---
 class QoSManager:
-    def __init__(self):
+    def __init__(self, push_sink=None, trace_log=None):
+        # push_sink(policies, trace_id): delivers policies without HTTP (in-process mode inside
+        # QoSController, where it is apply_policies). None: PUT to Ryu's REST API.
+        # In-process, the per-sample print is dropped, log rows and messages wait for write_logs()
+        # (called off the stats handler), QoE comes from the /qoe pushes only.
+        self.push_sink = push_sink
+        self.verbose = push_sink is None
+        self.trace = trace_log if trace_log is not None else TraceLog()
+        self.notes = []  # Messages held back until write_logs() (in-process mode)
+
         self.state = "IDLE"          # State: IDLE, ACTIVE
         self.dl_bw_limit = MAX_BANDWIDTH    # Current download bandwidth limit (default 10 Mbps)
         self.last_action_time = 0    # Last QoS action timestamp
 
         # History for detecting persistent loss increase
         self.loss_history = deque(maxlen=3)
+        # History for detecting a standing queue at the bottleneck (measured by the controller's probes)
+        self.queue_delay_history = deque(maxlen=3)
 
         # QoS configuration constants
         self.MIN_BW = 1.0   # Minimum bandwidth limit (1 Mbps)
@@ -51,27 +77,91 @@ class QoSManager:
 
         self.max_vid_bps_avg = 0  # Maximum 10-second moving average video bandwidth
 
+        self.trace_id = None  # Trace id of the sample being processed (forwarded on pushes)
+        self.decided = False  # 'decision' already traced for this sample
+
+        # Latest receiver-side QoE report pushed directly by video_qoe_probe.py (POST /qoe)
+        self.latest_qoe = None
+
+        # Bounded history: 1 s / 1 min / 1 h rollups with per-tier retention
+        self.store = TelemetryStore(TELEMETRY_NAME, buffered=not self.verbose)
+        self.csv_log = CsvLog(LOG_CSV_FILE, CSV_HEADER, buffered=not self.verbose)
+
+        DL_LIMIT.set(self.dl_bw_limit)
+
+    def set_state(self, state):
+        """Change state and count the transition."""
+        if state != self.state:
+            TRANSITIONS.labels(self.state, state).inc()
+        self.state = state
+        ENGINE_STATE.set(STATE_CODES[state])
+
     def log_to_csv(self, timestamp, total_bps, vid_bps, dl_bps, qos_state, loss_ma, event_msg=""):
-        """Append the current state to the CSV log."""
+        """Append the current state to the CSV log and the telemetry rollups."""
+        self.store.add({"total_mbps": total_bps, "video_mbps": vid_bps, "download_mbps": dl_bps,
+                        "qos_on": qos_state, "download_limit_mbps": self.dl_bw_limit, "video_loss_percent": loss_ma})
         try:
-            with open(LOG_CSV_FILE, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    timestamp,
-                    round(total_bps, 2),
-                    round(vid_bps, 2),
-                    round(dl_bps, 2),
-                    qos_state,
-                    self.dl_bw_limit,
-                    round(loss_ma, 2),
-                    event_msg
-                ])
+            self.csv_log.append([
+                timestamp,
+                round(total_bps, 2),
+                round(vid_bps, 2),
+                round(dl_bps, 2),
+                qos_state,
+                self.dl_bw_limit,
+                round(loss_ma, 2),
+                event_msg
+            ])
         except Exception as e:
-            print(f"[LOG ERROR] Could not write to CSV: {e}")
+            self.report(f"[LOG ERROR] Could not write to CSV: {e}")
+
+    def write_logs(self, log=print):
+        """Write the buffered CSV rows and telemetry rollups, and hand the held-back messages to `log`."""
+        notes, self.notes = self.notes, []
+        for note in notes:
+            log(note)
+        try:
+            self.csv_log.write()
+            self.store.write()
+        except Exception as e:
+            log(f"[LOG ERROR] Could not write to CSV: {e}")
+
+    def report(self, message):
+        """Print now, or (in-process) keep it for write_logs()."""
+        if self.verbose:
+            print(message)
+        else:
+            self.notes.append(message)
+
+    def on_qoe(self, report):
+        self.latest_qoe = report
+
+    def current_qoe(self, metrics):
+        """QoE forwarded by current_network, else the last report pushed by the probe (if fresh)."""
+        qoe = metrics.get("qoe") or self.latest_qoe
+        if qoe and time.time() - qoe.get("time", 0) <= QOE_MAX_AGE:
+            return qoe
+        return None
 
     def update(self, metrics):
+        start = time.perf_counter()
+        self.trace_id = metrics.get("trace_id")
+        self.decided = False
+        try:
+            self._update(metrics)
+        finally:
+            UPDATE_TIME.observe(time.perf_counter() - start)
+            DL_LIMIT.set(self.dl_bw_limit)
+            self.record_decision()  # No push this sample: the decision ends here
+
+    def record_decision(self):
+        """Trace the 'decision' stage once per sample: before the push if there is one."""
+        if not self.decided:
+            self.decided = True
+            self.trace.record(self.trace_id, 'decision')
+
+    def _update(self, metrics):
         current_time = time.time()
-        timestamp_str = datetime.now().strftime("%H:%M:%S")
+        timestamp_str = datetime.now().strftime(CSV_TIME_FORMAT)
         qos_state = 0  # 0: IDLE, 1: ACTIVE
 
         # Extract values from metrics
@@ -83,13 +173,30 @@ class QoSManager:
         avg_dl_bps = metrics.get("download_mbps_10sec_avg", 0)
         total_bps = vid_bps + dl_bps
 
+        # Receiver-side QoE is ground truth: measured loss replaces the counter estimate
+        qoe = self.current_qoe(metrics)
+        is_stalling = False
+        if qoe:
+            if qoe.get("video_loss_percent") is not None:
+                loss_ma = qoe["video_loss_percent"]
+            is_stalling = qoe.get("stall_sec", 0) > 0
+
         # Update loss history
         self.loss_history.append(loss_ma)
+        SAMPLES.inc()
+        VIDEO_LOSS.set(loss_ma)
+
+        # Queueing delay (None until the controller has probe samples: never triggers)
+        queue_ms = metrics.get("queue_delay_ms")
+        self.queue_delay_history.append(queue_ms or 0.0)
+        if queue_ms is not None:
+            QUEUE_DELAY.set(queue_ms)
 
         # Event message placeholder for logging
         event_msg = "-"
 
-        print(f"[ENGINE] State:{self.state} | DLBW:{self.dl_bw_limit} Mbps | Loss(MA):{loss_ma}% | Vid:{vid_bps} Mbps (Vid_MAX:{self.max_vid_bps_avg} Mbps)")
+        if self.verbose:
+            print(f"[ENGINE] State:{self.state} | DLBW:{self.dl_bw_limit} Mbps | Loss(MA):{loss_ma}% | Vid:{vid_bps} Mbps (Vid_MAX:{self.max_vid_bps_avg} Mbps)")
 
         # Detect persistent video loss increase over ~3 seconds
         # Trigger if loss stays above 1% for three samples
@@ -99,6 +206,12 @@ class QoSManager:
             if all(l > 1.0 for l in self.loss_history):
                 is_loss_increasing = True
 
+        # Detect a standing queue: delay above the limit for three samples, before loss shows up
+        is_queue_building = False
+        if len(self.queue_delay_history) == 3:
+            if all(q > QUEUE_DELAY_LIMIT_MS for q in self.queue_delay_history):
+                is_queue_building = True
+
         # Detect more than 20% drop from the maximum 10-second moving average
         is_bw_drop = False
         if (self.max_vid_bps_avg < avg_vid_bps):
@@ -113,7 +226,7 @@ class QoSManager:
         # -> If either is below 0.1 Mbps, QoS is unnecessary
         if vid_bps < 0.1 or dl_bps < 0.1:
             if self.state != "IDLE":
-                print(">>> Traffic Missing (Video or Download). Reset QoS.")
+                self.report(">>> Traffic Missing (Video or Download). Reset QoS.")
                 event_msg = "QoS OFF"
                 qos_state = 0
                 self.reset_qos()
@@ -124,16 +237,23 @@ class QoSManager:
             self.log_to_csv(timestamp_str, total_bps, vid_bps, dl_bps, qos_state, loss_ma, event_msg)
             return
 
-        # Determine whether QoS intervention is needed (loss increase OR bandwidth drop)
-        need_qos_intervention = is_loss_increasing or is_bw_drop
+        # Determine whether QoS intervention is needed (loss increase OR bandwidth drop OR player stall OR queueing)
+        need_qos_intervention = is_loss_increasing or is_bw_drop or is_stalling or is_queue_building
 
         if self.state == "IDLE":
             # Start QoS when loss increases or bandwidth drops more than 20%
             if need_qos_intervention:
-                trigger_reason = "Loss Increasing" if is_loss_increasing else "BW Drop > 20%"
-                print(f">>> {trigger_reason} Detected. QoS ON. Set Download BW = 1 Mbps.")
+                if is_loss_increasing:
+                    trigger_reason = "Loss Increasing"
+                elif is_bw_drop:
+                    trigger_reason = "BW Drop > 20%"
+                elif is_queue_building:
+                    trigger_reason = "Queue Delay"
+                else:
+                    trigger_reason = "Player Stall"
+                self.report(f">>> {trigger_reason} Detected. QoS ON. Set Download BW = 1 Mbps.")
                 event_msg = "QoS ON (DL_BW=1Mbps)"
-                self.state = "ACTIVE"
+                self.set_state("ACTIVE")
                 qos_state = 1
                 self.dl_bw_limit = self.MIN_BW  # Enter with a strict 1 Mbps limit
                 self.apply_policy()
@@ -145,17 +265,17 @@ class QoSManager:
                 if need_qos_intervention:
                     if self.dl_bw_limit > self.MIN_BW:
                         self.dl_bw_limit -= BW_OPTIMIZE_VALUE
-                        print(f">>> Condition Bad. Decrease BW -> {self.dl_bw_limit} Mbps")
+                        self.report(f">>> Condition Bad. Decrease BW -> {self.dl_bw_limit} Mbps")
                         event_msg = "DL_BW Decreased"
                         self.apply_policy()
                     else:
-                        print(">>> BW at Minimum (1 Mbps). Maintaining.")
+                        self.report(">>> BW at Minimum (1 Mbps). Maintaining.")
                     # Reset timers after adjustments
                     self.last_action_time = current_time
                 else:
                     if self.dl_bw_limit >= self.MAX_BW:
                         # Above 9.5 Mbps and stable -> turn QoS off
-                        print(">>> DL BW > 9.5 Mbps & Stable. QoS OFF.")
+                        self.report(">>> DL BW > 9.5 Mbps & Stable. QoS OFF.")
                         event_msg = "QoS OFF"
                         qos_state = 0
                         self.reset_qos()
@@ -164,7 +284,7 @@ class QoSManager:
                     else:
                         # Increase only by the headroom left after video usage
                         if (self.dl_bw_limit < (MAX_BANDWIDTH - self.max_vid_bps_avg)):
-                            print(">>> Probing Success. Increasing BW...")
+                            self.report(">>> Probing Success. Increasing BW...")
                             event_msg = "DL_BW Increase"
                             self.probe_bandwidth()
                             # Reset timers after adjustments
@@ -180,7 +300,7 @@ class QoSManager:
         # Maintain probe state for the next tick
 
     def reset_qos(self):
-        self.state = "IDLE"
+        self.set_state("IDLE")
         self.dl_bw_limit = MAX_BANDWIDTH  # Default link speed
         # Send default policies
         policies = [
@@ -200,36 +320,142 @@ class QoSManager:
         self.push_to_ryu(policies)
 
     def push_to_ryu(self, policies):
+        self.record_decision()
+        self.trace.record(self.trace_id, 'push_sent')
+        start = time.perf_counter()
+
+        # In-process: hand the policy list straight to the controller (no JSON, no HTTP)
+        if self.push_sink is not None:
+            try:
+                self.push_sink(policies, self.trace_id)
+            except Exception as e:
+                self.report(f"[PUSH FAIL] {e}")
+                PUSH_FAILURES.inc()
+            finally:
+                PUSH_TIME.observe(time.perf_counter() - start)
+            return
+
         payload = {
             "qos-policies:qos-policies": {
                 "policy": policies
             }
         }
+        headers = HEADERS
+        if self.trace_id:
+            headers = dict(HEADERS, **{TRACE_HEADER: self.trace_id})
+
         try:
-            r = requests.put(RYU_REST_URL, json=payload, headers=HEADERS, timeout=1)
+            r = requests.put(RYU_REST_URL, json=payload, headers=headers, timeout=1)
             if r.status_code != 200:
                 print(f"[RYU ERROR] {r.text}")
+                PUSH_FAILURES.inc()
         except Exception as e:
             print(f"[RYU FAIL] {e}")
+            PUSH_FAILURES.inc()
+        finally:
+            PUSH_TIME.observe(time.perf_counter() - start)
+
+
+class AllocatorManager(QoSManager):
+    """
+    Alternative decision mode: every sample, MAX_BANDWIDTH is shared across CLASS_PRIORITY by
+    weighted max-min fairness (qos_allocator.allocate). Only classes held below their demand are
+    metered (at their share); the others run unmetered, so a class is never policed at its own
+    average rate. ACTIVE means some class is metered.
+    """
+
+    def __init__(self, push_sink=None, trace_log=None):
+        super(AllocatorManager, self).__init__(push_sink, trace_log)
+        import qos_allocator  # NumPy is only needed in this mode
+        self.allocator = qos_allocator
+        self.classes = list(CLASS_PRIORITY)
+        self.priority = [CLASS_PRIORITY[name] for name in self.classes]
+        self.limits = dict.fromkeys(self.classes, MAX_BANDWIDTH)  # Last pushed limits (Mbps)
+        self.metered = set()  # Classes with a meter on the switches
+
+    def demand(self, name, metrics):
+        # Offered rate (before the bottleneck) when the collector reports it
+        rate = max(metrics.get(f"{name}_tx_mbps", 0), metrics.get(f"{name}_mbps", 0))
+        if name in self.metered and rate >= self.limits[name] * SATURATED_SHARE:
+            return float('inf')
+        return rate * (1 + DEMAND_HEADROOM)
+
+    def _update(self, metrics):
+        timestamp_str = datetime.now().strftime(CSV_TIME_FORMAT)
+        vid_bps = metrics.get("video_mbps", 0)
+        dl_bps = metrics.get("download_mbps", 0)
+        loss_ma = metrics.get("video_loss_percent_ma", 0)
+        SAMPLES.inc()
+        VIDEO_LOSS.set(loss_ma)
+
+        demand = [self.demand(name, metrics) for name in self.classes]
+        alloc = self.allocator.allocate([MAX_BANDWIDTH * TARGET_UTILIZATION], [demand], self.priority)[0]
+        limits = {name: round(float(mbps), 2) for name, mbps in zip(self.classes, alloc)}
+        metered = {n for n, d in zip(self.classes, demand) if d > limits[n]}
+
+        self.set_state("ACTIVE" if metered else "IDLE")
+        if self.verbose:
+            print("[ENGINE] Allocator | " + " | ".join(
+                f"{n}: {limits[n] if n in metered else '-'} Mbps" for n in self.classes))
+
+        event_msg = "-"
+        if metered != self.metered or any(abs(limits[n] - self.limits[n]) >= ALLOC_MIN_CHANGE for n in metered):
+            self.limits = limits
+            self.metered = metered
+            self.dl_bw_limit = limits["download"] if "download" in metered else MAX_BANDWIDTH
+            self.push_to_ryu([{"name": n, "priority": CLASS_PRIORITY[n], "bandwidth-limit": limits[n]}
+                              for n in self.classes if n in metered])
+            event_msg = "ALLOC " + (" ".join(f"{n}={limits[n]}" for n in self.classes if n in metered) or "unmetered")
+
+        qos_state = STATE_CODES[self.state]
+        self.log_to_csv(timestamp_str, vid_bps + dl_bps, vid_bps, dl_bps, qos_state, loss_ma, event_msg)
+
+
+def create_manager(push_sink=None, mode=None, trace_log=None):
+    """Decision manager for QOS_ENGINE_MODE (or `mode`)."""
+    managers = {"fsm": QoSManager, "allocator": AllocatorManager}
+    mode = mode or ENGINE_MODE
+    if mode not in managers:
+        raise ValueError(f"Unknown engine mode '{mode}' (expected one of {sorted(managers)})")
+    return managers[mode](push_sink, trace_log)
+
+
+def create_app(qos_manager):
+    """Flask app of the standalone engine (imported here: the in-process controller needs no Flask)."""
+    from flask import Flask, Response, request, jsonify
+    app = Flask(__name__)
+
+    @app.route('/metrics', methods=['POST'])
+    def handle_metrics():
+        if not request.is_json:
+            return jsonify({"error": "No JSON"}), 400
 
+        metrics = request.get_json()
+        qos_manager.trace.record(metrics.get("trace_id"), 'engine_recv')
+        # Delegate decision to the QoS manager
+        qos_manager.update(metrics)
 
-# Instantiate manager
-qos_manager = QoSManager()
+        return jsonify({"status": "processed"}), 200
 
+    @app.route('/qoe', methods=['POST'])
+    def handle_qoe():
+        if not request.is_json:
+            return jsonify({"error": "No JSON"}), 400
 
-@app.route('/metrics', methods=['POST'])
-def handle_metrics():
-    if not request.is_json:
-        return jsonify({"error": "No JSON"}), 400
+        # Ground-truth QoE from the receiver probe (video_qoe_probe.py --engine-url)
+        qos_manager.on_qoe(request.get_json())
+        return jsonify({"status": "stored"}), 200
 
-    metrics = request.get_json()
-    # Delegate decision to the QoS manager
-    qos_manager.update(metrics)
+    @app.route('/metrics', methods=['GET'])
+    def export_metrics():
+        # Prometheus scrape endpoint (POST on the same path is the metric ingestion above)
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
-    return jsonify({"status": "processed"}), 200
+    return app
 
 
 if __name__ == '__main__':
     init_csv()  # Create CSV header at program start
-    print("--- Decision Engine Started on Port 5000 ---")
+    app = create_app(create_manager())
+    print(f"--- Decision Engine Started on Port 5000 (mode: {ENGINE_MODE}) ---")
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# heavy_hitters.py
+# Compact top-talker tracking for the QoS controller.
+# Space-Saving keeps at most `capacity` counters per traffic class, so memory stays
+# bounded no matter how many flows iperf (or anything else) opens.
+
+
+class SpaceSaving:
+    """
+    Space-Saving sketch (Metwally et al.).
+    Tracks the heaviest keys by weight using a fixed number of counters.
+    Each entry stores [count, error]; count - error is a guaranteed lower bound.
+    """
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.counters = {}  # key -> [count, error]
+
+    def update(self, key, weight=1):
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+            return
+
+        # Sketch is full: evict the smallest counter and inherit its count as error
+        min_key = min(self.counters, key=lambda k: self.counters[k][0])
+        min_count = self.counters.pop(min_key)[0]
+        self.counters[key] = [min_count + weight, min_count]
+
+    def decay(self, factor=0.5):
+        """Age all counters so the sketch follows current (not all-time) top talkers."""
+        for key in list(self.counters):
+            entry = self.counters[key]
+            entry[0] *= factor
+            entry[1] *= factor
+            if entry[0] < 1:
+                del self.counters[key]
+
+    def top(self, n=10):
+        """Return the n heaviest keys as (key, count, error), heaviest first."""
+        items = sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)
+        return [(key, entry[0], entry[1]) for key, entry in items[:n]]
+
+    def __len__(self):
+        return len(self.counters)
+
+
+class HeavyHitterTracker:
+    """
+    Per-class Space-Saving sketches fed with byte deltas of per-flow entries.
+    Keys are 5-tuples: (ipv4_src, ipv4_dst, ip_proto, l4_src, l4_dst).
+    """
+
+    def __init__(self, capacity=32, decay=0.5):
+        self.capacity = capacity
+        self.decay_factor = decay
+        self.sketches = {}     # class name -> SpaceSaving
+        self.last_bytes = {}   # (dpid, 5-tuple) -> last seen byte_count
+
+    def observe(self, dpid, cls, flow_key, byte_count):
+        """Feed the cumulative byte counter of one per-flow entry."""
+        prev = self.last_bytes.get((dpid, flow_key), 0)
+        self.last_bytes[(dpid, flow_key)] = byte_count
+        delta = byte_count - prev
+        if delta <= 0:
+            return
+
+        sketch = self.sketches.get(cls)
+        if sketch is None:
+            sketch = self.sketches[cls] = SpaceSaving(self.capacity)
+        sketch.update(flow_key, delta)
+
+    def forget(self, dpid, flow_key):
+        """Drop counter state of a flow entry that no longer exists on the switch."""
+        self.last_bytes.pop((dpid, flow_key), None)
+
+    def forget_datapath(self, dpid):
+        """Drop counter state of every flow entry of a switch (disconnect or resync)."""
+        for key in [k for k in self.last_bytes if k[0] == dpid]:
+            del self.last_bytes[key]
+
+    def tick(self):
+        """Close one measurement interval: age counters by the decay factor."""
+        for sketch in self.sketches.values():
+            sketch.decay(self.decay_factor)
+
+    def top(self, n=10, interval=1.0):
+        """
+        Return {class: [ {src, dst, sport, dport, bps, error_bps}, ... ]}.
+        Read after tick(): with decay factor d the steady-state counter is
+        bytes_per_interval * d / (1 - d).
+        """
+        d = self.decay_factor
+        scale = 8 * (1 - d) / (d * max(0.001, interval))
+        result = {}
+        for cls, sketch in self.sketches.items():
+            rows = []
+            for key, count, error in sketch.top(n):
+                src, dst, proto, sport, dport = key
+                rows.append({
+                    "src": src, "dst": dst, "proto": proto,
+                    "sport": sport, "dport": dport,
+                    "bps": round(count * scale),
+                    "error_bps": round(error * scale),
+                })
+            result[cls] = rows
+        return result
@@ -1,16 +1,194 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+import json
+import os
+import time
+
 from mininet.net import Mininet
 from mininet.node import RemoteController, OVSKernelSwitch
 from mininet.link import TCLink  # TC(Traffic Control) based link
 from mininet.cli import CLI      # CLI(Command Line Interface)
 from mininet.log import setLogLevel, info
 
+# QoE probe on the video user; its snapshot file is read by current_network.py
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+QOE_PROBE = os.path.join(SCRIPT_DIR, 'video_qoe_probe.py')
+QOE_JSON_FILE = os.path.join(SCRIPT_DIR, 'latest_qoe.json')
+VIDEO_GENERATOR = os.path.join(SCRIPT_DIR, 'traffic_video.py')
+ABR_GENERATOR = os.path.join(SCRIPT_DIR, 'traffic_video_abr.py')
+DOWNLOAD_GENERATOR = os.path.join(SCRIPT_DIR, 'traffic_file.py')
+
+VIDEO_PORT = 5001
+DOWNLOAD_PORT = 5002
+SHAPES = ("chain", "tree", "leaf-spine")
+
+# Default configuration: the original lab (h1, h2, vSrv, dSrv, s1 -10 Mbps- s2)
+DEFAULT_CONFIG = {
+    "video_users": 1,
+    "download_users": 1,
+    "video_servers": 1,
+    "download_servers": 1,
+    "bottlenecks": 1,        # K bottleneck links (meaning depends on the shape)
+    "shape": "chain",
+    "link": {"bw": 10},      # Default bottleneck link parameters (bw Mbps, delay '5ms', loss %)
+    "links": [],             # Optional per-bottleneck overrides, index i -> bottleneck i
+    "controller_ip": "127.0.0.1",
+    "controller_port": 6633,
+
+    # Headless mode: receivers and generators start automatically, no CLI
+    "headless": False,
+    "duration": 60,          # Seconds of traffic in headless mode
+    "video_mbps": 0,         # Per video server (UDP, traffic_video.py); 0 = none. The controller only counts TCP video
+    "abr_players": 1,        # Per video server (TCP, traffic_video_abr.py); at least 1 for the controller to see video
+    "download_flows": 10,    # Per download server (traffic_file.py)
+    "download_profile": "constant",
+}
+
+
+def host_ip(role, idx):
+    """
+    Address plan (10.0.0.0/16, one L2 segment). The first host of each role keeps its
+    original address so the traffic scripts' defaults still work.
+    """
+    legacy = {"video_user": "10.0.0.1", "download_user": "10.0.0.2",
+              "video_server": "10.0.0.10", "download_server": "10.0.0.20"}
+    subnet = {"video_user": 1, "download_user": 2, "video_server": 3, "download_server": 4}
+    if idx == 0:
+        return legacy[role]
+    return f"10.0.{subnet[role]}.{idx}"
+
+
+def server_name(role, idx):
+    """vSrv, vSrv2, ... / dSrv, dSrv2, ... (users are numbered globally: h1, h2, ...)."""
+    base = {"video_server": "vSrv", "download_server": "dSrv"}[role]
+    return base if idx == 0 else f"{base}{idx + 1}"
+
+
+def bottleneck_params(cfg, i):
+    params = dict(cfg["link"])
+    if i < len(cfg["links"]):
+        params.update(cfg["links"][i])
+    return params
 
-def video_download_topology():
+
+def build_topology(net, cfg):
+    """
+    Add switches, hosts and links for the configured shape.
+    Users always hang off s1 and servers off s2, so the controller's view of
+    s1 (after the bottleneck) and s2 (before the bottleneck) stays valid.
+
+      chain:      s1 - s3 - ... - s2        K bottleneck links in series
+      tree:       s1 = K parallel server-side subtrees: s2, s3, ... (servers spread over them)
+      leaf-spine: leaves s1 (users) and s2 (servers), K spines; each leaf-spine link is a bottleneck (STP on)
+
+    Returns {"video_users": [...], "download_users": [...], "video_servers": [...], "download_servers": [...]}.
     """
-    Topology overview:
+    k = max(1, cfg["bottlenecks"])
+    shape = cfg["shape"]
+    stp = shape == "leaf-spine"  # Only this shape has L2 loops
+
+    info(f'*** Adding switches ({shape}, {k} bottleneck link(s))\n')
+    s1 = net.addSwitch('s1', stp=stp)  # User-side switch
+    s2 = net.addSwitch('s2', stp=stp)  # Server-side switch
+    server_switches = [s2]
+
+    if shape == "chain":
+        # s1 - s3 - s4 - ... - s2: every hop is a bottleneck link
+        hops = [s1] + [net.addSwitch(f's{i + 3}') for i in range(k - 1)] + [s2]
+        for i, (a, b) in enumerate(zip(hops, hops[1:])):
+            net.addLink(a, b, **bottleneck_params(cfg, i))
+
+    elif shape == "tree":
+        # s1 fans out to K server-side switches over K bottleneck links
+        server_switches += [net.addSwitch(f's{i + 3}') for i in range(k - 1)]
+        for i, sw in enumerate(server_switches):
+            net.addLink(s1, sw, **bottleneck_params(cfg, i))
+
+    elif shape == "leaf-spine":
+        # Two leaves, K spines; STP keeps the L2 fabric loop-free for OFPP_NORMAL forwarding
+        for i in range(k):
+            spine = net.addSwitch(f's{i + 3}', stp=True)
+            net.addLink(s1, spine, **bottleneck_params(cfg, 2 * i))
+            net.addLink(spine, s2, **bottleneck_params(cfg, 2 * i + 1))
+
+    else:
+        raise ValueError(f"Unknown shape '{shape}' (expected one of {SHAPES})")
+
+    info('*** Adding hosts (users)\n')
+    hosts = {"video_users": [], "download_users": [], "video_servers": [], "download_servers": []}
+    user_no = 1
+    for role, count in (("video_user", cfg["video_users"]), ("download_user", cfg["download_users"])):
+        for idx in range(count):
+            h = net.addHost(f'h{user_no}', ip=f'{host_ip(role, idx)}/16')
+            net.addLink(h, s1)  # User <-> s1: ample bandwidth
+            hosts[role + "s"].append(h)
+            user_no += 1
+
+    info('*** Adding servers\n')
+    n = 0
+    for role, count in (("video_server", cfg["video_servers"]), ("download_server", cfg["download_servers"])):
+        for idx in range(count):
+            srv = net.addHost(server_name(role, idx), ip=f'{host_ip(role, idx)}/16')
+            # Servers <-> s2 (or spread over the tree's server-side switches): ample bandwidth
+            net.addLink(srv, server_switches[n % len(server_switches)])
+            hosts[role + "s"].append(srv)
+            n += 1
+
+    if len(server_switches) > 1:
+        # The controller sums the offered (tx) rate over these switches; by default it only reads s2
+        dpids = ",".join(str(int(sw.dpid, 16)) for sw in server_switches)
+        info(f'*** Servers spread over {len(server_switches)} switches: start ryu-manager with QOS_SERVER_DPIDS={dpids}\n')
+
+    return hosts
+
+
+def start_receivers(hosts, qoe_file=QOE_JSON_FILE):
+    info('*** Starting receivers on the users\n')
+    for i, h in enumerate(hosts["video_users"]):
+        # Video users: QoE probe on port 5001 (UDP video + TCP ABR)
+        # The first one writes latest_qoe.json for current_network.py
+        out = qoe_file if i == 0 else f'/tmp/qoe_{h.name}.json'
+        h.cmd(f'nohup python3 {QOE_PROBE} --port {VIDEO_PORT} --out {out} > /tmp/qoe_{h.name}.log 2>&1 &')
+        info(f'    - {h.name} ({h.IP()}): QoE probe on UDP/TCP port {VIDEO_PORT}\n')
+
+    for h in hosts["download_users"]:
+        # Download users: TCP sink on port 5002
+        h.cmd(f'nohup iperf -s -p {DOWNLOAD_PORT} > /tmp/iperf_{h.name}.log 2>&1 &')
+        info(f'    - {h.name} ({h.IP()}): Listening TCP on port {DOWNLOAD_PORT}\n')
+
+
+def start_generators(hosts, cfg):
+    """Start one generator per server, each aimed at a user of its class (round robin)."""
+    info('*** Starting traffic generators\n')
+    duration = cfg["duration"]
+    for i, srv in enumerate(hosts["video_servers"]):
+        if not hosts["video_users"]:
+            break
+        user = hosts["video_users"][i % len(hosts["video_users"])]
+        if cfg["video_mbps"]:
+            # Background UDP load only: invisible to the controller's TCP 5001 counters
+            srv.cmd(f'nohup python3 {VIDEO_GENERATOR} --target {user.IP()}:{VIDEO_PORT} '
+                    f'--mbps {cfg["video_mbps"]} --duration {duration} > /tmp/video_{srv.name}.log 2>&1 &')
+        if cfg["abr_players"]:
+            srv.cmd(f'nohup python3 {ABR_GENERATOR} --target {user.IP()}:{VIDEO_PORT} '
+                    f'--players {cfg["abr_players"]} --duration {duration} > /tmp/abr_{srv.name}.log 2>&1 &')
+        info(f'    - {srv.name} -> {user.name}: video {cfg["video_mbps"]} Mbps, {cfg["abr_players"]} ABR player(s)\n')
+
+    for i, srv in enumerate(hosts["download_servers"]):
+        if not hosts["download_users"]:
+            break
+        user = hosts["download_users"][i % len(hosts["download_users"])]
+        srv.cmd(f'nohup python3 {DOWNLOAD_GENERATOR} --target {user.IP()}:{DOWNLOAD_PORT} '
+                f'--flows {cfg["download_flows"]} --profile {cfg["download_profile"]} --duration {duration} '
+                f'--quiet --json /tmp/download_{srv.name}.json > /tmp/download_{srv.name}.log 2>&1 &')
+        info(f'    - {srv.name} -> {user.name}: {cfg["download_flows"]} download flow(s), {cfg["download_profile"]}\n')
+
+
+def video_download_topology(cfg=None):
+    """
+    Topology overview (default configuration):
       - h1: Video user (Video User)
       - h2: File download user (Download User)
       - vSrv: Video server (Video Server)
@@ -19,9 +197,11 @@ def video_download_topology():
       - s2: Switch near servers (Server Switch)
       - The link between s1 and s2 is a 10 Mbps bottleneck
 
-      All hosts use the same subnet (10.0.0.0/24) and the switches operate at L2,
+      All hosts use the same subnet (10.0.0.0/16) and the switches operate at L2,
       so routing is unnecessary for communication.
+      Counts, shape and link parameters come from `cfg` (see DEFAULT_CONFIG).
     """
+    cfg = dict(DEFAULT_CONFIG, **(cfg or {}))
 
     net = Mininet(
         controller=RemoteController,
@@ -34,70 +214,88 @@ def video_download_topology():
     info('*** Adding controller\n')
     # Assume the Ryu Controller runs on localhost (port 6633)
     # If using a different port (e.g., 6653), adjust here or in ryu-manager.
-    c0 = net.addController(
+    net.addController(
         'c0',
         controller=RemoteController,
-        ip='127.0.0.1',
-        port=6633
+        ip=cfg["controller_ip"],
+        port=cfg["controller_port"]
     )
 
-    info('*** Adding hosts (users)\n')
-    # Same LAN: 10.0.0.0/24
-    h1 = net.addHost('h1', ip='10.0.0.1/24')   # Video client
-    h2 = net.addHost('h2', ip='10.0.0.2/24')   # Download client
-
-    info('*** Adding servers\n')
-    vSrv = net.addHost('vSrv', ip='10.0.0.10/24')  # Video server
-    dSrv = net.addHost('dSrv', ip='10.0.0.20/24')  # Download server
+    hosts = build_topology(net, cfg)
 
-    info('*** Adding switches\n')
-    s1 = net.addSwitch('s1')  # User-side switch
-    s2 = net.addSwitch('s2')  # Server-side switch
+    info('*** Starting network\n')
+    net.start()
 
-    info('*** Creating links\n')
-    # User ↔ s1: > 100 Mbps (ample bandwidth)
-    net.addLink(h1, s1)
-    net.addLink(h2, s1)
+    # --- Automatically start receivers (QoE probe, iperf sink) ---
+    start_receivers(hosts)
 
-    # s1 ↔ s2: 10 Mbps bottleneck (congestion point)
-    net.addLink(s1, s2, bw=10)
+    if cfg["headless"]:
+        # Wait for STP (leaf-spine) and the controller's base flows before sending
+        if cfg["shape"] == "leaf-spine":
+            net.waitConnected()
+            time.sleep(35)
+        else:
+            time.sleep(3)
+        start_generators(hosts, cfg)
+        info(f'*** Headless run: {cfg["duration"]} sec of traffic\n')
+        time.sleep(cfg["duration"] + 5)
+    else:
+        info('*** Network is ready. Use "xterm vSrv dSrv" to generate traffic.\n')
+        CLI(net)   # Enter Mininet CLI
 
-    # Servers ↔ s2: > 100 Mbps (plenty of bandwidth on server side)
-    net.addLink(vSrv, s2)
-    net.addLink(dSrv, s2)
+    info('*** Stopping network\n')
+    net.stop()
 
-    info('*** Starting network\n')
-    net.start()
 
-    # --- Automatically start iperf receivers ---
-    # Prepare h1 and h2 to receive data.
-    info('*** Starting iperf servers (Receivers) on h1 (video user) and h2 (download user)\n')
+def load_config(args):
+    """Defaults <- config file (--config) <- explicit command-line arguments."""
+    cfg = dict(DEFAULT_CONFIG)
+    if args.config:
+        with open(args.config, 'r') as f:
+            cfg.update(json.load(f))
 
-    # h1 (Video User): TCP ABR listener (Port 5001)
-    # nc: netcat command
-    #  -l: Listen (server mode)
-    #  -k: Keep-alive (stay running after disconnect)
-    #  -p 5001: use port 5001
-    #  > /dev/null: discard received data
-    h1.cmd('nohup nc -lk -p 5001 > /dev/null 2>&1 &')
-    # h1.cmd('nohup iperf -s -p 5001 > /tmp/iperf_h1.log 2>&1 &')
+    overrides = {
+        "video_users": args.video_users, "download_users": args.download_users,
+        "video_servers": args.video_servers, "download_servers": args.download_servers,
+        "bottlenecks": args.bottlenecks, "shape": args.shape, "duration": args.duration,
+        "video_mbps": args.video_mbps, "abr_players": args.abr_players,
+        "download_flows": args.download_flows, "download_profile": args.download_profile,
+    }
+    cfg.update({k: v for k, v in overrides.items() if v is not None})
+    if args.headless:
+        cfg["headless"] = True
 
-    # h2 (Download User): TCP listener (Port 5002)
-    # -s: Server mode (receive)
-    # -p 5002: Port 5002
-    h2.cmd('nohup iperf -s -p 5002 > /tmp/iperf_h2.log 2>&1 &')
+    link = dict(cfg["link"])
+    for key, value in (("bw", args.bw), ("delay", args.delay), ("loss", args.loss)):
+        if value is not None:
+            link[key] = value
+    cfg["link"] = link
+    return cfg
 
-    info('*** iperf receivers started:\n')
-    info('    - h1 (Video User):   Listening TCP ABR on port 5001\n')
-    info('    - h2 (Download User): Listening TCP on port 5002\n')
 
-    info('*** Network is ready. Use "xterm vSrv dSrv" to generate traffic.\n')
-    CLI(net)   # Enter Mininet CLI
+def main():
+    parser = argparse.ArgumentParser(description="Video/download QoS topology (no arguments: original 2x2 lab with CLI)")
+    parser.add_argument("--config", help="JSON file with DEFAULT_CONFIG keys (per-link overrides in 'links')")
+    parser.add_argument("--video-users", type=int)
+    parser.add_argument("--download-users", type=int)
+    parser.add_argument("--video-servers", type=int)
+    parser.add_argument("--download-servers", type=int)
+    parser.add_argument("--bottlenecks", type=int, help="Number of bottleneck links (K)")
+    parser.add_argument("--shape", choices=SHAPES)
+    parser.add_argument("--bw", type=float, help="Bottleneck bandwidth (Mbps)")
+    parser.add_argument("--delay", help="Bottleneck delay, e.g. 5ms")
+    parser.add_argument("--loss", type=float, help="Bottleneck loss (%%)")
+    parser.add_argument("--headless", action="store_true", help="Start receivers and generators, no CLI")
+    parser.add_argument("--duration", type=float, help="Headless traffic duration (seconds)")
+    parser.add_argument("--video-mbps", type=float)
+    parser.add_argument("--abr-players", type=int)
+    parser.add_argument("--download-flows", type=int)
+    parser.add_argument("--download-profile", choices=("constant", "onoff", "pareto"))
+    args = parser.parse_args()
 
-    info('*** Stopping network\n')
-    net.stop()
+    video_download_topology(load_config(args))
 
 
 if __name__ == '__main__':
     setLogLevel('info')
-    video_download_topology()
+    main()
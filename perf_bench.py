@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# perf_bench.py
+# Offline micro-benchmarks for the hot paths of the QoS loop (no switch, no HTTP):
+#   - QoSController._flow_stats_reply_handler   flow-stats bodies of 10 .. 100k entries (single and multipart)
+#   - QoSController.apply_policies              policy batches of 1 .. 10k (cold install and no-op repush)
+#   - QoSManager.update                         long synthetic metric streams
+#   - qos_allocator.allocate                    water-filling over 10 .. 100k links (NumPy)
+#   - yang_parser                               model load and per-policy key validation
+#   - RestQoSController JSON                    policy PUT decode and /stats encode
+#
+# Datapaths are stubbed (messages are serialized like Ryu's Datapath.send_msg, then discarded).
+# Each benchmark reports ops/sec (median of repeats) and allocation peak per op (tracemalloc).
+#
+# Usage:
+#   python perf_bench.py --save-baseline perf_baseline.json
+#   python perf_bench.py --compare perf_baseline.json      (exit code 1 on regression)
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATS_SIZES = [10, 100, 1000, 10000, 100000]
+POLICY_SIZES = [1, 10, 100, 1000, 10000]
+METRIC_STREAM_LEN = 10000
+MULTIPART_ENTRIES = 500      # Flow entries per multipart part (OVS fills ~64 KiB messages)
+QUICK_LIMIT = 1000           # --quick: skip inputs larger than this
+MIN_TIME = 0.2               # Seconds per repeat (loops are calibrated to reach it)
+REPEATS = 5
+SPEED_TOLERANCE = 0.15       # Regression: ops/sec more than 15% below the baseline
+MEMORY_TOLERANCE = 0.25      # Regression: allocation peak more than 25% above the baseline
+
+
+# --- Harness ---
+def _timed(fn, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - start
+
+
+def measure(fn, min_time=MIN_TIME, repeats=REPEATS):
+    """pyperf-style: calibrate the loop count, then time `repeats` runs of it."""
+    loops = 1
+    while True:
+        elapsed = _timed(fn, loops)
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    per_op = [_timed(fn, loops) / loops for _ in range(repeats)]
+
+    # Allocation peak of a single call, measured separately (tracemalloc slows everything down)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    median = statistics.median(per_op)
+    return {
+        "ops_per_sec": round(1.0 / median, 2) if median > 0 else None,
+        "mean_us": round(statistics.mean(per_op) * 1e6, 3),
+        "stdev_us": round(statistics.stdev(per_op) * 1e6, 3) if len(per_op) > 1 else 0.0,
+        "loops": loops,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """The code under test prints on every call; keep the terminal (and the timings) clean."""
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        yield
+
+
+# --- Controller fixtures ---
+class StubDatapath:
+    """Minimal Ryu Datapath: real OF1.3 encoder, no socket."""
+
+    def __init__(self, dpid):
+        from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.sent = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.sent += 1
+
+
+class StubWSGI:
+    def register(self, controller, data):
+        pass
+
+
+class StubEvent:
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class StubMsg:
+    def __init__(self, datapath, body, flags=0, xid=0):
+        self.datapath = datapath
+        self.body = body
+        self.flags = flags
+        self.xid = xid
+
+
+def make_controller():
+    from ryu.lib import hub
+    import qos_ryu_app
+    with quiet():
+        app = qos_ryu_app.QoSController(wsgi=StubWSGI())
+    hub.kill(app.monitor_thread)  # No periodic FlowStats requests during the benchmark
+    for dpid in (1, 2):
+        dp = StubDatapath(dpid)
+        app.datapaths[dpid] = dp
+        app.install_base_flows(dp)
+    return app
+
+
+def flow_stats_body(n, dpid, rng):
+    """Base/QoS entries plus (n - 6) per-flow entries, as on the monitored switch."""
+    from ryu.ofproto import ofproto_v1_3_parser as parser
+    import qos_ryu_app as q
+
+    def stat(priority, cookie, nbytes, **match):
+        return parser.OFPFlowStats(table_id=0, duration_sec=10, duration_nsec=0, priority=priority,
+                                   idle_timeout=0, hard_timeout=0, flags=0, cookie=cookie,
+                                   packet_count=nbytes // 1400, byte_count=nbytes,
+                                   match=parser.OFPMatch(**match), instructions=[])
+
+    body = [
+        stat(0, q.make_cookie(q.COOKIE_BASE), 10_000),
+        stat(10, q.make_cookie(q.COOKIE_BASE), 1_000, eth_type=0x0806),
+        stat(5, q.make_cookie(q.COOKIE_BASE, "video"), 5_000_000, eth_type=0x0800, ip_proto=6, tcp_dst=5001),
+        stat(5, q.make_cookie(q.COOKIE_BASE, "download"), 9_000_000, eth_type=0x0800, ip_proto=6, tcp_dst=5002),
+        stat(120, q.make_cookie(q.COOKIE_QOS, "video"), 7_000_000, eth_type=0x0800, ip_proto=6, tcp_dst=5001),
+        stat(110, q.make_cookie(q.COOKIE_QOS, "download"), 8_000_000, eth_type=0x0800, ip_proto=6, tcp_dst=5002),
+    ]
+    for i in range(max(0, n - len(body))):
+        dport = 5001 if i % 4 == 0 else 5002
+        name = q.CLASS_BY_PORT[dport]
+        body.append(stat(q.HH_FLOW_PRIORITY, q.make_cookie(q.COOKIE_HH, name), rng.randint(1_000, 50_000_000),
+                         eth_type=0x0800, ip_proto=6, ipv4_src=f"10.0.{3 + i % 2}.{1 + i % 250}",
+                         ipv4_dst=f"10.0.{1 + i % 2}.{1 + (i // 250) % 250}",
+                         tcp_src=1024 + i % 60000, tcp_dst=dport))
+    return body[:n] if n < len(body) else body
+
+
+def policy_batch(n):
+    """Two class policies plus (n - 2) single-flow policies (the only kind that scales to thousands)."""
+    policies = [
+        {"name": "video", "priority": 20, "bandwidth-limit": 9.0},
+        {"name": "download", "priority": 10, "bandwidth-limit": 3.0},
+    ][:n]
+    for i in range(n - len(policies)):
+        policies.append({
+            "name": f"flow-{i}", "priority": 1 + i % 50, "bandwidth-limit": 1 + i % 5,
+            "match": {"class": "download", "ipv4-src": f"10.0.4.{1 + i % 250}", "ipv4-dst": "10.0.0.2",
+                      "tcp-src": 1024 + i, "tcp-dst": 5002},
+        })
+    return policies
+
+
+# --- Benchmarks ---
+def bench_flow_stats(sizes):
+    import qos_ryu_app as q
+    app = make_controller()
+    rng = random.Random(1)
+    results = {}
+    for n in sizes:
+        dp1, dp2 = app.datapaths[1], app.datapaths[2]
+        ev1 = StubEvent(StubMsg(dp1, flow_stats_body(min(n, 6), 1, rng)))
+        ev2 = StubEvent(StubMsg(dp2, flow_stats_body(n, 2, rng)))
+        app.hh_tracker = q.HeavyHitterTracker(capacity=q.HH_SKETCH_SIZE)
+        app.prev_stats.clear()
+        # Establish baselines so every measured call takes the full (rate + net_status) path
+        app._flow_stats_reply_handler(ev1)
+        app._flow_stats_reply_handler(ev2)
+        app._flow_stats_reply_handler(ev1)
+        results[f"flow_stats_handler[{n}]"] = measure(lambda: app._flow_stats_reply_handler(ev2))
+
+        # Same table as a multipart reply: parts are collected, the last one is processed
+        if n > MULTIPART_ENTRIES:
+            more = dp2.ofproto.OFPMPF_REPLY_MORE
+            body = ev2.msg.body
+            starts = range(0, n, MULTIPART_ENTRIES)
+            parts = [StubEvent(StubMsg(dp2, body[i:i + MULTIPART_ENTRIES], flags=0 if i == starts[-1] else more))
+                     for i in starts]
+
+            def run_parts():
+                for ev in parts:
+                    app._flow_stats_reply_handler(ev)
+            results[f"flow_stats_multipart[{n}]"] = measure(run_parts)
+    return results
+
+
+def bench_apply_policies(sizes):
+    app = make_controller()
+    results = {}
+    for n in sizes:
+        policies = policy_batch(n)
+
+        def cold():
+            # Fresh switches: every meter and flow is sent
+            for dp in app.datapaths.values():
+                app.installed_policies[dp.id] = {}
+                app.installed_meters[dp.id] = {}
+            app.apply_policies(policies)
+
+        with quiet():
+            results[f"apply_policies_cold[{n}]"] = measure(cold)
+            app.apply_policies(policies)
+            # Same set again: the diff must send nothing
+            results[f"apply_policies_repush[{n}]"] = measure(lambda: app.apply_policies(policies))
+    return results
+
+
+def metric_stream(n, rng):
+    """Video steady, download bursts with loss episodes, like the collector's 1 Hz samples."""
+    stream = []
+    for i in range(n):
+        burst = (i // 60) % 2 == 1
+        loss = rng.uniform(2, 15) if burst and (i % 60) < 20 else rng.uniform(0, 0.5)
+        video = max(0.0, 6 - (loss / 10) + rng.uniform(-0.3, 0.3))
+        download = rng.uniform(3, 8) if burst else rng.uniform(0, 0.05)
+        stream.append({
+            "timestamp": "00:00:00", "video_mbps": round(video, 2), "download_mbps": round(download, 2),
+            "video_loss_percent_ma": round(loss, 2), "raw_loss_percent": round(loss, 2), "delay_ms": 20.0,
+            "video_mbps_10sec_avg": round(video, 1), "download_mbps_10sec_avg": round(download, 1),
+            "trace_id": None,
+        })
+    return stream
+
+
+def bench_engine(length):
+    import decision_engine_push_to_ryu as engine
+    rng = random.Random(2)
+    stream = metric_stream(length, rng)
+
+    def run_stream():
+        pushes = []
+        # A push sink selects the in-process setup: CSV/telemetry rows stay buffered, no per-sample print,
+        # so the timing is the decision path and not disk I/O
+        manager = engine.QoSManager(push_sink=lambda policies, trace_id: None)
+        manager.push_to_ryu = pushes.append  # No HTTP: count pushes instead
+        manager.PROBE_INTERVAL = 0            # Samples arrive back-to-back, not at 1 Hz
+        for sample in stream:
+            manager.update(sample)
+        return len(pushes)
+
+    with quiet():
+        pushes = run_stream()
+        result = measure(run_stream, repeats=3)
+    # Report per sample, not per stream
+    for key in ("ops_per_sec",):
+        result[key] = round(result[key] * length, 2)
+    result["mean_us"] = round(result["mean_us"] / length, 3)
+    result["stdev_us"] = round(result["stdev_us"] / length, 3)
+    result["pushes_per_stream"] = pushes
+    return {f"qos_manager_update[{length} samples]": result}
+
+
+def bench_allocator(sizes):
+    import numpy as np
+    import qos_allocator
+    rng = np.random.default_rng(4)
+    results = {}
+    for n in sizes:
+        # Four classes per link, one of them elastic (unbounded demand)
+        capacity = np.full(n, 10.0)
+        demand = rng.uniform(0, 8, size=(n, 4))
+        demand[:, 0] = np.inf
+        priority = [10, 20, 30, 40]
+        results[f"allocate[{n} links]"] = measure(lambda: qos_allocator.allocate(capacity, demand, priority))
+    return results
+
+
+def bench_yang(sizes):
+    from yang_parser import get_required_policy_keys
+    results = {}
+    with quiet():
+        results["yang_load_model"] = measure(get_required_policy_keys, repeats=3)
+        required = get_required_policy_keys()
+    for n in sizes:
+        policies = policy_batch(n)
+        # Same check apply_policies runs on every push
+        results[f"yang_validate[{n}]"] = measure(
+            lambda: [required - set(p.keys()) for p in policies if not required.issubset(p.keys())])
+    return results
+
+
+def bench_rest_json(sizes):
+    import qos_ryu_app as q
+    results = {}
+    for n in sizes:
+        body = json.dumps({"qos-policies:qos-policies": {"policy": policy_batch(n)}}).encode('utf-8')
+        results[f"rest_decode_policies[{n}]"] = measure(
+            lambda: json.loads(body.decode('utf-8')).get('qos-policies:qos-policies', {}).get('policy', []))
+
+    app = make_controller()
+    rng = random.Random(3)
+    ev1 = StubEvent(StubMsg(app.datapaths[1], flow_stats_body(6, 1, rng)))
+    ev2 = StubEvent(StubMsg(app.datapaths[2], flow_stats_body(q.HH_MAX_FLOWS, 2, rng)))
+    for ev in (ev1, ev2, ev1, ev2):
+        app._flow_stats_reply_handler(ev)
+    app.net_status['flow_tables'] = {str(d): {'active': 1000, 'limit': q.FLOW_TABLE_LIMIT, 'occupancy': 0.5,
+                                              'hh_flows': 900} for d in (1, 2)}
+    results["rest_encode_stats"] = measure(lambda: json.dumps(app.net_status))
+    return results
+
+
+GROUPS = [
+    ("flow_stats", lambda quick: bench_flow_stats(limit(STATS_SIZES, quick))),
+    ("apply_policies", lambda quick: bench_apply_policies(limit(POLICY_SIZES, quick))),
+    ("engine", lambda quick: bench_engine(QUICK_LIMIT if quick else METRIC_STREAM_LEN)),
+    ("allocator", lambda quick: bench_allocator(limit(STATS_SIZES, quick))),
+    ("yang", lambda quick: bench_yang(limit(POLICY_SIZES, quick))),
+    ("rest_json", lambda quick: bench_rest_json(limit(POLICY_SIZES, quick))),
+]
+
+
+def limit(sizes, quick):
+    return [n for n in sizes if not quick or n <= QUICK_LIMIT]
+
+
+# --- Baseline comparison ---
+def compare(results, baseline, tolerance=SPEED_TOLERANCE):
+    """Returns the list of regressions (benchmarks missing from the baseline are ignored)."""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("ops_per_sec") or not cur.get("ops_per_sec"):
+            continue
+        speed = cur["ops_per_sec"] / base["ops_per_sec"] - 1
+        cur["vs_baseline_speed"] = round(speed, 3)
+        if speed < -tolerance:
+            regressions.append(f"{name}: {cur['ops_per_sec']:.1f} ops/s vs {base['ops_per_sec']:.1f} ({speed:+.0%})")
+        if base.get("peak_kib") and cur["peak_kib"] > base["peak_kib"] * (1 + MEMORY_TOLERANCE) and cur["peak_kib"] > 64:
+            regressions.append(f"{name}: peak {cur['peak_kib']:.0f} KiB vs {base['peak_kib']:.0f} KiB")
+    return regressions
+
+
+def print_results(results):
+    print("-" * 96)
+    print(f"{'Benchmark':<44} | {'ops/sec':>12} | {'mean(us)':>12} | {'stdev(us)':>10} | {'peak(KiB)':>9}")
+    print("-" * 96)
+    for name, r in results.items():
+        if "skipped" in r:
+            print(f"{name:<44} | skipped: {r['skipped']}")
+            continue
+        delta = f"  ({r['vs_baseline_speed']:+.0%})" if "vs_baseline_speed" in r else ""
+        print(f"{name:<44} | {r['ops_per_sec']:>12,.1f} | {r['mean_us']:>12,.1f} | {r['stdev_us']:>10,.1f} | "
+              f"{r['peak_kib']:>9,.1f}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks of the QoS hot paths")
+    parser.add_argument("--filter", help="Only run groups whose name contains this text "
+                                         f"({', '.join(g for g, _ in GROUPS)})")
+    parser.add_argument("--quick", action="store_true", help=f"Inputs up to {QUICK_LIMIT} only")
+    parser.add_argument("--json", help="Write all results to this file")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Store the results as the new baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Flag regressions against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=SPEED_TOLERANCE,
+                        help="Allowed ops/sec drop before a benchmark counts as regressed (fraction)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    out_paths = [os.path.abspath(p) if p else None for p in (args.json, args.save_baseline)]
+
+    # The code under test writes state/trace/CSV files into the working directory
+    sys.path.insert(0, SCRIPT_DIR)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="qos_perf_")
+    os.chdir(workdir)
+
+    results = {}
+    try:
+        for group, run in GROUPS:
+            if args.filter and args.filter not in group:
+                continue
+            print(f"[BENCH] {group} ...", flush=True)
+            try:
+                results.update(run(args.quick))
+            except ImportError as e:
+                # Optional dependency of that component (ryu, flask, pyang, numpy) not installed
+                results[group] = {"skipped": str(e)}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    print_results(results)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    json_path, baseline_path = out_paths
+    for path in (json_path, baseline_path):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"[BENCH] Results written to {path}")
+
+    if regressions:
+        print(f"\n[REGRESSION] {len(regressions)} benchmark(s) slower or larger than {args.compare}:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    elif baseline:
+        print(f"\n[OK] No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
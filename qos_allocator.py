@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# qos_allocator.py
+# Weighted max-min (water-filling) bandwidth allocation for N traffic classes on L links.
+# Every array is (links, classes), so one call allocates the whole network at once.
+#
+# Per link:
+#   1. Each class gets its guarantee first (scaled down if the guarantees exceed the capacity).
+#   2. The rest is water-filled: the level rises until the capacity is used, class c receiving
+#      min(residual demand_c, weight_c * level). Classes below the level are fully served.
+#   3. Capacity nobody asked for is spread by weight, so limits never strand bandwidth
+#      (an elastic class can only show more demand if its meter lets it).
+#
+# Weights and guarantees come from the YANG policy priority (see allocate()).
+
+import numpy as np
+
+GUARANTEE_PER_PRIORITY = 0.01  # Share of the link capacity guaranteed per priority point (10 -> 10 %)
+
+
+def water_fill(capacity, demand, weight, guarantee):
+    """
+    capacity: (L,) Mbps; demand, weight, guarantee: (L, C) (or (C,), broadcast to every link).
+    demand may be np.inf for classes that take whatever they get. weight must be > 0.
+    Returns the (L, C) allocation in Mbps; each row sums to its capacity.
+    """
+    capacity = np.asarray(capacity, dtype=float)
+    links = capacity.shape[0]
+    demand = np.broadcast_to(np.asarray(demand, dtype=float), (links, np.shape(demand)[-1]))
+    weight = np.broadcast_to(np.asarray(weight, dtype=float), demand.shape)
+    guarantee = np.broadcast_to(np.asarray(guarantee, dtype=float), demand.shape)
+    rows = np.arange(links)
+
+    # 1. Guarantees (reserved even while the class is idle: meters cannot lend bandwidth back)
+    reserved = guarantee.sum(axis=1)
+    scale = np.minimum(1.0, capacity / np.maximum(reserved, 1e-12))
+    base = guarantee * scale[:, None]
+    residual = capacity - base.sum(axis=1)
+    need = np.maximum(demand - base, 0.0)
+
+    # 2. Water level: visit classes by need/weight; at the k-th breakpoint the fill is
+    #    sum(need of classes before k) + ratio_k * sum(weight of classes from k on)
+    ratio = need / weight
+    order = np.argsort(ratio, axis=1)
+    ratio_s = np.take_along_axis(ratio, order, axis=1)
+    need_s = np.take_along_axis(need, order, axis=1)
+    weight_s = np.take_along_axis(weight, order, axis=1)
+    need_before = np.concatenate([np.zeros((links, 1)), np.cumsum(need_s[:, :-1], axis=1)], axis=1)
+    weight_from = np.cumsum(weight_s[:, ::-1], axis=1)[:, ::-1]
+    filled = need_before + ratio_s * weight_from
+
+    full = filled >= residual[:, None]
+    k = np.argmax(full, axis=1)
+    level = (residual - need_before[rows, k]) / weight_from[rows, k]
+    level[~full.any(axis=1)] = np.inf  # Every demand fits
+    share = np.minimum(need, weight * level[:, None])
+
+    # 3. Leftover (only when every demand fits) goes out by weight
+    leftover = np.maximum(residual - share.sum(axis=1), 0.0)
+    share += weight * (leftover / weight.sum(axis=1))[:, None]
+    return base + share
+
+
+def allocate(capacity, demand, priority):
+    """
+    Meter limits from YANG priorities: weight = priority,
+    guarantee = priority * GUARANTEE_PER_PRIORITY of the link capacity.
+    """
+    capacity = np.asarray(capacity, dtype=float)
+    weight = np.maximum(np.asarray(priority, dtype=float), 1.0)
+    guarantee = weight * GUARANTEE_PER_PRIORITY * capacity[:, None]
+    return water_fill(capacity, demand, weight, guarantee)
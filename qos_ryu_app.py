@@ -4,30 +4,148 @@ from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib.packet import packet, ipv4, tcp
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 from webob import Response
+import itertools
 import json
+import os
+import struct
 import time
 
 # Import YANG model parser
 from yang_parser import get_required_policy_keys
+from heavy_hitters import HeavyHitterTracker
+from qos_metrics import REGISTRY, Counter, Gauge, Histogram
+from qos_trace import TraceLog, new_trace_id, TRACE_HEADER
 
 # --- Configuration ---
 # Matches the Decision Engine (Client) endpoint URL (http://.../qos/qos-policies)
 REST_URL = '/qos/qos-policies'
 STATS_URL = '/stats'
+METRICS_URL = '/metrics'
+QOE_URL = '/qoe'  # In-process engine: video_qoe_probe.py --engine-url http://<controller>:8080/qoe
+
+# Desired policy state, replayed when a switch (or the controller) restarts
+POLICY_STATE_FILE = "qos_policy_state.json"
+
+# In-process engine: current_network's metric computation and the QoSManager run inside the
+# controller, fed from the FlowStats handler and pushing through apply_policies (no HTTP hops).
+# The REST API stays up for remote use; do not also run current_network.py/the Flask engine.
+ENGINE_INPROCESS = os.environ.get("QOS_ENGINE_INPROCESS", "0") == "1"
+ENGINE_LOG_INTERVAL = 5  # Seconds between writes of the in-process engine's buffered CSV/telemetry rows
 
 # Port mapping (Mininet: vSrv->5001, dSrv->5002)
 POLICY_PORT_MAP = {
     "video": 5001,
     "download": 5002
 }
+CLASS_BY_PORT = {port: name for name, port in POLICY_PORT_MAP.items()}
+
+MONITOR_INTERVAL = 1  # seconds between FlowStats requests
+STATS_TIMEOUT = 5 * MONITOR_INTERVAL  # Seconds an unanswered FlowStats request is kept for its reply
+
+# Received rate is read on the user-side switch (s1), offered rate on the server-side switches.
+# Mininet's tree shape spreads the servers over s2..s(K+1): start the controller with
+# QOS_SERVER_DPIDS=2,3,... so their tx is summed (mininet_topo.py prints the value to use).
+USER_DPID = 1
+SERVER_DPIDS = tuple(int(d) for d in os.environ.get("QOS_SERVER_DPIDS", "2").split(","))
+
+# --- Heavy-hitter (per-flow) monitoring ---
+# Only the server-side switch (s2) is monitored: it sees the offered load before the bottleneck.
+FLOW_MONITOR_DPID = 2
+HH_PUNT_PRIORITY = 250      # Copies the first packets of an unknown flow to the controller
+HH_FLOW_PRIORITY = 260      # Exact 5-tuple entries installed from PacketIn
+HH_POLICY_PRIORITY = 300    # Base priority of policies targeting a single flow
+HH_IDLE_TIMEOUT = 10        # Per-flow entries expire after 10 s without traffic
+HH_MAX_FLOWS = 1000         # Cap on per-flow entries per switch (flow-table budget)
+HH_PUNT_RESUME = 0.9        # Punting resumes once per-flow entries drop below this share of the cap
+HH_SKETCH_SIZE = 32         # Space-Saving counters per class
+HH_TOP_K = 5                # Top talkers reported on /stats
+HH_POLICY_IDLE_TIMEOUT = 30 # Single-flow policies are reclaimed once the flow goes quiet
+FLOW_METER_BASE = 256       # Single-flow policy meters start above every class meter id (uint8 priority)
+
+# --- Flow-table lifecycle ---
+# Cookie layout: owner in the top byte, traffic class index in the low byte.
+COOKIE_OWNER_SHIFT = 56
+COOKIE_OWNER_MASK = 0xff << COOKIE_OWNER_SHIFT
+COOKIE_BASE = 0x01        # ARP/ICMP, monitoring and default flows
+COOKIE_QOS = 0x02         # Class flows installed by apply_policies
+COOKIE_HH = 0x03          # Heavy-hitter punt and per-flow entries
+COOKIE_HH_POLICY = 0x04   # Policies targeting a single flow
+CLASS_INDEX = {name: i + 1 for i, name in enumerate(POLICY_PORT_MAP)}
+CLASS_BY_INDEX = {i: name for name, i in CLASS_INDEX.items()}
+
+TABLE_STATS_INTERVAL = 10  # Monitor ticks between OFPTableStats requests
+FLOW_TABLE_LIMIT = 2000    # Flow entries the switch can hold (TCAM/flow-table budget)
+FLOW_TABLE_HIGH_WATER = 0.8  # Warn and stop installing per-flow entries above this occupancy
+
+# --- Link delay probing ---
+# Every switch floods a timestamped probe frame (PacketOut, NORMAL); its neighbours punt it back.
+# One-way link delay = probe transit - half the echo RTT of both control channels.
+PROBE_ETHERTYPE = 0x88b5        # IEEE 802 local experimental ethertype
+PROBE_PRIORITY = 1000           # Above every QoS and heavy-hitter entry: probes are never forwarded on
+PROBE_INTERVAL = 2              # Monitor ticks between probe rounds
+PROBE_TIMEOUT = 2.0             # Seconds after which a probe no longer counts (lost or stale)
+PROBE_MAX_PACKET_INS = 64       # Probe PacketIns handled per round; the rest are dropped
+PROBE_EWMA = 0.3                # Weight of a new sample in the smoothed delay
+PROBE_BASE_HORIZON = 600.0      # Seconds for the base (propagation) delay to follow a rise, e.g. a route change
+PROBE_IDLE_BPS = 100e3          # Base may only rise while the monitored classes carry less than this
+PROBE_PAYLOAD = struct.Struct('!QIQ')  # sender dpid, round, send time (monotonic ns)
+ECHO_PAYLOAD = struct.Struct('!Q')     # send time (monotonic ns)
+
+
+# --- Metrics (exposed on /metrics) ---
+STATS_RTT = Histogram('qos_stats_round_trip_seconds', 'FlowStats request to reply latency', ['dpid'])
+STATS_HANDLER_TIME = Histogram('qos_stats_handler_seconds', 'Time spent processing one FlowStats reply')
+STATS_PARTS = Histogram('qos_stats_reply_parts', 'Multipart messages per FlowStats reply',
+                        buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+STATS_STALE = Counter('qos_stats_stale_replies_total',
+                      'FlowStats requests given up (timed out, or answered after a newer request)', ['dpid'])
+APPLY_POLICIES_TIME = Histogram('qos_apply_policies_seconds', 'Time spent in apply_policies')
+CLASS_RATE = Gauge('qos_class_rate_bps', 'Per-class rate (rx: after bottleneck s1, tx: before bottleneck s2)', ['class', 'direction'])
+CLASS_LOSS = Gauge('qos_class_loss_bps', 'Per-class loss across the bottleneck', ['class'])
+METER_LIMIT = Gauge('qos_meter_limit_kbps', 'Meter rate installed on the switch', ['dpid', 'meter_id'])
+FLOW_MODS = Counter('qos_flow_mods_total', 'OFPFlowMod messages sent', ['dpid'])
+METER_MODS = Counter('qos_meter_mods_total', 'OFPMeterMod messages sent', ['dpid'])
+PACKET_INS = Counter('qos_packet_in_total', 'OFPPacketIn messages handled')
+FLOWS_REMOVED = Counter('qos_flow_removed_total', 'OFPFlowRemoved messages handled', ['owner'])
+FLOW_TABLE_ACTIVE = Gauge('qos_flow_table_active_entries', 'Active flow entries reported by OFPTableStats', ['dpid'])
+HH_FLOWS = Gauge('qos_heavy_hitter_flows', 'Per-flow monitoring entries installed', ['dpid'])
+RESYNCS = Counter('qos_resyncs_total', 'Switch state resyncs after (re)connect', ['dpid'])
+POLICY_PUSHES = Counter('qos_policy_pushes_total', 'Policy sets received from the decision engine')
+LINK_DELAY = Gauge('qos_link_delay_ms', 'Smoothed one-way link delay from active probes', ['link'])
+QUEUE_DELAY = Gauge('qos_link_queue_delay_ms', 'Link delay above its recent minimum (queueing)', ['link'])
+ECHO_RTT = Histogram('qos_echo_rtt_seconds', 'OFPT_ECHO round trip of the control channel', ['dpid'])
+PROBES_SENT = Counter('qos_probes_sent_total', 'Delay probes sent with PacketOut', ['dpid'])
+PROBES_DROPPED = Counter('qos_probes_dropped_total', 'Probe PacketIns ignored (stale or over the per-round cap)')
+ENGINE_TICK_TIME = Histogram('qos_inprocess_engine_seconds', 'Metric computation and decision per tick (in-process engine)')
+
+
+def make_cookie(owner, name=None):
+    return (owner << COOKIE_OWNER_SHIFT) | CLASS_INDEX.get(name, 0)
+
+
+def cookie_owner(cookie):
+    return (cookie & COOKIE_OWNER_MASK) >> COOKIE_OWNER_SHIFT
+
+
+def cookie_class(cookie):
+    return CLASS_BY_INDEX.get(cookie & 0xff)
 
 
 def mbps_to_kbps(mbps):
     return int(mbps * 1000)
 
 
+def probe_frame(dpid, round_no):
+    """Broadcast Ethernet frame carrying the sender dpid, the probe round and the send time."""
+    src_mac = b'\x02' + (dpid & 0xffffffffff).to_bytes(5, 'big')  # Locally administered
+    payload = PROBE_PAYLOAD.pack(dpid, round_no, time.monotonic_ns())
+    frame = b'\xff' * 6 + src_mac + struct.pack('!H', PROBE_ETHERTYPE) + payload
+    return frame.ljust(60, b'\0')  # Minimum Ethernet frame size
+
+
 class QoSController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
     _CONTEXTS = { 'wsgi': WSGIApplication }
@@ -49,16 +167,84 @@ class QoSController(app_manager.RyuApp):
 
         # Statistics storage
         self.prev_stats = {}
+        self.stats_sent = {}   # dpid -> {xid: (monotonic send time, trace id)} of outstanding FlowStats requests
+        self.stats_parts = {}  # dpid -> {xid: [entries so far, parts so far]} while OFPMPF_REPLY_MORE parts arrive
+
+        # Control-loop tracing (one trace id per monitor tick)
+        # In-process engine: records are buffered and written by _write_engine_logs
+        self.trace = TraceLog(buffered=ENGINE_INPROCESS)
+
+        # Desired policy state (last accepted push) and switches still being resynced
+        self.desired_policies = self._load_policy_state()
+        self.policy_state_dirty = False  # In-process engine: desired_policies not yet saved
+        self.resyncing = set()  # dpids waiting for the barrier that closes the resync batch
+
+        # Heavy-hitter state: per-flow entries installed per switch and top-talker sketches
+        self.hh_flows = {}  # dpid -> {5-tuple: class name}
+        self.hh_punting = {}  # dpid -> False while punt entries are downgraded to NORMAL only (at the cap)
+        self.hh_tracker = HeavyHitterTracker(capacity=HH_SKETCH_SIZE)
+        self.class_meters = {}  # class name -> meter id currently applied to that class
+        self.flow_meters = {}   # single-flow policy name -> its own meter id (FLOW_METER_BASE and up)
+
+        # Flow lifecycle state per switch
+        self.installed_policies = {}  # dpid -> {policy name: (priority, match fields, meter id)}
+        self.installed_meters = {}    # dpid -> {meter id: kbps}
+        self.retired_bytes = {}       # dpid -> {class name: bytes of expired per-flow entries}
+        self.table_stats = {}         # dpid -> {'active': n, 'lookup': n, 'matched': n}
+        self.monitor_ticks = 0
+
+        # Active delay measurement
+        self.probe_round = 0
+        self.probe_packet_ins = 0  # Probe PacketIns handled in the current round
+        self.echo_rtt = {}         # dpid -> smoothed control-channel RTT (seconds)
+        self.link_delay = {}       # (src dpid, dst dpid) -> {'delay', 'last', 'base', 'samples', 'time'}
 
         # Processed network state
         self.net_status = {
             "video_bps": 0, "download_bps": 0,
             "video_tx_bps": 0, "download_tx_bps": 0,
-            "video_loss": 0, "total_bps": 0
+            "video_loss": 0, "total_bps": 0,
+            "heavy_hitters": {},
+            "flow_tables": {},
+            "link_delay": {},       # "src-dst" -> measured one-way delay of that switch-to-switch link
+            "control_rtt_ms": {}    # dpid -> echo RTT of the OpenFlow channel
         }
 
+        # In-process collector + decision engine (None: external current_network.py and Flask engine)
+        self.collector = None
+        self.qos_manager = None
+        self.engine_trace_id = None  # Last tick handed to the in-process engine
+        if ENGINE_INPROCESS:
+            self._start_inprocess_engine()
+
+    def _start_inprocess_engine(self):
+        from current_network import MetricsCollector, init_files
+        import decision_engine_push_to_ryu as engine
+        init_files()
+        engine.init_csv()
+        # No JSON snapshot, QoE file or per-sample print inside the stats handler; rows are buffered
+        self.collector = MetricsCollector(write_json=False, read_qoe_file=False, buffered=True, verbose=False)
+        self.qos_manager = engine.create_manager(push_sink=self.apply_policies, trace_log=self.trace)
+        self.log_thread = hub.spawn(self._write_engine_logs)
+        self.logger.info(f"[ENGINE] In-process decision engine enabled (mode: {engine.ENGINE_MODE})")
+
+    def _write_engine_logs(self):
+        """Writes the in-process engine's logs, trace records and policy state in batches, outside the stats handler."""
+        while True:
+            hub.sleep(ENGINE_LOG_INTERVAL)
+            try:
+                if self.policy_state_dirty:
+                    self.policy_state_dirty = False
+                    self._save_policy_state()
+                self.trace.flush()
+                self.collector.write_logs()
+                self.qos_manager.write_logs(self.logger.info)
+            except Exception as e:
+                self.logger.error(f"[ENGINE] Log write failed: {e}")
+
     # --- Flow helper ---
-    def add_flow(self, datapath, priority, match, actions, meter_id=None):
+    def add_flow(self, datapath, priority, match, actions, meter_id=None,
+                 cookie=0, idle_timeout=0, hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -69,9 +255,48 @@ class QoSController(app_manager.RyuApp):
         if meter_id:
             inst.insert(0, parser.OFPInstructionMeter(meter_id))
 
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
+        # Entries that can expire report back so their counters and state are reclaimed
+        flags = 0
+        if idle_timeout or hard_timeout:
+            flags = ofproto.OFPFF_SEND_FLOW_REM
+
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, priority=priority,
+                                match=match, instructions=inst, flags=flags,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout)
         datapath.send_msg(mod)
+        FLOW_MODS.labels(str(datapath.id)).inc()
+
+    def del_flow(self, datapath, priority, match):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                priority=priority, match=match,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY)
+        datapath.send_msg(mod)
+        FLOW_MODS.labels(str(datapath.id)).inc()
+
+    # --- Desired state persistence ---
+    def _load_policy_state(self):
+        try:
+            with open(POLICY_STATE_FILE, 'r') as f:
+                policies = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.error(f"[STATE] Could not read {POLICY_STATE_FILE}: {e}")
+            return {}
+        self.logger.info(f"[STATE] Restored {len(policies)} policies from {POLICY_STATE_FILE}")
+        return policies
+
+    def _save_policy_state(self):
+        # Write-then-rename so a crash never leaves a truncated state file
+        tmp_file = POLICY_STATE_FILE + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.desired_policies, f, indent=2)
+            os.replace(tmp_file, POLICY_STATE_FILE)
+        except Exception as e:
+            self.logger.error(f"[STATE] Could not write {POLICY_STATE_FILE}: {e}")
 
     # --- Base and monitoring flows ---
     def install_base_flows(self, dp):
@@ -81,69 +306,474 @@ class QoSController(app_manager.RyuApp):
         # Shared action: Normal forwarding
         actions_normal = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
 
+        # Fresh lifecycle state: the switch only holds what we install from here on
+        self.installed_policies[dp.id] = {}
+        self.installed_meters[dp.id] = {}
+        self.retired_bytes[dp.id] = {}
+        cookie = make_cookie(COOKIE_BASE)
+
         # 1. Allow ARP and ICMP (Priority 10)
-        self.add_flow(dp, 10, parser.OFPMatch(eth_type=0x0806), actions_normal)
-        self.add_flow(dp, 10, parser.OFPMatch(eth_type=0x0800, ip_proto=1), actions_normal)
+        self.add_flow(dp, 10, parser.OFPMatch(eth_type=0x0806), actions_normal, cookie=cookie)
+        self.add_flow(dp, 10, parser.OFPMatch(eth_type=0x0800, ip_proto=1), actions_normal, cookie=cookie)
 
         # 2. Monitoring flows (Priority 5)
         # Separate traffic for statistics while still forwarding normally
         match_video = parser.OFPMatch(eth_type=0x0800, ip_proto=6, tcp_dst=5001)
-        self.add_flow(dp, 5, match_video, actions_normal)
+        self.add_flow(dp, 5, match_video, actions_normal, cookie=make_cookie(COOKIE_BASE, "video"))
 
         match_download = parser.OFPMatch(eth_type=0x0800, ip_proto=6, tcp_dst=5002)
-        self.add_flow(dp, 5, match_download, actions_normal)
+        self.add_flow(dp, 5, match_download, actions_normal, cookie=make_cookie(COOKIE_BASE, "download"))
 
         # 3. Default: Normal forwarding (Priority 0)
-        self.add_flow(dp, 0, parser.OFPMatch(), actions_normal)
+        self.add_flow(dp, 0, parser.OFPMatch(), actions_normal, cookie=cookie)
+
+        # 4. Delay probes from neighbouring switches go to the controller only (Priority 1000)
+        probe_actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+        self.add_flow(dp, PROBE_PRIORITY, parser.OFPMatch(eth_type=PROBE_ETHERTYPE), probe_actions, cookie=cookie)
+
+        # 5. Heavy-hitter punt flows (Priority 250, monitored switch only)
+        if dp.id == FLOW_MONITOR_DPID:
+            self.hh_flows[dp.id] = {}
+            self.hh_punting[dp.id] = True
+            for name in POLICY_PORT_MAP:
+                self.install_punt_flow(dp, name)
 
         self.logger.info(f"Initialized Switch: {dp.id} (Monitoring Flows Installed)")
 
+    def resync_datapath(self, dp):
+        """
+        Replay the desired state on a (re)connected switch in one batch:
+        flush QoS-owned flows and all meters, reinstall base flows and policies,
+        then close the batch with a barrier. No reply is awaited in between.
+        """
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+        self.resyncing.add(dp.id)
+        RESYNCS.labels(str(dp.id)).inc()
+
+        # 1. Flush whatever QoS state survived on the switch (flows first, then meters)
+        for owner in (COOKIE_QOS, COOKIE_HH, COOKIE_HH_POLICY):
+            req = parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE, table_id=ofp.OFPTT_ALL,
+                                    cookie=owner << COOKIE_OWNER_SHIFT, cookie_mask=COOKIE_OWNER_MASK,
+                                    out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY)
+            dp.send_msg(req)
+        dp.send_msg(parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_DELETE, meter_id=ofp.OFPM_ALL))
+        for key in [k for k in METER_LIMIT.children if k[0] == str(dp.id)]:
+            del METER_LIMIT.children[key]
+
+        # 2. Base flows, then the last accepted policies
+        self.install_base_flows(dp)
+        if self.desired_policies:
+            self._sync_policies(dp, self.desired_policies)
+
+        # 3. Barrier: everything above is in effect once the reply arrives
+        dp.send_msg(parser.OFPBarrierRequest(dp))
+        self.logger.info(f"[STATE] Switch {dp.id}: resync sent ({len(self.desired_policies)} policies)")
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        if dpid in self.resyncing:
+            self.resyncing.discard(dpid)
+            self.logger.info(f"[STATE] Switch {dpid}: QoS state restored")
+
+    def reset_counters(self, dpid):
+        """Forget rate baselines of a switch; its next FlowStats sample only sets a new baseline."""
+        self.prev_stats.pop(dpid, None)
+        self.stats_sent.pop(dpid, None)
+        self.stats_parts.pop(dpid, None)
+        self.retired_bytes[dpid] = {}
+        self.hh_tracker.forget_datapath(dpid)
+        self.forget_links(dpid)
+
     @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
     def _state_change_handler(self, ev):
         dp = ev.datapath
         if ev.state == MAIN_DISPATCHER:
             self.datapaths[dp.id] = dp
-            self.install_base_flows(dp)
+            self.reset_counters(dp.id)
+            self.resync_datapath(dp)
         elif ev.state == DEAD_DISPATCHER:
             if dp.id in self.datapaths:
                 del self.datapaths[dp.id]
+            self.reset_counters(dp.id)
+            self.resyncing.discard(dp.id)
+
+    # --- Heavy-hitter flows ---
+    def install_punt_flow(self, dp, name):
+        """
+        Forward a class normally and copy its packets to the controller (until a per-flow entry exists).
+        While per-flow entries are capped, the same entry forwards only (no PacketIn per packet).
+        """
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
+        if self.hh_punting.get(dp.id, True):
+            actions.insert(0, parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, 128))
+        match = parser.OFPMatch(eth_type=0x0800, ip_proto=6, tcp_dst=POLICY_PORT_MAP[name])
+        self.add_flow(dp, HH_PUNT_PRIORITY, match, actions, meter_id=self._class_meter(dp, name),
+                      cookie=make_cookie(COOKIE_HH, name))
+
+    def _set_punting(self, dp, enabled):
+        """Switch the punt entries between copy-to-controller and NORMAL only (same match: ADD replaces)."""
+        if self.hh_punting.get(dp.id, True) == enabled:
+            return
+        self.hh_punting[dp.id] = enabled
+        for name in POLICY_PORT_MAP:
+            self.install_punt_flow(dp, name)
+        state = "resumed" if enabled else "paused (per-flow cap or flow table full)"
+        self.logger.info(f"[FLOW] Switch {dp.id}: heavy-hitter punting {state}")
+
+    def _update_punting(self, dpid):
+        """Pause punting at the per-flow cap or table high-water mark, resume below the resume mark."""
+        flows = self.hh_flows.get(dpid)
+        dp = self.datapaths.get(dpid)
+        if flows is None or dp is None:
+            return
+        if len(flows) >= HH_MAX_FLOWS or not self._table_has_room(dpid):
+            self._set_punting(dp, False)
+        elif len(flows) < HH_MAX_FLOWS * HH_PUNT_RESUME:
+            self._set_punting(dp, True)
+
+    def _class_meter(self, dp, name):
+        # Only reference meters this switch already has, or the FlowMod is rejected
+        meter_id = self.class_meters.get(name)
+        if meter_id in self.installed_meters.get(dp.id, {}):
+            return meter_id
+        return None
+
+    def install_hh_flow(self, dp, flow_key, name):
+        """Exact 5-tuple entry: gives the flow its own counters, keeps the class meter."""
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        src, dst, proto, sport, dport = flow_key
+        match = parser.OFPMatch(eth_type=0x0800, ip_proto=proto, ipv4_src=src, ipv4_dst=dst,
+                                tcp_src=sport, tcp_dst=dport)
+        actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
+        self.add_flow(dp, HH_FLOW_PRIORITY, match, actions, meter_id=self._class_meter(dp, name),
+                      cookie=make_cookie(COOKIE_HH, name), idle_timeout=HH_IDLE_TIMEOUT)
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        dp = ev.msg.datapath
+        PACKET_INS.inc()
+        if ev.msg.data[12:14] == PROBE_ETHERTYPE.to_bytes(2, 'big'):
+            self._handle_probe(dp.id, ev.msg.data)
+            return
+
+        flows = self.hh_flows.get(dp.id)
+        if flows is None:
+            return
+
+        pkt = packet.Packet(ev.msg.data)
+        ip = pkt.get_protocol(ipv4.ipv4)
+        seg = pkt.get_protocol(tcp.tcp)
+        if ip is None or seg is None:
+            return
+
+        name = CLASS_BY_PORT.get(seg.dst_port)
+        flow_key = (ip.src, ip.dst, ip.proto, seg.src_port, seg.dst_port)
+        if name is None or flow_key in flows:
+            return
+
+        # Stay within the flow-table budget: beyond the cap flows are only counted per class,
+        # and the punt entries stop copying packets until room frees up
+        if len(flows) >= HH_MAX_FLOWS or not self._table_has_room(dp.id):
+            self._set_punting(dp, False)
+            return
+
+        flows[flow_key] = name
+        self.install_hh_flow(dp, flow_key, name)
+        HH_FLOWS.labels(str(dp.id)).set(len(flows))
+
+    # --- Flow lifecycle ---
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        if dpid in self.resyncing:
+            return  # Entries flushed by the resync batch: counters were reset already
+
+        owner = cookie_owner(msg.cookie)
+        name = cookie_class(msg.cookie)
+        FLOWS_REMOVED.labels(str(owner)).inc()
+
+        # Keep class byte counters monotonic after the entry disappears from FlowStats
+        if name is not None:
+            retired = self.retired_bytes.setdefault(dpid, {})
+            retired[name] = retired.get(name, 0) + msg.byte_count
+
+        if owner == COOKIE_HH:
+            match = msg.match
+            flow_key = (match.get('ipv4_src'), match.get('ipv4_dst'), match.get('ip_proto'),
+                        match.get('tcp_src'), match.get('tcp_dst'))
+            self.hh_flows.get(dpid, {}).pop(flow_key, None)
+            self.hh_tracker.forget(dpid, flow_key)
+            self._update_punting(dpid)
+
+        elif owner == COOKIE_HH_POLICY:
+            installed = self.installed_policies.get(dpid, {})
+            for pol_name, entry in list(installed.items()):
+                if entry[0] == msg.priority and all(msg.match.get(k) == v for k, v in entry[1]):
+                    del installed[pol_name]
+                    self.logger.info(f"[FLOW] Policy '{pol_name}' expired on switch {dpid}")
+
+    def _table_has_room(self, dpid):
+        stats = self.table_stats.get(dpid)
+        if stats is None:
+            return True
+        return stats['active'] < FLOW_TABLE_LIMIT * FLOW_TABLE_HIGH_WATER
+
+    def _request_table_stats(self, datapath):
+        parser = datapath.ofproto_parser
+        req = parser.OFPTableStatsRequest(datapath, 0)
+        datapath.send_msg(req)
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def _table_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        active = 0; lookup = 0; matched = 0
+        for stat in ev.msg.body:
+            active += stat.active_count
+            lookup += stat.lookup_count
+            matched += stat.matched_count
+
+        self.table_stats[dpid] = {'active': active, 'lookup': lookup, 'matched': matched}
+        FLOW_TABLE_ACTIVE.labels(str(dpid)).set(active)
+        self.net_status['flow_tables'][str(dpid)] = {
+            'active': active,
+            'limit': FLOW_TABLE_LIMIT,
+            'occupancy': round(active / FLOW_TABLE_LIMIT, 3),
+            'hh_flows': len(self.hh_flows.get(dpid, {})),
+            'hh_punting': self.hh_punting.get(dpid, True),
+        }
+        if active >= FLOW_TABLE_LIMIT * FLOW_TABLE_HIGH_WATER:
+            self.logger.warning(f"[FLOW] Switch {dpid} flow table at {active}/{FLOW_TABLE_LIMIT} entries")
+        self._update_punting(dpid)
+
+    # --- Link delay probing ---
+    def _send_probes(self):
+        """One probe round: an echo request and a flooded probe frame per switch."""
+        self.probe_round += 1
+        self.probe_packet_ins = 0
+        for dp in self.datapaths.values():
+            if dp.id in self.resyncing:
+                continue  # Probe flow not in place yet
+            ofp = dp.ofproto
+            parser = dp.ofproto_parser
+            dp.send_msg(parser.OFPEchoRequest(dp, data=ECHO_PAYLOAD.pack(time.monotonic_ns())))
+            out = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER, in_port=ofp.OFPP_CONTROLLER,
+                                      actions=[parser.OFPActionOutput(ofp.OFPP_NORMAL)],
+                                      data=probe_frame(dp.id, self.probe_round))
+            dp.send_msg(out)
+            PROBES_SENT.labels(str(dp.id)).inc()
+        self._expire_links()
+
+    @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
+    def _echo_reply_handler(self, ev):
+        data = ev.msg.data
+        if not data or len(data) != ECHO_PAYLOAD.size:
+            return  # Not one of ours (Ryu's own keepalive)
+        dpid = ev.msg.datapath.id
+        rtt = (time.monotonic_ns() - ECHO_PAYLOAD.unpack(data)[0]) / 1e9
+        ECHO_RTT.labels(str(dpid)).observe(rtt)
+        prev = self.echo_rtt.get(dpid)
+        self.echo_rtt[dpid] = rtt if prev is None else prev + PROBE_EWMA * (rtt - prev)
+        self.net_status['control_rtt_ms'][str(dpid)] = round(self.echo_rtt[dpid] * 1000, 3)
+
+    def _handle_probe(self, dpid, data):
+        recv_ns = time.monotonic_ns()
+        if len(data) < 14 + PROBE_PAYLOAD.size:
+            return
+        src, _, sent_ns = PROBE_PAYLOAD.unpack_from(data, 14)
+        transit = (recv_ns - sent_ns) / 1e9
+        self.probe_packet_ins += 1
+        if (src == dpid or src not in self.datapaths or not 0 <= transit <= PROBE_TIMEOUT
+                or self.probe_packet_ins > PROBE_MAX_PACKET_INS):
+            PROBES_DROPPED.inc()
+            return
+
+        # Both control channels are part of the transit: take half of each echo RTT off
+        delay = max(0.0, transit - (self.echo_rtt.get(src, 0.0) + self.echo_rtt.get(dpid, 0.0)) / 2)
+        now = time.monotonic()
+        link = self.link_delay.get((src, dpid))
+        if link is None:
+            link = {'delay': delay, 'base': delay, 'samples': 0, 'time': now}
+            self.link_delay[(src, dpid)] = link
+        else:
+            link['delay'] += PROBE_EWMA * (delay - link['delay'])
+        # Base: lowest delay seen, so a standing queue of any length keeps counting as queue.
+        # It creeps up (route change) only while idle: under load a rise may just be the queue.
+        status = self.net_status
+        idle = status['total_bps'] + status['video_tx_bps'] + status['download_tx_bps'] < PROBE_IDLE_BPS
+        if delay < link['base']:
+            link['base'] = delay
+        elif idle:
+            link['base'] += (delay - link['base']) * min(1.0, (now - link['time']) / PROBE_BASE_HORIZON)
+        link['last'] = delay
+        link['samples'] += 1
+        link['time'] = now
+
+        # Queueing delay: smoothed delay above the base (propagation + processing)
+        queue = max(0.0, link['delay'] - link['base'])
+        key = f"{src}-{dpid}"
+        self.net_status['link_delay'][key] = {
+            'delay_ms': round(link['delay'] * 1000, 3),
+            'last_ms': round(delay * 1000, 3),
+            'base_ms': round(link['base'] * 1000, 3),
+            'queue_ms': round(queue * 1000, 3),
+            'samples': link['samples'],
+        }
+        LINK_DELAY.labels(key).set(link['delay'] * 1000)
+        QUEUE_DELAY.labels(key).set(queue * 1000)
+
+    def _expire_links(self):
+        """Stop reporting links whose probes no longer arrive."""
+        cutoff = time.monotonic() - PROBE_TIMEOUT - 2 * PROBE_INTERVAL * MONITOR_INTERVAL
+        for src, dst in [k for k, link in self.link_delay.items() if link['time'] < cutoff]:
+            self._drop_link(src, dst)
+
+    def forget_links(self, dpid):
+        self.echo_rtt.pop(dpid, None)
+        self.net_status['control_rtt_ms'].pop(str(dpid), None)
+        for src, dst in [k for k in self.link_delay if dpid in k]:
+            self._drop_link(src, dst)
+
+    def _drop_link(self, src, dst):
+        key = f"{src}-{dst}"
+        del self.link_delay[(src, dst)]
+        self.net_status['link_delay'].pop(key, None)
+        LINK_DELAY.children.pop((key,), None)
+        QUEUE_DELAY.children.pop((key,), None)
 
     # --- Monitoring ---
     def _monitor(self):
         while True:
+            check_tables = self.monitor_ticks % TABLE_STATS_INTERVAL == 0
+            trace_id = new_trace_id()
+            self.trace.record(trace_id, 'stats_request')
             for dp in self.datapaths.values():
-                self._request_stats(dp)
-            hub.sleep(1)
-
-    def _request_stats(self, datapath):
+                self._request_stats(dp, trace_id)
+                if check_tables:
+                    self._request_table_stats(dp)
+            if self.monitor_ticks % PROBE_INTERVAL == 0:
+                self._send_probes()
+            self.monitor_ticks += 1
+            hub.sleep(MONITOR_INTERVAL)
+
+    def _request_stats(self, datapath, trace_id=None):
         parser = datapath.ofproto_parser
         req = parser.OFPFlowStatsRequest(datapath)
+        xid = datapath.set_xid(req)  # Replies (every multipart part) carry this xid
         datapath.send_msg(req)
+        now = time.monotonic()
+        sent = self.stats_sent.setdefault(datapath.id, {})
+        # A loaded switch may answer after the next request: keep each request until STATS_TIMEOUT
+        for old in [x for x, (t, _) in sent.items() if now - t > STATS_TIMEOUT]:
+            del sent[old]
+            self.stats_parts.get(datapath.id, {}).pop(old, None)
+            STATS_STALE.labels(str(datapath.id)).inc()
+        sent[xid] = (now, trace_id)
 
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
-        dpid = ev.msg.datapath.id
-        body = ev.msg.body
+        start = time.perf_counter()
+        msg = ev.msg
+        dpid = msg.datapath.id
+
+        sent = self.stats_sent.get(dpid)
+        if sent is not None and msg.xid not in sent:
+            # Answer to a request given up on (timed out or overtaken): no send time left to rate it
+            STATS_STALE.labels(str(dpid)).inc()
+            return
+
+        # Large tables come back in several parts: collect them, compute rates on the last one
+        pending = self.stats_parts.setdefault(dpid, {})
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            parts = pending.setdefault(msg.xid, [[], 0])
+            parts[0].extend(msg.body)
+            parts[1] += 1
+            STATS_HANDLER_TIME.observe(time.perf_counter() - start)
+            return
+
+        body = msg.body
+        count = 1
+        parts = pending.pop(msg.xid, None)
+        if parts is not None:
+            body = parts[0]
+            body.extend(msg.body)
+            count += parts[1]
+        STATS_PARTS.observe(count)
+
+        # Counters were read when the request reached the switch: rate over request send times
+        trace_id = None
+        sample_time = time.monotonic()  # Untracked reply: arrival time is the best estimate
+        if sent is not None:
+            sample_time, trace_id = sent.pop(msg.xid)
+            STATS_RTT.labels(str(dpid)).observe(time.monotonic() - sample_time)
+            # Older requests still open would now go back in time: give them up
+            for old in [x for x, (t, _) in sent.items() if t < sample_time]:
+                del sent[old]
+                pending.pop(old, None)
+                STATS_STALE.labels(str(dpid)).inc()
+
+        self._process_flow_stats(dpid, body, trace_id, sample_time)
+        STATS_HANDLER_TIME.observe(time.perf_counter() - start)
+
+    def _process_flow_stats(self, dpid, body, trace_id=None, sample_time=None):
+        # Counters are meaningless until the resync batch has been applied
+        if dpid in self.resyncing:
+            return
 
         vid_pkts = 0; vid_bytes = 0
         dl_pkts = 0; dl_bytes = 0
 
+        hh_flows = self.hh_flows.get(dpid)
+
         # Aggregate statistics from all flow entries (Priority 5 + Priority 100 QoS Flow)
+        # OFPMatch.get scans the match fields: look each one up once per entry
         for stat in body:
+            match = stat.match
+            tcp_dst = match.get('tcp_dst')
+            if tcp_dst is None or match.get('ip_proto') != 6:
+                continue
+
             # Video (TCP ABR 5001)
-            if (stat.match.get('ip_proto') == 6 and stat.match.get('tcp_dst') == 5001):
+            if tcp_dst == 5001:
                 vid_pkts += stat.packet_count
                 vid_bytes += stat.byte_count
 
             # Download (TCP 5002)
-            elif (stat.match.get('ip_proto') == 6 and stat.match.get('tcp_dst') == 5002):
+            elif tcp_dst == 5002:
                 dl_pkts += stat.packet_count
                 dl_bytes += stat.byte_count
 
-        current_time = time.time()
+            # Per-flow entries (monitored switch): feed the top-talker sketch. Single-flow policies
+            # sit above them too, but count the same flow (or a partial match): not fed
+            if hh_flows is not None and cookie_owner(stat.cookie) == COOKIE_HH:
+                name = CLASS_BY_PORT.get(tcp_dst)
+                if name is not None and match.get('tcp_src') is not None:
+                    flow_key = (match.get('ipv4_src'), match.get('ipv4_dst'), match.get('ip_proto'),
+                                match.get('tcp_src'), tcp_dst)
+                    self.hh_tracker.observe(dpid, name, flow_key, stat.byte_count)
+
+        # Bytes of entries that expired since they were installed
+        retired = self.retired_bytes.get(dpid, {})
+        vid_bytes += retired.get('video', 0)
+        dl_bytes += retired.get('download', 0)
 
+        if hh_flows is not None:
+            self.hh_tracker.tick()
+            self.net_status['heavy_hitters'] = self.hh_tracker.top(HH_TOP_K, interval=MONITOR_INTERVAL)
+
+        current_time = time.monotonic() if sample_time is None else sample_time
+
+        # First sample after (re)connect only sets the baseline: diffing against
+        # zero or pre-flap counters would report a phantom rate/loss spike
         if dpid not in self.prev_stats:
-            self.prev_stats[dpid] = {'vid_bytes': 0, 'dl_bytes': 0, 'time': current_time, 'vid_speed': 0, 'dl_speed': 0}
+            self.prev_stats[dpid] = {'vid_bytes': vid_bytes, 'dl_bytes': dl_bytes, 'time': current_time,
+                                     'vid_speed': 0, 'dl_speed': 0, 'valid': False}
+            return
 
         prev = self.prev_stats[dpid]
         time_diff = max(0.001, current_time - prev['time'])
@@ -154,23 +784,57 @@ class QoSController(app_manager.RyuApp):
         self.prev_stats[dpid] = {
             'vid_bytes': vid_bytes, 'dl_bytes': dl_bytes, 'time': current_time,
             'vid_speed': vid_diff * 8 / time_diff,
-            'dl_speed': dl_diff * 8 / time_diff
+            'dl_speed': dl_diff * 8 / time_diff,
+            'valid': True, 'trace_id': trace_id
         }
 
-        s1 = self.prev_stats.get(1)
-        s2 = self.prev_stats.get(2)
+        s1 = self.prev_stats.get(USER_DPID)
+        servers = [self.prev_stats.get(d) for d in SERVER_DPIDS]
 
-        if s1 and s2:
+        if s1 and s1['valid'] and all(s and s['valid'] for s in servers):
+            vid_tx = sum(s['vid_speed'] for s in servers)
+            dl_tx = sum(s['dl_speed'] for s in servers)
             self.net_status['video_bps'] = s1['vid_speed']
             self.net_status['download_bps'] = s1['dl_speed']
             self.net_status['total_bps'] = s1['vid_speed'] + s1['dl_speed']
-            self.net_status['video_tx_bps'] = s2['vid_speed']
-            self.net_status['download_tx_bps'] = s2['dl_speed']
-            self.net_status['video_loss'] = max(0, s2['vid_speed'] - s1['vid_speed'])
-            self.net_status['download_loss'] = max(0, s2['dl_speed'] - s1['dl_speed'])
+            self.net_status['video_tx_bps'] = vid_tx
+            self.net_status['download_tx_bps'] = dl_tx
+            self.net_status['video_loss'] = max(0, vid_tx - s1['vid_speed'])
+            self.net_status['download_loss'] = max(0, dl_tx - s1['dl_speed'])
+
+            CLASS_RATE.labels('video', 'rx').set(s1['vid_speed'])
+            CLASS_RATE.labels('download', 'rx').set(s1['dl_speed'])
+            CLASS_RATE.labels('video', 'tx').set(vid_tx)
+            CLASS_RATE.labels('download', 'tx').set(dl_tx)
+            CLASS_LOSS.labels('video').set(self.net_status['video_loss'])
+            CLASS_LOSS.labels('download').set(self.net_status['download_loss'])
+
+            self.net_status['trace_id'] = trace_id
+            self.trace.record(trace_id, 'stats_reply')
+
+            # Once per tick, when s1 and every server-side switch have answered the same request round
+            if (self.qos_manager is not None and trace_id is not None and trace_id != self.engine_trace_id
+                    and all(s.get('trace_id') == trace_id for s in [s1] + servers)):
+                self.engine_trace_id = trace_id
+                self._run_inprocess_engine(trace_id)
+
+    def _run_inprocess_engine(self, trace_id):
+        """One control tick without HTTP: net_status -> metrics sample -> decision -> apply_policies."""
+        start = time.perf_counter()
+        try:
+            self.trace.record(trace_id, 'collector_recv')
+            metrics = self.collector.process(self.net_status)
+            self.trace.record(trace_id, 'engine_recv')
+            self.qos_manager.update(metrics)
+        except Exception as e:
+            self.logger.error(f"[ENGINE] In-process tick failed: {e}")
+        ENGINE_TICK_TIME.observe(time.perf_counter() - start)
 
     # --- Apply QoS policies (meter-based) ---
-    def apply_policies(self, policies_list):
+    def apply_policies(self, policies_list, trace_id=None):
+        start = time.perf_counter()
+        POLICY_PUSHES.inc()
+
         # YANG validation
         for policy in policies_list:
             if not self.REQUIRED_POLICY_KEYS.issubset(policy.keys()):
@@ -179,41 +843,125 @@ class QoSController(app_manager.RyuApp):
                 continue
 
         policies = { p['name']: p for p in policies_list }
-        print(f"[RYU] Applying Policies: {policies}")
+        self.logger.info(f"[RYU] Applying Policies: {policies}")
+
+        # Remember the desired state so reconnecting switches (or a restarted controller) replay it
+        self.desired_policies = policies
+        for name in [n for n in self.flow_meters if n not in policies]:
+            del self.flow_meters[name]  # Switch meters go in _sync_policies step 4 once unused
+        if self.qos_manager is not None:
+            self.policy_state_dirty = True  # Pushed from the stats handler: saved by _write_engine_logs
+        else:
+            self._save_policy_state()
 
         for dp in self.datapaths.values():
-            ofp = dp.ofproto
-            parser = dp.ofproto_parser
-            actions_normal = [parser.OFPActionOutput(ofp.OFPP_NORMAL)]
+            self._sync_policies(dp, policies)
+
+        self.trace.record(trace_id, 'meter_mod')
+        APPLY_POLICIES_TIME.observe(time.perf_counter() - start)
+
+    def _flow_meter_id(self, name):
+        """Meter id of a single-flow policy: allocated per name, never shared with a class meter."""
+        meter_id = self.flow_meters.get(name)
+        if meter_id is None:
+            used = set(self.flow_meters.values())
+            meter_id = next(m for m in itertools.count(FLOW_METER_BASE) if m not in used)
+            self.flow_meters[name] = meter_id
+        return meter_id
+
+    def _sync_policies(self, dp, policies):
+        """Bring one switch to the desired policy set, sending only what changed."""
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+        actions_normal = [parser.OFPActionOutput(ofp.OFPP_NORMAL)]
+        installed = self.installed_policies.setdefault(dp.id, {})
+        meters = self.installed_meters.setdefault(dp.id, {})
+
+        for name, pol in policies.items():
+            # Policies with a 'match' container target one flow inside a class
+            flow_match = pol.get('match')
+            cls = flow_match.get('class', name) if flow_match else name
+            if cls not in POLICY_PORT_MAP:
+                continue
 
-            for name, pol in policies.items():
-                # 1. Configure meter (rate limiting)
+            # 1. Configure meter (rate limiting)
+            if flow_match:
+                meter_id = self._flow_meter_id(name)
+            else:
                 meter_id = max(1, int(pol.get('priority', 1)))  # Use priority as meter ID
-                bw_mbps = int(pol.get('bandwidth-limit', 10))
-                kbps = mbps_to_kbps(bw_mbps)
+            bw_mbps = float(pol.get('bandwidth-limit', 10))
+            kbps = mbps_to_kbps(bw_mbps)
 
+            if meters.get(meter_id) != kbps:
                 bands = [parser.OFPMeterBandDrop(rate=kbps, burst_size=max(1000, int(kbps/10)))]
 
-                # First ADD (creates meter if missing)
-                req_add = parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_ADD, flags=ofp.OFPMF_KBPS, meter_id=meter_id, bands=bands)
-                dp.send_msg(req_add)
+                # First ADD (creates meter if missing); skipped once we know the meter exists
+                if meter_id not in meters:
+                    req_add = parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_ADD, flags=ofp.OFPMF_KBPS, meter_id=meter_id, bands=bands)
+                    dp.send_msg(req_add)
 
                 # Then MODIFY (updates meter if it already exists)
                 req_mod = parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_MODIFY, flags=ofp.OFPMF_KBPS, meter_id=meter_id, bands=bands)
                 dp.send_msg(req_mod)
-
-                # Configure flow to pass through the meter
-                # Allows targeted control of download TCP separately
-                if name == "video":
-                    match = parser.OFPMatch(eth_type=0x0800, ip_proto=6, tcp_dst=5001)
-                elif name == "download":
-                    match = parser.OFPMatch(eth_type=0x0800, ip_proto=6, tcp_dst=5002)
-                else:
-                    continue
-
+                meters[meter_id] = kbps
+                METER_MODS.labels(str(dp.id)).inc()
+                METER_LIMIT.labels(str(dp.id), str(meter_id)).set(kbps)
+
+            # 2. Configure flow to pass through the meter
+            fields = {'eth_type': 0x0800, 'ip_proto': 6, 'tcp_dst': POLICY_PORT_MAP[cls]}
+            if flow_match:
+                # Heavy-hitter policy: meter a single 5-tuple above the per-flow entries
+                for leaf, field in (('ipv4-src', 'ipv4_src'), ('ipv4-dst', 'ipv4_dst'),
+                                    ('tcp-src', 'tcp_src'), ('tcp-dst', 'tcp_dst')):
+                    if leaf in flow_match:
+                        fields[field] = flow_match[leaf]
+                prio = HH_POLICY_PRIORITY + int(pol.get('priority', 1))
+            else:
                 # Use higher priority (100+) so it precedes monitoring flows (5)
                 prio = 100 + int(pol.get('priority', 1))
-                self.add_flow(dp, prio, match, actions_normal, meter_id=meter_id)
+
+            entry = (prio, tuple(sorted(fields.items())), meter_id)
+            if installed.get(name) == entry:
+                continue  # Unchanged since the last push: nothing to send
+            if name in installed:
+                old_prio, old_fields, _ = installed[name]
+                if (old_prio, old_fields) != entry[:2]:
+                    self.del_flow(dp, old_prio, parser.OFPMatch(**dict(old_fields)))
+
+            if flow_match:
+                self.add_flow(dp, prio, parser.OFPMatch(**fields), actions_normal, meter_id=meter_id,
+                              cookie=make_cookie(COOKIE_HH_POLICY, cls), idle_timeout=HH_POLICY_IDLE_TIMEOUT)
+            else:
+                self.add_flow(dp, prio, parser.OFPMatch(**fields), actions_normal, meter_id=meter_id,
+                              cookie=make_cookie(COOKIE_QOS, cls))
+            installed[name] = entry
+
+            if flow_match:
+                continue
+
+            # Per-flow entries sit above the class flow, so they must carry the class meter too
+            self.class_meters[cls] = meter_id
+            if dp.id in self.hh_flows:
+                self.install_punt_flow(dp, cls)
+                for flow_key, flow_cls in self.hh_flows[dp.id].items():
+                    if flow_cls == cls:
+                        self.install_hh_flow(dp, flow_key, cls)
+
+        # 3. Remove flows of policies that are no longer requested
+        for name in [n for n in installed if n not in policies]:
+            prio, fields, _ = installed.pop(name)
+            self.del_flow(dp, prio, parser.OFPMatch(**dict(fields)))
+
+        # 4. Release meters no flow refers to anymore
+        in_use = {entry[2] for entry in installed.values()}
+        if dp.id in self.hh_flows:
+            in_use.update(self.class_meters.values())  # Still referenced by punt/per-flow entries
+        for meter_id in [m for m in meters if m not in in_use]:
+            del meters[meter_id]
+            req_del = parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_DELETE, meter_id=meter_id)
+            dp.send_msg(req_del)
+            METER_MODS.labels(str(dp.id)).inc()
+            METER_LIMIT.children.pop((str(dp.id), str(meter_id)), None)
 
 
 class RestQoSController(ControllerBase):
@@ -224,13 +972,31 @@ class RestQoSController(ControllerBase):
     @route('qos', REST_URL, methods=['PUT', 'POST'])
     def put_policies(self, req, **kwargs):
         try:
+            trace_id = req.headers.get(TRACE_HEADER)
+            self.qos_app.trace.record(trace_id, 'policy_recv')
             data = json.loads(req.body.decode('utf-8'))
             policies = data.get('qos-policies:qos-policies', {}).get('policy', [])
-            self.qos_app.apply_policies(policies)
+            self.qos_app.apply_policies(policies, trace_id=trace_id)
             return Response(status=200, body=json.dumps({"msg": "OK"}), content_type='application/json', charset='utf-8')
         except Exception as e:
             return Response(status=500, body=str(e), charset='utf-8')
 
     @route('qos_stats', STATS_URL, methods=['GET'])
     def get_stats(self, req, **kwargs):
+        self.qos_app.trace.record(self.qos_app.net_status.get('trace_id'), 'stats_served')
         return Response(content_type='application/json', body=json.dumps(self.qos_app.net_status), charset='utf-8')
+
+    @route('qos_qoe', QOE_URL, methods=['POST'])
+    def post_qoe(self, req, **kwargs):
+        # Receiver QoE pushed by video_qoe_probe.py, for the in-process engine
+        if self.qos_app.qos_manager is None:
+            return Response(status=404, body="In-process engine not enabled", charset='utf-8')
+        try:
+            self.qos_app.qos_manager.on_qoe(json.loads(req.body.decode('utf-8')))
+            return Response(status=200, body=json.dumps({"status": "stored"}), content_type='application/json', charset='utf-8')
+        except ValueError as e:
+            return Response(status=400, body=str(e), charset='utf-8')
+
+    @route('qos_metrics', METRICS_URL, methods=['GET'])
+    def get_metrics(self, req, **kwargs):
+        return Response(content_type='text/plain', body=REGISTRY.render(), charset='utf-8')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# qos_trace.py
+# Control-loop tracing: one trace id per monitor tick, propagated
+# Ryu -> current_network -> decision engine -> Ryu, with a monotonic timestamp at each stage.
+#
+# Every process appends its own records to the same log file ("<trace_id> <stage> <ns>").
+# CLOCK_MONOTONIC is system-wide on Linux, so timestamps from different processes
+# (and Mininet host namespaces) on one machine can be subtracted directly.
+#
+# buffered=True (the in-process engine inside the controller) keeps the records in memory until
+# flush(), so event-loop handlers never touch the file.
+#
+# The log is bounded: past TRACE_MAX_BYTES the first writer to notice renames it to
+# <file>.1 (replacing the previous one); the other writers see the new inode and reopen.
+
+import itertools
+import os
+import time
+
+TRACE_LOG_FILE = "qos_trace.log"
+TRACE_HEADER = "X-QoS-Trace"  # HTTP header carrying the trace id on policy pushes
+TRACE_MAX_BYTES = 20 * 2**20  # Rotate to <file>.1 beyond this size (~100k ticks)
+TRACE_CHECK_EVERY = 1000      # Records between size checks
+
+# Stage order along the control loop
+STAGES = [
+    "stats_request",   # Ryu: OFPFlowStatsRequest sent
+    "stats_reply",     # Ryu: replies of s1 and s2 processed, net_status updated
+    "stats_served",    # Ryu: GET /stats answered
+    "collector_recv",  # current_network: /stats parsed
+    "collector_post",  # current_network: POST /metrics sent
+    "engine_recv",     # Engine: /metrics received
+    "decision",        # Engine: QoSManager.update finished
+    "push_sent",       # Engine: PUT /qos/qos-policies sent
+    "policy_recv",     # Ryu: policy push received
+    "meter_mod",       # Ryu: OFPMeterMod/FlowMod batch sent to the switches
+]
+
+_counter = itertools.count(1)
+
+
+def new_trace_id():
+    """Short id unique across processes: <pid>-<sequence> in hex."""
+    return f"{os.getpid():x}-{next(_counter):x}"
+
+
+class TraceLog:
+    """Append-only trace record writer. A path of None disables tracing."""
+
+    def __init__(self, path=TRACE_LOG_FILE, max_bytes=TRACE_MAX_BYTES, buffered=False):
+        self.f = None
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = 0
+        self.buffered = buffered
+        self.pending = []  # Records held back until flush() (buffered=True)
+        if path:
+            self._open()
+
+    def _open(self):
+        # Line buffered: each record is a single write() well below PIPE_BUF,
+        # so lines from concurrent processes never interleave
+        self.f = open(self.path, 'a', buffering=1)
+
+    def record(self, trace_id, stage, t_ns=None):
+        if self.f is None or not trace_id:
+            return
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        line = f"{trace_id} {stage} {t_ns}\n"
+        if self.buffered:
+            self.pending.append(line)
+            return
+        self.f.write(line)
+        self.records += 1
+        if self.records % TRACE_CHECK_EVERY == 0:
+            self._check_rotate()
+
+    def flush(self):
+        """Write the records held back by buffered=True."""
+        if self.f is None or not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        before = self.records
+        self.records += len(lines)
+        self.f.writelines(lines)
+        if before // TRACE_CHECK_EVERY != self.records // TRACE_CHECK_EVERY:
+            self._check_rotate()
+
+    def _check_rotate(self):
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != os.fstat(self.f.fileno()).st_ino:
+            # Another process rotated the log: follow it to the new file
+            self.f.close()
+            self._open()
+        elif current.st_size > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+            self.f.close()
+            self._open()
+
+    def close(self):
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# scenario_bench.py
+# Repeatable QoS benchmark: starts controller, decision engine and collector in a fresh
+# run directory, drives scripted traffic phases against the simulator (sim_datapath.py)
+# or the Mininet topology, then computes KPIs from the run's logs and writes them as JSON.
+#
+# Usage:
+#   python scenario_bench.py --backend sim --scenario congestion
+#   sudo python3 scenario_bench.py --backend mininet --scenario-file my_scenario.json
+#   python scenario_bench.py --kpis-only bench_runs/congestion-20260101-120000   (recompute from logs)
+
+import argparse
+import csv
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from qos_trace import TRACE_LOG_FILE
+from telemetry_store import CSV_TIME_FORMAT
+from trace_summary import load_traces, percentile
+from traffic_video_abr import QUALITIES
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNS_DIR = "bench_runs"
+RYU_STATS_URL = "http://127.0.0.1:8080/stats"
+ENGINE_URL = "http://127.0.0.1:5000/metrics"
+OFP_PORT = 6633
+STARTUP_TIMEOUT = 30.0     # Seconds to wait for each component (and the switches) to come up
+WARMUP = 5.0               # Seconds of idle monitoring before the first phase (baselines, resync)
+PHASE_STEP = 0.5           # Seconds between phase scheduler wake-ups
+ABR_TOP_BPS = QUALITIES[-1][1]  # Mininet video phases: one ABR player per this much offered load
+
+# KPI thresholds (same 1% rule as the decision engine)
+LOSS_THRESHOLD = 1.0       # Video loss (%) counted as a loss-second
+RECOVERY_SAMPLES = 3       # Consecutive samples below the threshold that count as recovered
+
+# Log files written into the run directory by the components (their relative defaults)
+COLLECTOR_CSV = "network_traffic.csv"
+ENGINE_CSV = "decision_engine_log.csv"
+EVENTS_FILE = "events.json"
+RESULT_FILE = "result.json"
+
+# --- Scenarios ---
+# Phase actions:
+#   video     constant video load            (mbps; Mininet: traffic_video_abr.py, one player per top rung)
+#   download  download burst                 (flows; Mininet: traffic_file.py)
+#   abr_ramp  video bitrate ramp             (from_mbps -> to_mbps; Mininet: traffic_video_abr.py with `players`)
+SCENARIOS = {
+    "congestion": {
+        "duration": 90,
+        "phases": [
+            {"at": 0, "action": "video", "mbps": 6, "duration": 90},
+            {"at": 15, "action": "download", "flows": 10, "duration": 40},
+        ],
+    },
+    "abr": {
+        "duration": 90,
+        "phases": [
+            {"at": 0, "action": "download", "flows": 10, "duration": 90},
+            {"at": 10, "action": "abr_ramp", "from_mbps": 1, "to_mbps": 8, "players": 2, "duration": 60},
+        ],
+    },
+    "mixed": {
+        "duration": 120,
+        "phases": [
+            {"at": 0, "action": "video", "mbps": 4, "duration": 120},
+            {"at": 15, "action": "download", "flows": 10, "duration": 30},
+            {"at": 60, "action": "abr_ramp", "from_mbps": 1, "to_mbps": 6, "players": 1, "duration": 40},
+            {"at": 70, "action": "download", "flows": 20, "duration": 20},
+        ],
+    },
+}
+
+
+# --- Stack (controller, engine, collector) ---
+class Stack:
+    """The three QoS processes, each started with the run directory as working directory."""
+
+    def __init__(self, workdir, ofp_port=OFP_PORT, ryu_manager=None, inprocess=False):
+        self.workdir = workdir
+        self.inprocess = inprocess  # Collector and engine inside the controller (QOS_ENGINE_INPROCESS)
+        self.ofp_port = ofp_port
+        self.ryu_manager = ryu_manager or shutil.which("ryu-manager") or "ryu-manager"
+        self.procs = []
+
+    def _spawn(self, name, cmd, env=None):
+        log = open(os.path.join(self.workdir, f"{name}.log"), 'w')
+        # QoE snapshots of this run are written into the run directory (see MininetBackend)
+        env = dict(os.environ, QOS_QOE_FILE=os.path.join(self.workdir, "latest_qoe.json"), **(env or {}))
+        proc = subprocess.Popen(cmd, cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT, env=env)
+        self.procs.append((name, proc, log))
+        print(f"[BENCH] Started {name} (pid {proc.pid})")
+        return proc
+
+    def start(self):
+        self._spawn("ryu", [self.ryu_manager, "--ofp-tcp-listen-port", str(self.ofp_port),
+                            os.path.join(SCRIPT_DIR, "qos_ryu_app.py")],
+                    env={"QOS_ENGINE_INPROCESS": "1" if self.inprocess else "0"})
+        wait_http(RYU_STATS_URL, "get")
+        if self.inprocess:
+            return
+        self._spawn("engine", [sys.executable, os.path.join(SCRIPT_DIR, "decision_engine_push_to_ryu.py")])
+        wait_http(ENGINE_URL, "get")
+        self._spawn("collector", [sys.executable, os.path.join(SCRIPT_DIR, "current_network.py")])
+
+    def stop(self):
+        for name, proc, log in reversed(self.procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+        self.procs = []
+
+
+def wait_http(url, method):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if getattr(requests, method)(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {STARTUP_TIMEOUT:.0f} s")
+
+
+# --- Backends ---
+class SimBackend:
+    """Drives sim_datapath.SimFleet in a background thread; phases set the offered load."""
+
+    def __init__(self, switches, ofp_port):
+        from sim_datapath import SimFleet
+        self.fleet = SimFleet(switches, ("127.0.0.1", ofp_port))
+        self.fleet.set_load(video_mbps=0, video_flows=0, download_flows=0)
+        self.load = None
+        self.thread = threading.Thread(target=self.fleet.run, kwargs={"report": False}, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while self.fleet.snapshot()["connected"] < len(self.fleet.switches):
+            if time.monotonic() > deadline:
+                raise RuntimeError("Simulated switches did not connect")
+            time.sleep(0.5)
+
+    def start_phase(self, phase, workdir):
+        pass  # Load is recomputed from the active phases in update()
+
+    def update(self, active, elapsed):
+        video_mbps = 0.0
+        download_flows = 0
+        for phase in active:
+            if phase["action"] == "video":
+                video_mbps += phase["mbps"]
+            elif phase["action"] == "abr_ramp":
+                progress = min(1.0, (elapsed - phase["at"]) / phase["duration"])
+                video_mbps += phase["from_mbps"] + (phase["to_mbps"] - phase["from_mbps"]) * progress
+            elif phase["action"] == "download":
+                download_flows += phase["flows"]
+        load = (round(video_mbps, 3), download_flows)
+        if load != self.load:
+            # Queued: the fleet thread applies it before its next tick
+            self.load = load
+            self.fleet.set_load(video_mbps=video_mbps, video_flows=1 if video_mbps > 0 else 0,
+                                download_flows=download_flows)
+
+    def ground_truth(self):
+        return self.fleet.snapshot()
+
+    def stop(self):
+        self.fleet.stop()
+        self.thread.join(timeout=5)
+
+
+class MininetBackend:
+    """Builds the topology from mininet_topo and runs the generators on its hosts (needs root)."""
+
+    def __init__(self, topo_cfg, ofp_port):
+        from mininet.net import Mininet
+        from mininet.node import RemoteController, OVSKernelSwitch
+        from mininet.link import TCLink
+        import mininet_topo
+
+        self.topo = mininet_topo
+        self.cfg = dict(mininet_topo.DEFAULT_CONFIG, **(topo_cfg or {}))
+        self.cfg["controller_port"] = ofp_port
+        self.net = Mininet(controller=RemoteController, switch=OVSKernelSwitch, link=TCLink,
+                           autoSetMacs=True, autoStaticArp=True)
+        self.net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=ofp_port)
+        self.hosts = None
+        self.procs = []
+
+    def start(self, workdir):
+        self.hosts = self.topo.build_topology(self.net, self.cfg)
+        self.net.start()
+        self.topo.start_receivers(self.hosts, qoe_file=os.path.join(workdir, "latest_qoe.json"))
+        time.sleep(3)
+
+    def start_phase(self, phase, workdir):
+        name = f"{phase['action']}_{phase['at']}"
+        server_role, user_role = ("download_servers", "download_users") if phase["action"] == "download" \
+            else ("video_servers", "video_users")
+        srv, user = self.hosts[server_role][0], self.hosts[user_role][0]
+        duration = phase["duration"]
+        if phase["action"] == "video":
+            # TCP players, not UDP traffic_video.py: the controller only counts TCP 5001.
+            # Enough players at the top rung to offer roughly `mbps`
+            players = phase.get("players", max(1, math.ceil(phase["mbps"] * 1e6 / ABR_TOP_BPS)))
+            cmd = (f"python3 {self.topo.ABR_GENERATOR} --target {user.IP()}:{self.topo.VIDEO_PORT} "
+                   f"--players {players} --duration {duration}")
+        elif phase["action"] == "abr_ramp":
+            # Real players ramp on their own (buffer-based ABR); from/to only shape the simulator
+            cmd = (f"python3 {self.topo.ABR_GENERATOR} --target {user.IP()}:{self.topo.VIDEO_PORT} "
+                   f"--players {phase.get('players', 1)} --duration {duration}")
+        else:
+            cmd = (f"python3 {self.topo.DOWNLOAD_GENERATOR} --target {user.IP()}:{self.topo.DOWNLOAD_PORT} "
+                   f"--flows {phase['flows']} --duration {duration} --quiet "
+                   f"--json {os.path.join(workdir, name + '.json')}")
+        log = open(os.path.join(workdir, f"{name}.log"), 'w')
+        self.procs.append((srv.popen(cmd, shell=True, stdout=log, stderr=subprocess.STDOUT), log))
+
+    def update(self, active, elapsed):
+        pass
+
+    def ground_truth(self):
+        return None
+
+    def stop(self):
+        for proc, log in self.procs:
+            if proc.poll() is None:
+                proc.terminate()
+            log.close()
+        self.net.stop()
+
+
+# --- Scenario execution ---
+def run_scenario(scenario, backend, workdir):
+    """Run the phases on schedule. Returns the event list (relative and monotonic times)."""
+    events = []
+    phases = scenario["phases"]
+    started, ended = set(), set()
+    start = time.monotonic()
+
+    def record(phase_idx, kind):
+        phase = phases[phase_idx]
+        events.append({"t": round(time.monotonic() - start, 3), "mono_ns": time.monotonic_ns(),
+                       "phase": phase_idx, "action": phase["action"], "event": kind})
+        print(f"[BENCH] {events[-1]['t']:>7.1f}s  {phase['action']} {kind}")
+
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= scenario["duration"]:
+            break
+        for i, phase in enumerate(phases):
+            if i not in started and elapsed >= phase["at"]:
+                started.add(i)
+                record(i, "start")
+                backend.start_phase(phase, workdir)
+            if i in started and i not in ended and elapsed >= phase["at"] + phase["duration"]:
+                ended.add(i)
+                record(i, "end")
+        active = [p for i, p in enumerate(phases) if i in started and i not in ended]
+        backend.update(active, elapsed)
+        time.sleep(PHASE_STEP)
+
+    for i in sorted(started - ended):
+        record(i, "end")
+    return events
+
+
+# --- KPIs ---
+def read_csv_rows(path, start_wall):
+    """Rows of a component CSV with 't' = seconds since the run started (1 s resolution)."""
+    rows = []
+    try:
+        with open(path, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    wall = datetime.strptime(row["Timestamp"], CSV_TIME_FORMAT)
+                except (KeyError, ValueError):
+                    continue
+                row["t"] = (wall - start_wall).total_seconds()
+                rows.append(row)
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+def _float(row, key):
+    try:
+        return float(row.get(key) or 0)
+    except ValueError:
+        return 0.0
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 3) if values else None
+
+
+def compute_kpis(workdir, events, duration, start_wall, start_mono_ns):
+    """KPIs from the collector and engine CSVs, the trace log and the phase events."""
+    collector = [r for r in read_csv_rows(os.path.join(workdir, COLLECTOR_CSV), start_wall) if 0 <= r["t"] <= duration]
+    engine = [r for r in read_csv_rows(os.path.join(workdir, ENGINE_CSV), start_wall) if 0 <= r["t"] <= duration]
+    try:
+        traces = load_traces(os.path.join(workdir, TRACE_LOG_FILE))
+    except FileNotFoundError:
+        traces = {}
+
+    downloads = [e for e in events if e["action"] == "download"]
+    download_windows = []
+    for e in downloads:
+        if e["event"] == "start":
+            end = next((x["t"] for x in downloads if x["phase"] == e["phase"] and x["event"] == "end"), duration)
+            download_windows.append((e["t"], end))
+    onset = next((e for e in downloads if e["event"] == "start"), None)
+
+    kpis = {
+        "samples": len(collector),
+        "time_to_detect_sec": None,
+        "time_to_enforce_sec": None,
+        "video_loss_seconds": sum(1 for r in collector if _float(r, "Video_loss(%)") > LOSS_THRESHOLD),
+        "video_loss_percent_mean": _mean([_float(r, "Video_loss(%)") for r in collector]),
+        "video_mbps_mean": _mean([_float(r, "Video(Mbps)") for r in collector]),
+        "download_goodput_mbps": _mean([_float(r, "Download(Mbps)") for r in collector
+                                        if any(a <= r["t"] <= b for a, b in download_windows)]),
+        "policy_pushes_per_min": None,
+        "recovery_sec": None,
+        "qos_release_sec": None,
+    }
+
+    # Policy pushes: trace records when tracing is on, engine events otherwise
+    end_ns = start_mono_ns + int(duration * 1e9)
+    pushes = sorted((stages["push_sent"], tid) for tid, stages in traces.items()
+                    if start_mono_ns <= stages.get("push_sent", -1) <= end_ns)
+    if pushes:
+        kpis["policy_pushes_per_min"] = round(len(pushes) / (duration / 60.0), 2)
+    else:
+        kpis["policy_pushes_per_min"] = round(
+            sum(1 for r in engine if r.get("Event_Message", "-") not in ("-", "")) / (duration / 60.0), 2)
+
+    enforce_t = None
+    if onset is not None:
+        # Detection and enforcement: first push after the congestion onset (trace), else the engine CSV
+        first = next(((ns, tid) for ns, tid in pushes if ns >= onset["mono_ns"]), None)
+        if first is not None:
+            stages = traces[first[1]]
+            detect_ns = stages.get("decision", first[0])
+            kpis["time_to_detect_sec"] = round((detect_ns - onset["mono_ns"]) / 1e9, 3)
+            if "meter_mod" in stages:
+                kpis["time_to_enforce_sec"] = round((stages["meter_mod"] - onset["mono_ns"]) / 1e9, 3)
+                enforce_t = onset["t"] + kpis["time_to_enforce_sec"]
+        else:
+            on = next((r for r in engine if r["t"] >= onset["t"] and r.get("Event_Message", "").startswith("QoS ON")), None)
+            if on is not None:
+                kpis["time_to_detect_sec"] = round(on["t"] - onset["t"], 3)
+                enforce_t = on["t"]
+
+    # Recovery: enforcement -> video loss back under the threshold for RECOVERY_SAMPLES samples
+    if enforce_t is not None:
+        run = 0
+        for r in collector:
+            if r["t"] < enforce_t:
+                continue
+            run = run + 1 if _float(r, "Video_loss(%)") <= LOSS_THRESHOLD else 0
+            if run == RECOVERY_SAMPLES:
+                kpis["recovery_sec"] = round(r["t"] - (RECOVERY_SAMPLES - 1) - enforce_t, 3)
+                break
+
+    # Release: last download burst over -> engine turns QoS off
+    ends = [e["t"] for e in downloads if e["event"] == "end"]
+    if ends:
+        off = next((r for r in engine if r["t"] >= max(ends) and r.get("Event_Message") == "QoS OFF"), None)
+        if off is not None:
+            kpis["qos_release_sec"] = round(off["t"] - max(ends), 3)
+
+    # Control-loop latency per push (stats_request -> meter_mod)
+    loop_ms = sorted((traces[tid]["meter_mod"] - traces[tid]["stats_request"]) / 1e6
+                     for _, tid in pushes if "meter_mod" in traces[tid] and "stats_request" in traces[tid])
+    kpis["control_loop_ms"] = {
+        "n": len(loop_ms),
+        "p50": round(percentile(loop_ms, 50), 2),
+        "p99": round(percentile(loop_ms, 99), 2),
+        "max": round(loop_ms[-1], 2) if loop_ms else 0.0,
+    }
+    return kpis
+
+
+def code_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_scenario(args):
+    if args.scenario_file:
+        with open(args.scenario_file, 'r') as f:
+            scenario = json.load(f)
+        scenario.setdefault("name", os.path.splitext(os.path.basename(args.scenario_file))[0])
+    else:
+        scenario = dict(SCENARIOS[args.scenario], name=args.scenario)
+    if args.duration:
+        scenario["duration"] = args.duration
+    scenario["phases"] = sorted(scenario["phases"], key=lambda p: p["at"])
+    return scenario
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted QoS scenario runner with KPI output")
+    parser.add_argument("--backend", choices=("sim", "mininet"), default="sim")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="congestion")
+    parser.add_argument("--scenario-file", help="JSON scenario: {'duration': s, 'phases': [...]} (overrides --scenario)")
+    parser.add_argument("--duration", type=float, help="Override the scenario duration (seconds)")
+    parser.add_argument("--switches", type=int, default=2, help="Simulated switches (sim backend)")
+    parser.add_argument("--topo-config", help="mininet_topo.py config JSON (mininet backend)")
+    parser.add_argument("--ofp-port", type=int, default=OFP_PORT)
+    parser.add_argument("--ryu-manager", help="Path to ryu-manager (default: from PATH)")
+    parser.add_argument("--inprocess", action="store_true",
+                        help="Run collector and decision engine inside the controller (no HTTP hops)")
+    parser.add_argument("--workdir", help=f"Run directory (default: {RUNS_DIR}/<scenario>-<time>)")
+    parser.add_argument("--out", help=f"Result JSON (default: <workdir>/{RESULT_FILE})")
+    parser.add_argument("--kpis-only", metavar="WORKDIR", help="Recompute the KPIs of a finished run")
+    args = parser.parse_args()
+
+    if args.kpis_only:
+        with open(os.path.join(args.kpis_only, RESULT_FILE), 'r') as f:
+            result = json.load(f)
+        with open(os.path.join(args.kpis_only, EVENTS_FILE), 'r') as f:
+            events = json.load(f)
+        result["kpis"] = compute_kpis(args.kpis_only, events, result["duration_sec"],
+                                      datetime.fromisoformat(result["started"]), result["start_mono_ns"])
+        print(json.dumps(result["kpis"], indent=2))
+        return
+
+    scenario = load_scenario(args)
+    workdir = args.workdir or os.path.join(RUNS_DIR, f"{scenario['name']}-{datetime.now():%Y%m%d-%H%M%S}")
+    os.makedirs(workdir, exist_ok=True)
+    workdir = os.path.abspath(workdir)
+
+    stack = Stack(workdir, args.ofp_port, args.ryu_manager, args.inprocess)
+    backend = None
+    try:
+        stack.start()
+        if args.backend == "sim":
+            backend = SimBackend(args.switches, args.ofp_port)
+            backend.start()
+        else:
+            topo_cfg = None
+            if args.topo_config:
+                with open(args.topo_config, 'r') as f:
+                    topo_cfg = json.load(f)
+            backend = MininetBackend(topo_cfg, args.ofp_port)
+            backend.start(workdir)
+
+        print(f"[BENCH] Warm-up {WARMUP:.0f} s, then '{scenario['name']}' for {scenario['duration']} s ({args.backend})")
+        time.sleep(WARMUP)
+        start_wall, start_mono_ns = datetime.now(), time.monotonic_ns()
+        events = run_scenario(scenario, backend, workdir)
+        ground_truth = backend.ground_truth()
+    finally:
+        if backend is not None:
+            backend.stop()
+        stack.stop()
+
+    with open(os.path.join(workdir, EVENTS_FILE), 'w') as f:
+        json.dump(events, f, indent=2)
+
+    result = {
+        "scenario": scenario["name"],
+        "backend": args.backend,
+        "engine": "inprocess" if args.inprocess else "http",
+        "switches": args.switches if args.backend == "sim" else None,
+        "version": code_version(),
+        "started": start_wall.isoformat(),
+        "start_mono_ns": start_mono_ns,
+        "duration_sec": scenario["duration"],
+        "phases": scenario["phases"],
+        "kpis": compute_kpis(workdir, events, scenario["duration"], start_wall, start_mono_ns),
+        "ground_truth_end": ground_truth,
+        "workdir": workdir,
+    }
+    out = args.out or os.path.join(workdir, RESULT_FILE)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    if out != os.path.join(workdir, RESULT_FILE):
+        shutil.copy(out, os.path.join(workdir, RESULT_FILE))
+
+    print(json.dumps(result["kpis"], indent=2))
+    print(f"[BENCH] Result written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,887 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# sim_datapath.py
+# Simulated OpenFlow 1.3 switches for running QoSController without root, OVS or Mininet.
+#
+# Every simulated switch opens its own OpenFlow channel to the controller (like ovs-vswitchd),
+# so the controller code path is exactly the one used with Mininet. Switches are paired:
+# dpid 2k+2 is the server-side switch (like s2) and dpid 2k+1 the user-side switch (like s1),
+# joined by a bottleneck link modelled as a fluid FIFO queue.
+#
+# Traffic is fluid: each simulated flow offers bytes every tick; the flow table (highest
+# priority match), meters (token buckets, OFPMC_ADD/MODIFY/DELETE) and the bottleneck queue
+# decide how many bytes get through, and the matched entries' counters advance accordingly.
+# Video flows send at a constant rate, download flows are AIMD (halve on loss, linear ramp).
+# Delay probes sent with PacketOut cross the pair's link (server->user waits for the queue)
+# and come back as PacketIn from the peer switch when it has a to-controller entry for them.
+#
+# Usage: python sim_datapath.py --switches 2000 --controller 127.0.0.1:6633
+
+import argparse
+import heapq
+import selectors
+import socket
+import struct
+import threading
+import time
+
+# --- Configuration ---
+CONTROLLER_ADDR = ("127.0.0.1", 6633)
+TICK = 0.1                  # Seconds per fluid-model step
+REPORT_INTERVAL = 5.0       # Seconds between status lines
+CONNECT_BATCH = 50          # New connections opened per loop iteration (don't flood the accept queue)
+RECONNECT_DELAY = 2.0       # Seconds before a dropped channel is reopened
+RECV_SIZE = 65536
+
+BOTTLENECK_MBPS = 10        # Same as the Mininet s1-s2 link
+BUFFER_MS = 100             # Bottleneck queue size, in milliseconds at link rate
+VIDEO_MBPS = 6              # Offered video load per switch pair
+VIDEO_FLOWS = 1
+DOWNLOAD_FLOWS = 10
+DOWNLOAD_MAX_MBPS = 100     # Per-flow ceiling (access link)
+TCP_INIT_MBPS = 0.5         # Initial rate of a download flow
+TCP_MIN_MBPS = 0.05         # Floor of a download flow after repeated losses (about 1 segment per RTT)
+TCP_RAMP_MBPS = 1.0         # Additive increase per flow, Mbps per second
+PKT_BYTES = 1400            # Bytes per packet when deriving packet counters
+PUNT_INTERVAL = 1.0         # Seconds between PacketIns for one flow while it hits a to-controller entry
+FLOW_TABLE_SIZE = 2000      # Entries per switch before OFPFMFC_TABLE_FULL
+PROPAGATION_MS = 1.0        # One-way delay of the pair link without queueing
+
+# Addressing of the simulated flows (same plan as mininet_topo.py)
+VIDEO_USER, DOWNLOAD_USER = "10.0.0.1", "10.0.0.2"
+VIDEO_SERVER, DOWNLOAD_SERVER = "10.0.0.10", "10.0.0.20"
+CLASS_PORTS = {"video": 5001, "download": 5002}
+SRC_PORT_BASE = 40000
+
+# --- OpenFlow 1.3 wire format ---
+OFP_VERSION = 0x04
+OFP_HEADER = struct.Struct('!BBHI')
+OFP_MAX_MSG = 0xffff
+
+OFPT_HELLO, OFPT_ERROR, OFPT_ECHO_REQUEST, OFPT_ECHO_REPLY = 0, 1, 2, 3
+OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY = 5, 6
+OFPT_GET_CONFIG_REQUEST, OFPT_GET_CONFIG_REPLY, OFPT_SET_CONFIG = 7, 8, 9
+OFPT_PACKET_IN, OFPT_FLOW_REMOVED, OFPT_PACKET_OUT, OFPT_FLOW_MOD = 10, 11, 13, 14
+OFPT_PORT_MOD, OFPT_TABLE_MOD = 16, 17
+OFPT_MULTIPART_REQUEST, OFPT_MULTIPART_REPLY = 18, 19
+OFPT_BARRIER_REQUEST, OFPT_BARRIER_REPLY = 20, 21
+OFPT_ROLE_REQUEST, OFPT_ROLE_REPLY = 24, 25
+OFPT_GET_ASYNC_REQUEST, OFPT_GET_ASYNC_REPLY, OFPT_SET_ASYNC = 26, 27, 28
+OFPT_METER_MOD = 29
+IGNORED_TYPES = {OFPT_HELLO, OFPT_ECHO_REPLY, OFPT_ERROR, OFPT_SET_CONFIG,
+                 OFPT_PORT_MOD, OFPT_TABLE_MOD, OFPT_SET_ASYNC}
+
+OFPMP_DESC, OFPMP_FLOW, OFPMP_AGGREGATE, OFPMP_TABLE = 0, 1, 2, 3
+OFPMP_METER, OFPMP_METER_CONFIG, OFPMP_PORT_DESC = 9, 10, 13
+OFPMPF_REPLY_MORE = 1
+
+OFPFC_ADD, OFPFC_MODIFY, OFPFC_MODIFY_STRICT, OFPFC_DELETE, OFPFC_DELETE_STRICT = range(5)
+OFPFF_SEND_FLOW_REM, OFPFF_RESET_COUNTS = 0x1, 0x4
+OFPRR_IDLE_TIMEOUT, OFPRR_HARD_TIMEOUT, OFPRR_DELETE = 0, 1, 2
+OFPMC_ADD, OFPMC_MODIFY, OFPMC_DELETE = 0, 1, 2
+OFPM_ALL = 0xffffffff
+OFPTT_ALL = 0xff
+OFPP_CONTROLLER = 0xfffffffd
+OFP_NO_BUFFER = 0xffffffff
+OFPIT_WRITE_ACTIONS, OFPIT_APPLY_ACTIONS, OFPIT_METER = 3, 4, 6
+OFPAT_OUTPUT = 0
+
+OFPET_BAD_REQUEST, OFPET_FLOW_MOD_FAILED, OFPET_METER_MOD_FAILED = 1, 5, 12
+OFPBRC_BAD_TYPE, OFPBRC_BAD_MULTIPART = 1, 2
+OFPFMFC_TABLE_FULL = 1
+OFPMMFC_METER_EXISTS, OFPMMFC_UNKNOWN_METER = 1, 2
+
+FEATURES = struct.Struct('!QIBB2xII')        # datapath_id, n_buffers, n_tables, auxiliary_id, capabilities, reserved
+MULTIPART = struct.Struct('!HH4x')           # type, flags
+FLOW_MOD = struct.Struct('!QQBBHHHIIIH2x')   # cookie, cookie_mask, table_id, command, idle, hard, priority, buffer_id, out_port, out_group, flags
+FLOW_STATS_REQ = struct.Struct('!B3xII4xQQ') # table_id, out_port, out_group, cookie, cookie_mask
+FLOW_STATS = struct.Struct('!HBxIIHHHH4xQQQ')  # length, table_id, duration s/ns, priority, idle, hard, flags, cookie, packets, bytes
+FLOW_REMOVED = struct.Struct('!QHBBIIHHQQ')  # cookie, priority, reason, table_id, duration s/ns, idle, hard, packets, bytes
+PACKET_IN = struct.Struct('!IHBBQ')          # buffer_id, total_len, reason, table_id, cookie
+PACKET_OUT = struct.Struct('!IIH6x')         # buffer_id, in_port, actions_len
+TABLE_STATS = struct.Struct('!B3xIQQ')       # table_id, active, lookup, matched
+AGGREGATE_STATS = struct.Struct('!QQI4x')    # packets, bytes, flows
+METER_MOD = struct.Struct('!HHI')            # command, flags, meter_id
+METER_BAND = struct.Struct('!HHII4x')        # type, len, rate, burst_size
+METER_STATS = struct.Struct('!IH6xIQQII')    # meter_id, len, flow_count, packet_in, byte_in, duration s/ns
+BAND_STATS = struct.Struct('!QQ')            # packet_band_count, byte_band_count
+METER_CONFIG = struct.Struct('!HHI')         # length, flags, meter_id
+PORT = struct.Struct('!I4x6s2x16sIIIIIIII')  # port_no, hw_addr, name, config, state, curr, advertised, supported, peer, speeds
+DESC = struct.Struct('!256s256s256s32s256s')
+ERROR = struct.Struct('!HH')
+
+# OXM (OpenFlow basic class) fields this simulator understands: field -> (name, struct format)
+OXM_CLASS_BASIC = 0x8000
+OXM_FIELDS = {
+    0: ('in_port', '!I'), 5: ('eth_type', '!H'), 10: ('ip_proto', '!B'),
+    11: ('ipv4_src', 'ip'), 12: ('ipv4_dst', 'ip'),
+    13: ('tcp_src', '!H'), 14: ('tcp_dst', '!H'), 15: ('udp_src', '!H'), 16: ('udp_dst', '!H'),
+}
+
+
+def ofp_message(msg_type, xid, body=b''):
+    return OFP_HEADER.pack(OFP_VERSION, msg_type, OFP_HEADER.size + len(body), xid) + body
+
+
+def parse_match(buf, offset):
+    """Decode an ofp_match. Returns (fields, raw padded bytes, offset after the match)."""
+    _, length = struct.unpack_from('!HH', buf, offset)
+    padded = (length + 7) // 8 * 8
+    fields = {}
+    pos, end = offset + 4, offset + length
+    while pos + 4 <= end:
+        (hdr,) = struct.unpack_from('!I', buf, pos)
+        oxm_class, field, has_mask, size = hdr >> 16, (hdr >> 9) & 0x7f, (hdr >> 8) & 1, hdr & 0xff
+        value = bytes(buf[pos + 4:pos + 4 + (size // 2 if has_mask else size)])
+        known = OXM_FIELDS.get(field) if oxm_class == OXM_CLASS_BASIC else None
+        if known is None:
+            # Kept so the entry never matches simulated traffic it was not meant for
+            fields[f'oxm_{oxm_class:x}_{field}'] = value
+        elif known[1] == 'ip':
+            fields[known[0]] = socket.inet_ntoa(value)
+        else:
+            fields[known[0]] = struct.unpack(known[1], value)[0]
+        pos += 4 + size
+    return fields, bytes(buf[offset:offset + padded]), offset + padded
+
+
+def in_port_match(port_no):
+    oxm = struct.pack('!II', (OXM_CLASS_BASIC << 16) | 4, port_no)
+    return struct.pack('!HH', 1, 4 + len(oxm)) + oxm + b'\0' * 4
+
+
+def parse_instructions(buf):
+    """Return (meter id or None, True if an action outputs to the controller)."""
+    meter_id, to_controller = None, False
+    pos = 0
+    while pos + 4 <= len(buf):
+        itype, ilen = struct.unpack_from('!HH', buf, pos)
+        if ilen < 4:
+            break
+        if itype == OFPIT_METER:
+            (meter_id,) = struct.unpack_from('!I', buf, pos + 4)
+        elif itype in (OFPIT_APPLY_ACTIONS, OFPIT_WRITE_ACTIONS):
+            apos = pos + 8
+            while apos + 8 <= pos + ilen:
+                atype, alen = struct.unpack_from('!HH', buf, apos)
+                if alen < 8:
+                    break
+                if atype == OFPAT_OUTPUT and struct.unpack_from('!I', buf, apos + 4)[0] == OFPP_CONTROLLER:
+                    to_controller = True
+                apos += alen
+        pos += ilen
+    return meter_id, to_controller
+
+
+def tcp_packet(flow):
+    """Ethernet/IPv4/TCP header of a simulated flow, for PacketIn payloads."""
+    src, dst = socket.inet_aton(flow.src), socket.inet_aton(flow.dst)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40, 0, 0x4000, 64, 6, 0, src, dst)
+    csum = sum(struct.unpack('!10H', ip))
+    csum = (csum & 0xffff) + (csum >> 16)
+    csum = ~((csum & 0xffff) + (csum >> 16)) & 0xffff
+    ip = ip[:10] + struct.pack('!H', csum) + ip[12:]
+    tcp = struct.pack('!HHIIBBHHH', flow.sport, flow.dport, 0, 0, 5 << 4, 0x10, 65535, 0, 0)
+    eth = b'\x00\x00\x00\x00\x00\x01' + b'\x00\x00\x00\x00\x00\x02' + struct.pack('!H', 0x0800)
+    return eth + ip + tcp
+
+
+class SimFlow:
+    """One simulated flow (server -> user). Video is constant rate, downloads are AIMD."""
+
+    __slots__ = ('cls', 'src', 'dst', 'sport', 'dport', 'fields', 'elastic', 'rate_bps', 'max_bps', 'packet')
+
+    def __init__(self, cls, src, dst, sport, rate_bps, elastic, max_bps):
+        self.cls = cls
+        self.src, self.dst = src, dst
+        self.sport, self.dport = sport, CLASS_PORTS[cls]
+        self.fields = {'eth_type': 0x0800, 'ip_proto': 6, 'ipv4_src': src, 'ipv4_dst': dst,
+                       'tcp_src': sport, 'tcp_dst': self.dport}
+        self.elastic = elastic
+        self.rate_bps = rate_bps
+        self.max_bps = max_bps
+        self.packet = tcp_packet(self)
+
+    def matches(self, match):
+        fields = self.fields
+        for key, value in match.items():
+            if fields.get(key) != value:
+                return False
+        return True
+
+    def feedback(self, lost, dt):
+        if not self.elastic:
+            return
+        if lost:
+            self.rate_bps = max(TCP_MIN_MBPS * 1e6, self.rate_bps / 2)
+        else:
+            self.rate_bps = min(self.max_bps, self.rate_bps + TCP_RAMP_MBPS * 1e6 * dt)
+
+
+class FlowEntry:
+    __slots__ = ('priority', 'match', 'match_raw', 'instructions', 'cookie', 'idle_timeout', 'hard_timeout',
+                 'flags', 'meter_id', 'to_controller', 'packet_count', 'byte_count', 'created', 'last_hit')
+
+    def __init__(self, priority, match, match_raw, instructions, cookie, idle_timeout, hard_timeout, flags, now):
+        self.priority = priority
+        self.match = match
+        self.match_raw = match_raw
+        self.set_instructions(instructions)
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.flags = flags
+        self.packet_count = 0
+        self.byte_count = 0
+        self.created = now
+        self.last_hit = now
+
+    def set_instructions(self, instructions):
+        self.instructions = instructions
+        self.meter_id, self.to_controller = parse_instructions(instructions)
+
+    def covers(self, match):
+        """Non-strict OpenFlow match: every field of `match` is present here with the same value."""
+        for key, value in match.items():
+            if self.match.get(key) != value:
+                return False
+        return True
+
+    def duration(self, now):
+        d = max(0.0, now - self.created)
+        return int(d), int((d % 1) * 1e9)
+
+
+class Meter:
+    """Single drop band, fluid token bucket."""
+
+    __slots__ = ('meter_id', 'flags', 'bands_raw', 'rate_bps', 'burst_bytes', 'tokens',
+                 'packet_in', 'byte_in', 'band_packets', 'band_bytes', 'created')
+
+    def __init__(self, meter_id, now):
+        self.meter_id = meter_id
+        self.packet_in = self.byte_in = self.band_packets = self.band_bytes = 0
+        self.created = now
+        self.tokens = 0.0
+
+    def configure(self, flags, bands_raw):
+        self.flags = flags
+        self.bands_raw = bands_raw
+        rate_kbps, burst_kb = 0, 0
+        if len(bands_raw) >= METER_BAND.size:
+            _, _, rate_kbps, burst_kb = METER_BAND.unpack_from(bands_raw, 0)
+        self.rate_bps = rate_kbps * 1000
+        self.burst_bytes = burst_kb * 1000 / 8
+        self.tokens = min(self.tokens, self.burst_bytes)
+
+    def allowance(self, dt):
+        """Bytes the meter lets through this tick."""
+        self.tokens = min(self.tokens + self.rate_bps * dt / 8, max(self.burst_bytes, self.rate_bps * dt / 8))
+        return self.tokens
+
+
+class Bottleneck:
+    """Fluid FIFO queue between the server-side and user-side switch of a pair."""
+
+    def __init__(self, mbps, buffer_ms):
+        self.capacity = mbps * 1e6 / 8                 # bytes/s
+        self.buffer = self.capacity * buffer_ms / 1000  # bytes
+        self.queue = 0.0
+        self.dropped = 0.0
+
+    def transmit(self, arrived, dt):
+        """Returns (delivered share of this tick's arrivals, dropped share)."""
+        if arrived <= 0:
+            self.queue = max(0.0, self.queue - self.capacity * dt)
+            return 0.0, 0.0
+        backlog = self.queue + arrived
+        sent = min(backlog, self.capacity * dt)
+        backlog -= sent
+        drop = max(0.0, backlog - self.buffer)
+        self.queue = backlog - drop
+        self.dropped += drop
+        return sent / arrived, drop / arrived
+
+    @property
+    def delay_ms(self):
+        return self.queue / self.capacity * 1000
+
+
+class SimSwitch:
+    """One simulated datapath: OpenFlow channel, flow table, meters and counters."""
+
+    def __init__(self, dpid, fleet):
+        self.dpid = dpid
+        self.fleet = fleet
+        self.sock = None
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.retry_at = 0.0
+        self.connected = False
+        self.channel_up = False   # Features exchanged (the controller knows our dpid)
+
+        self.entries = {}         # (priority, match key) -> FlowEntry
+        self.ordered = None       # Entries by descending priority, rebuilt lazily
+        self.lookup_cache = {}    # flow index -> FlowEntry (cleared on every table change)
+        self.meters = {}          # meter id -> Meter
+        self.lookup_count = 0
+        self.matched_count = 0
+        self.last_punt = {}       # flow index -> time of the last PacketIn
+        self.peer = None          # Switch at the other end of the pair link
+        self.egress = None        # Bottleneck crossed by frames sent to the peer (None: no queue)
+        self.ports = [
+            PORT.pack(n, bytes([0, 0, 0, (dpid >> 16) & 0xff, (dpid >> 8) & 0xff, n]),
+                      f"s{dpid}-eth{n}".encode(), 0, 0, 0, 0, 0, 0, 10000000, 10000000)
+            for n in (1, 2)
+        ]
+
+    # --- Channel ---
+    def connect(self, now):
+        try:
+            sock = socket.create_connection(self.fleet.controller, timeout=2)
+        except OSError:
+            self.retry_at = now + RECONNECT_DELAY
+            return False
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.rx.clear()
+        self.tx.clear()
+        self.connected = True
+        self.fleet.selector.register(sock, selectors.EVENT_READ, self)
+        self.send(OFPT_HELLO, 0)
+        return True
+
+    def close(self, now):
+        if self.sock is not None:
+            self.fleet.selector.unregister(self.sock)
+            self.sock.close()
+        self.sock = None
+        self.connected = False
+        self.channel_up = False
+        self.retry_at = now + RECONNECT_DELAY
+        self.fleet.pending.append(self)
+        # Like a switch in fail-secure mode, the flow table and meters survive the disconnect
+
+    def send(self, msg_type, xid, body=b''):
+        if not self.connected:
+            return
+        pending = bool(self.tx)
+        self.tx += ofp_message(msg_type, xid, body)
+        if not pending:
+            self.on_writable()
+
+    def on_writable(self):
+        try:
+            sent = self.sock.send(self.tx)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close(time.monotonic())
+            return
+        del self.tx[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.tx else 0)
+        self.fleet.selector.modify(self.sock, events, self)
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close(time.monotonic())
+            return
+        self.rx += data
+        while len(self.rx) >= OFP_HEADER.size and self.connected:
+            _, msg_type, length, xid = OFP_HEADER.unpack_from(self.rx, 0)
+            if len(self.rx) < length:
+                break
+            msg = bytes(self.rx[:length])
+            del self.rx[:length]
+            self.handle(msg_type, xid, msg)
+
+    def error(self, err_type, code, msg):
+        self.send(OFPT_ERROR, OFP_HEADER.unpack_from(msg, 0)[3], ERROR.pack(err_type, code) + msg[:64])
+
+    # --- Message dispatch ---
+    def handle(self, msg_type, xid, msg):
+        body = msg[OFP_HEADER.size:]
+        if msg_type in IGNORED_TYPES:
+            return
+        if msg_type == OFPT_ECHO_REQUEST:
+            self.send(OFPT_ECHO_REPLY, xid, body)
+        elif msg_type == OFPT_FEATURES_REQUEST:
+            self.channel_up = True
+            self.send(OFPT_FEATURES_REPLY, xid, FEATURES.pack(self.dpid, 0, 1, 0, 0x7, 0))
+        elif msg_type == OFPT_BARRIER_REQUEST:
+            self.send(OFPT_BARRIER_REPLY, xid)
+        elif msg_type == OFPT_FLOW_MOD:
+            self.flow_mod(msg)
+        elif msg_type == OFPT_METER_MOD:
+            self.meter_mod(msg)
+        elif msg_type == OFPT_PACKET_OUT:
+            self.packet_out(msg)
+        elif msg_type == OFPT_MULTIPART_REQUEST:
+            self.multipart(xid, msg)
+        elif msg_type == OFPT_GET_CONFIG_REQUEST:
+            self.send(OFPT_GET_CONFIG_REPLY, xid, struct.pack('!HH', 0, 0xffff))
+        elif msg_type == OFPT_ROLE_REQUEST:
+            self.send(OFPT_ROLE_REPLY, xid, body)
+        elif msg_type == OFPT_GET_ASYNC_REQUEST:
+            self.send(OFPT_GET_ASYNC_REPLY, xid, b'\0' * 24)
+        else:
+            self.error(OFPET_BAD_REQUEST, OFPBRC_BAD_TYPE, msg)
+
+    # --- Flow table ---
+    def table_changed(self):
+        self.ordered = None
+        self.lookup_cache.clear()
+
+    def lookup(self, idx, flow):
+        entry = self.lookup_cache.get(idx)
+        if entry is None and idx not in self.lookup_cache:
+            if self.ordered is None:
+                self.ordered = sorted(self.entries.values(), key=lambda e: -e.priority)
+            entry = next((e for e in self.ordered if flow.matches(e.match)), None)
+            self.lookup_cache[idx] = entry
+        return entry
+
+    def flow_mod(self, msg):
+        (cookie, cookie_mask, table_id, command, idle, hard, priority,
+         _, _, _, flags) = FLOW_MOD.unpack_from(msg, OFP_HEADER.size)
+        match, match_raw, pos = parse_match(msg, OFP_HEADER.size + FLOW_MOD.size)
+        instructions = msg[pos:]
+        now = time.monotonic()
+        key = (priority, frozenset(match.items()))
+
+        if command == OFPFC_ADD:
+            meter_id, _ = parse_instructions(instructions)
+            if meter_id is not None and meter_id not in self.meters:
+                self.error(OFPET_METER_MOD_FAILED, OFPMMFC_UNKNOWN_METER, msg)
+                return
+            old = self.entries.get(key)
+            if old is None and len(self.entries) >= self.fleet.table_size:
+                self.error(OFPET_FLOW_MOD_FAILED, OFPFMFC_TABLE_FULL, msg)
+                return
+            entry = FlowEntry(priority, match, match_raw, instructions, cookie, idle, hard, flags, now)
+            if old is not None and not flags & OFPFF_RESET_COUNTS:
+                # Same behaviour as OVS: replacing an identical entry keeps its counters
+                entry.packet_count, entry.byte_count = old.packet_count, old.byte_count
+                entry.created = old.created
+            self.entries[key] = entry
+            self.table_changed()
+
+        elif command in (OFPFC_MODIFY, OFPFC_MODIFY_STRICT):
+            for k, entry in self.entries.items():
+                if (k == key if command == OFPFC_MODIFY_STRICT else entry.covers(match)) \
+                        and (entry.cookie & cookie_mask) == (cookie & cookie_mask):
+                    entry.set_instructions(instructions)
+            self.table_changed()
+
+        elif command in (OFPFC_DELETE, OFPFC_DELETE_STRICT):
+            victims = [k for k, entry in self.entries.items()
+                       if (k == key if command == OFPFC_DELETE_STRICT else entry.covers(match))
+                       and (entry.cookie & cookie_mask) == (cookie & cookie_mask)]
+            for k in victims:
+                self.remove(k, OFPRR_DELETE, now)
+
+    def remove(self, key, reason, now):
+        entry = self.entries.pop(key)
+        self.table_changed()
+        if entry.flags & OFPFF_SEND_FLOW_REM:
+            sec, nsec = entry.duration(now)
+            body = FLOW_REMOVED.pack(entry.cookie, entry.priority, reason, 0, sec, nsec,
+                                     entry.idle_timeout, entry.hard_timeout,
+                                     entry.packet_count, entry.byte_count) + entry.match_raw
+            self.send(OFPT_FLOW_REMOVED, 0, body)
+
+    def expire(self, now):
+        for key, entry in list(self.entries.items()):
+            if entry.hard_timeout and now - entry.created >= entry.hard_timeout:
+                self.remove(key, OFPRR_HARD_TIMEOUT, now)
+            elif entry.idle_timeout and now - entry.last_hit >= entry.idle_timeout:
+                self.remove(key, OFPRR_IDLE_TIMEOUT, now)
+
+    # --- Meters ---
+    def meter_mod(self, msg):
+        command, flags, meter_id = METER_MOD.unpack_from(msg, OFP_HEADER.size)
+        bands = msg[OFP_HEADER.size + METER_MOD.size:]
+        now = time.monotonic()
+
+        if command == OFPMC_ADD:
+            if meter_id in self.meters:
+                self.error(OFPET_METER_MOD_FAILED, OFPMMFC_METER_EXISTS, msg)
+                return
+            meter = self.meters[meter_id] = Meter(meter_id, now)
+            meter.configure(flags, bands)
+        elif command == OFPMC_MODIFY:
+            if meter_id not in self.meters:
+                self.error(OFPET_METER_MOD_FAILED, OFPMMFC_UNKNOWN_METER, msg)
+                return
+            self.meters[meter_id].configure(flags, bands)
+        elif command == OFPMC_DELETE:
+            deleted = set(self.meters) if meter_id == OFPM_ALL else {meter_id} & set(self.meters)
+            for m in deleted:
+                del self.meters[m]
+            # Flow entries using a deleted meter are removed with it
+            for key in [k for k, e in self.entries.items() if e.meter_id in deleted]:
+                self.remove(key, OFPRR_DELETE, now)
+
+    # --- Multipart (statistics) ---
+    def multipart(self, xid, msg):
+        mp_type, _ = MULTIPART.unpack_from(msg, OFP_HEADER.size)
+        offset = OFP_HEADER.size + MULTIPART.size
+        now = time.monotonic()
+
+        if mp_type == OFPMP_FLOW:
+            table_id, _, _, cookie, cookie_mask = FLOW_STATS_REQ.unpack_from(msg, offset)
+            match, _, _ = parse_match(msg, offset + FLOW_STATS_REQ.size)
+            parts = []
+            for entry in self.entries.values():
+                if not entry.covers(match) or (entry.cookie & cookie_mask) != (cookie & cookie_mask):
+                    continue
+                sec, nsec = entry.duration(now)
+                length = FLOW_STATS.size + len(entry.match_raw) + len(entry.instructions)
+                parts.append(FLOW_STATS.pack(length, 0, sec, nsec, entry.priority, entry.idle_timeout,
+                                             entry.hard_timeout, entry.flags, entry.cookie,
+                                             entry.packet_count, entry.byte_count)
+                             + entry.match_raw + entry.instructions)
+        elif mp_type == OFPMP_AGGREGATE:
+            entries = list(self.entries.values())
+            parts = [AGGREGATE_STATS.pack(sum(e.packet_count for e in entries),
+                                          sum(e.byte_count for e in entries), len(entries))]
+        elif mp_type == OFPMP_TABLE:
+            parts = [TABLE_STATS.pack(0, len(self.entries), self.lookup_count, self.matched_count)]
+        elif mp_type in (OFPMP_METER, OFPMP_METER_CONFIG):
+            (meter_id,) = struct.unpack_from('!I', msg, offset)
+            meters = [m for m in self.meters.values() if meter_id in (OFPM_ALL, m.meter_id)]
+            if mp_type == OFPMP_METER:
+                flow_count = {}
+                for e in self.entries.values():
+                    flow_count[e.meter_id] = flow_count.get(e.meter_id, 0) + 1
+                parts = []
+                for m in meters:
+                    sec, nsec = int(now - m.created), int(((now - m.created) % 1) * 1e9)
+                    parts.append(METER_STATS.pack(m.meter_id, METER_STATS.size + BAND_STATS.size,
+                                                  flow_count.get(m.meter_id, 0), m.packet_in, m.byte_in, sec, nsec)
+                                 + BAND_STATS.pack(m.band_packets, m.band_bytes))
+            else:
+                parts = [METER_CONFIG.pack(METER_CONFIG.size + len(m.bands_raw), m.flags, m.meter_id) + m.bands_raw
+                         for m in meters]
+        elif mp_type == OFPMP_PORT_DESC:
+            parts = self.ports
+        elif mp_type == OFPMP_DESC:
+            parts = [DESC.pack(b"QoS lab", b"sim_datapath", b"fluid model", str(self.dpid).encode(), b"simulated")]
+        else:
+            self.error(OFPET_BAD_REQUEST, OFPBRC_BAD_MULTIPART, msg)
+            return
+        self.send_multipart(xid, mp_type, parts)
+
+    def send_multipart(self, xid, mp_type, parts):
+        """Split the reply so no message exceeds 64 KB; all but the last carry OFPMPF_REPLY_MORE."""
+        limit = OFP_MAX_MSG - OFP_HEADER.size - MULTIPART.size
+        chunk, size = [], 0
+        for part in parts:
+            if chunk and size + len(part) > limit:
+                self.send(OFPT_MULTIPART_REPLY, xid, MULTIPART.pack(mp_type, OFPMPF_REPLY_MORE) + b''.join(chunk))
+                chunk, size = [], 0
+            chunk.append(part)
+            size += len(part)
+        self.send(OFPT_MULTIPART_REPLY, xid, MULTIPART.pack(mp_type, 0) + b''.join(chunk))
+
+    # --- Forwarding (fluid) ---
+    def forward(self, flows, offered, dt, now):
+        """
+        Pass one tick of traffic through the flow table and meters.
+        Counters count what matched (meter drops included, as on OVS).
+        Returns the bytes of each flow that got through.
+        """
+        passed = [0.0] * len(flows)
+        entries = [None] * len(flows)
+        metered = {}
+        for i, flow in enumerate(flows):
+            nbytes = offered[i]
+            if nbytes <= 0:
+                continue
+            packets = max(1, int(nbytes / PKT_BYTES))
+            self.lookup_count += packets
+            entry = self.lookup(i, flow)
+            if entry is None:
+                continue  # Table miss: dropped
+            self.matched_count += packets
+            entry.packet_count += packets
+            entry.byte_count += int(nbytes)
+            entry.last_hit = now
+            entries[i] = entry
+            if entry.to_controller and self.channel_up and now - self.last_punt.get(i, 0.0) >= PUNT_INTERVAL:
+                self.last_punt[i] = now
+                self.packet_in(entry, flow)
+            if entry.meter_id in self.meters:
+                metered[entry.meter_id] = metered.get(entry.meter_id, 0.0) + nbytes
+            passed[i] = nbytes
+
+        # Meters scale every flow through them by the same ratio (fluid drop band)
+        for meter_id, total in metered.items():
+            meter = self.meters[meter_id]
+            allowed = min(total, meter.allowance(dt))
+            meter.tokens -= allowed
+            meter.byte_in += int(total)
+            meter.packet_in += int(total / PKT_BYTES)
+            meter.band_bytes += int(total - allowed)
+            meter.band_packets += int((total - allowed) / PKT_BYTES)
+            ratio = allowed / total
+            for i, entry in enumerate(entries):
+                if entry is not None and entry.meter_id == meter_id:
+                    passed[i] *= ratio
+        return passed
+
+    def packet_in(self, entry, flow):
+        self.send_packet_in(entry, flow.packet)
+
+    def send_packet_in(self, entry, data):
+        body = PACKET_IN.pack(OFP_NO_BUFFER, len(data), 1, 0, entry.cookie) \
+            + in_port_match(1) + b'\0\0' + data
+        self.send(OFPT_PACKET_IN, 0, body)
+
+    # --- PacketOut (delay probes) ---
+    def packet_out(self, msg):
+        """Frames sent out of the switch reach the peer after the link delay; only probes are modelled."""
+        _, _, actions_len = PACKET_OUT.unpack_from(msg, OFP_HEADER.size)
+        data = bytes(msg[OFP_HEADER.size + PACKET_OUT.size + actions_len:])
+        if self.peer is None or len(data) < 14 or struct.unpack_from('!H', data, 12)[0] == 0x0800:
+            return
+        delay_ms = PROPAGATION_MS + (self.egress.delay_ms if self.egress is not None else 0.0)
+        self.fleet.defer(delay_ms / 1000, self.peer.receive_frame, data)
+
+    def receive_frame(self, data):
+        """A non-IP frame arrived on the link port: punt it if the table says so."""
+        if not self.channel_up:
+            return
+        fields = {'in_port': 1, 'eth_type': struct.unpack_from('!H', data, 12)[0]}
+        if self.ordered is None:
+            self.ordered = sorted(self.entries.values(), key=lambda e: -e.priority)
+        entry = next((e for e in self.ordered if all(fields.get(k) == v for k, v in e.match.items())), None)
+        if entry is not None and entry.to_controller:
+            entry.packet_count += 1
+            entry.byte_count += len(data)
+            entry.last_hit = time.monotonic()
+            self.send_packet_in(entry, data)
+
+
+class SimPair:
+    """Server-side switch -> bottleneck -> user-side switch, with the flows crossing it."""
+
+    def __init__(self, user_sw, server_sw, mbps, buffer_ms):
+        self.user_sw = user_sw        # Odd dpid (like s1)
+        self.server_sw = server_sw    # Even dpid (like s2)
+        self.link = Bottleneck(mbps, buffer_ms)
+        # Traffic (and probes) from the server side queue at the bottleneck; the reverse path is idle
+        server_sw.peer, server_sw.egress = user_sw, self.link
+        user_sw.peer = server_sw
+        self.flows = []
+        self.offered = {}             # class -> bps offered in the last tick
+        self.delivered = {}           # class -> bps delivered to the users in the last tick
+
+    def set_flows(self, flows):
+        self.flows = flows
+        for sw in (self.user_sw, self.server_sw):
+            sw.lookup_cache.clear()
+            sw.last_punt.clear()
+
+    def step(self, dt, now):
+        flows = self.flows
+        offered = [f.rate_bps * dt / 8 for f in flows]
+        tx = self.server_sw.forward(flows, offered, dt, now)
+        delivered_share, drop_share = self.link.transmit(sum(tx), dt)
+        at_user = [b * delivered_share for b in tx]
+        rx = self.user_sw.forward(flows, at_user, dt, now)
+
+        self.offered = dict.fromkeys(CLASS_PORTS, 0.0)
+        self.delivered = dict.fromkeys(CLASS_PORTS, 0.0)
+        for i, flow in enumerate(flows):
+            self.offered[flow.cls] += offered[i] * 8 / dt
+            self.delivered[flow.cls] += rx[i] * 8 / dt
+            # Loss seen by the sender: policed by a meter on either switch or dropped at the queue
+            lost = offered[i] > 0 and (tx[i] < offered[i] * 0.999 or drop_share > 0 or rx[i] < at_user[i] * 0.999)
+            flow.feedback(lost, dt)
+
+
+class SimFleet:
+    """All simulated switches, driven by one selector loop."""
+
+    def __init__(self, switches, controller=CONTROLLER_ADDR, mbps=BOTTLENECK_MBPS, buffer_ms=BUFFER_MS,
+                 tick=TICK, table_size=FLOW_TABLE_SIZE):
+        self.controller = controller
+        self.tick = tick
+        self.table_size = table_size
+        self.selector = selectors.DefaultSelector()
+        self.switches = [SimSwitch(dpid, self) for dpid in range(1, switches + 1)]
+        self.pending = list(self.switches)   # Switches waiting to (re)connect
+        self.pairs = [SimPair(self.switches[i], self.switches[i + 1], mbps, buffer_ms)
+                      for i in range(0, len(self.switches) - 1, 2)]
+        self.running = False          # True while run() owns the pairs (see set_load)
+        self.stop_requested = False
+        self.deferred = []   # Heap of (due time, seq, callback, arg): frames in flight on a link
+        self.deferred_seq = 0
+        self.load_lock = threading.Lock()
+        self.pending_load = None   # Latest set_load() arguments, applied by the fleet loop before its next tick
+        self.apply_load(VIDEO_MBPS, VIDEO_FLOWS, DOWNLOAD_FLOWS, DOWNLOAD_MAX_MBPS)
+
+    def set_load(self, video_mbps=VIDEO_MBPS, video_flows=VIDEO_FLOWS, download_flows=DOWNLOAD_FLOWS,
+                 download_mbps=DOWNLOAD_MAX_MBPS):
+        """Queue new traffic for every pair; safe from any thread (the last call before a tick wins)."""
+        with self.load_lock:
+            if self.running:
+                self.pending_load = (video_mbps, video_flows, download_flows, download_mbps)
+                return
+            # No loop yet (run() flips `running` under this lock): apply right away
+            self.pending_load = None
+            self.apply_load(video_mbps, video_flows, download_flows, download_mbps)
+
+    def apply_pending_load(self):
+        with self.load_lock:
+            load, self.pending_load = self.pending_load, None
+        if load is not None:
+            self.apply_load(*load)
+
+    def apply_load(self, video_mbps, video_flows, download_flows, download_mbps):
+        """Replace the traffic of every pair (fleet thread only: step() uses the flows and their caches)."""
+        for pair in self.pairs:
+            old = {(f.cls, f.sport): f for f in pair.flows}
+            flows = []
+            for i in range(video_flows):
+                rate = video_mbps * 1e6 / max(1, video_flows)
+                flows.append(SimFlow("video", VIDEO_SERVER, VIDEO_USER, SRC_PORT_BASE + i, rate, False, rate))
+            for i in range(download_flows):
+                flow = SimFlow("download", DOWNLOAD_SERVER, DOWNLOAD_USER, SRC_PORT_BASE + i,
+                               TCP_INIT_MBPS * 1e6, True, download_mbps * 1e6)
+                prev = old.get(("download", flow.sport))
+                if prev is not None:
+                    flow.rate_bps = min(prev.rate_bps, flow.max_bps)  # Running downloads keep their window
+                flows.append(flow)
+            pair.set_flows(flows)
+
+    def snapshot(self):
+        """Ground truth of the first pair (the dpid 1/2 pair the controller reports on) and fleet totals."""
+        pair = self.pairs[0] if self.pairs else None
+        return {
+            "connected": sum(1 for sw in self.switches if sw.channel_up),
+            "switches": len(self.switches),
+            "flow_entries": sum(len(sw.entries) for sw in self.switches),
+            "offered_bps": dict(pair.offered) if pair else {},
+            "delivered_bps": dict(pair.delivered) if pair else {},
+            "queue_delay_ms": round(pair.link.delay_ms, 2) if pair else 0.0,
+            "meters_bps": {m.meter_id: m.rate_bps for m in pair.server_sw.meters.values()} if pair else {},
+        }
+
+    def defer(self, delay, callback, arg):
+        self.deferred_seq += 1
+        heapq.heappush(self.deferred, (time.monotonic() + delay, self.deferred_seq, callback, arg))
+
+    def connect_pending(self, now):
+        due = [sw for sw in self.pending if sw.retry_at <= now][:CONNECT_BATCH]
+        for sw in due:
+            self.pending.remove(sw)
+            if not sw.connect(now):
+                self.pending.append(sw)
+
+    def run(self, duration=None, report=True):
+        with self.load_lock:
+            self.running = True
+        self.stop_requested = False
+        start = time.monotonic()
+        next_tick = start + self.tick
+        next_report = start + REPORT_INTERVAL
+        next_expire = start + 1.0
+        try:
+            while not self.stop_requested and (duration is None or time.monotonic() - start < duration):
+                now = time.monotonic()
+                if self.pending:
+                    self.connect_pending(now)
+
+                if now >= next_tick:
+                    if self.pending_load is not None:
+                        self.apply_pending_load()
+                    for pair in self.pairs:
+                        pair.step(self.tick, now)
+                    # Fall behind gracefully: never run more than one catch-up step
+                    next_tick = max(next_tick + self.tick, now)
+                while self.deferred and self.deferred[0][0] <= now:
+                    _, _, callback, arg = heapq.heappop(self.deferred)
+                    callback(arg)
+                if now >= next_expire:
+                    for sw in self.switches:
+                        sw.expire(now)
+                    next_expire = now + 1.0
+                if report and now >= next_report:
+                    self.print_status(now - start)
+                    next_report += REPORT_INTERVAL
+
+                wake = min(next_tick, self.deferred[0][0]) if self.deferred else next_tick
+                timeout = max(0.0, wake - time.monotonic())
+                for key, events in self.selector.select(timeout):
+                    sw = key.data
+                    if events & selectors.EVENT_READ:
+                        sw.on_readable()
+                    if events & selectors.EVENT_WRITE and sw.connected:
+                        sw.on_writable()
+        finally:
+            with self.load_lock:
+                self.running = False
+                if self.pending_load is not None:
+                    self.apply_load(*self.pending_load)
+                    self.pending_load = None
+            for sw in self.switches:
+                if sw.sock is not None:
+                    self.selector.unregister(sw.sock)
+                    sw.sock.close()
+                    sw.sock = None
+                    sw.connected = sw.channel_up = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def print_status(self, elapsed):
+        snap = self.snapshot()
+        offered = snap["offered_bps"]; delivered = snap["delivered_bps"]
+        meters = ", ".join(f"m{m}={bps / 1e6:.1f}" for m, bps in sorted(snap["meters_bps"].items())) or "none"
+        print(f"[SIM {int(elapsed):>5}s] switches {snap['connected']}/{snap['switches']} | "
+              f"entries {snap['flow_entries']} | pair 1: video {offered.get('video', 0) / 1e6:.2f}->"
+              f"{delivered.get('video', 0) / 1e6:.2f} Mbps, download {offered.get('download', 0) / 1e6:.2f}->"
+              f"{delivered.get('download', 0) / 1e6:.2f} Mbps, queue {snap['queue_delay_ms']:.1f} ms | meters {meters}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated OpenFlow 1.3 switches (fluid-model s1/s2 pairs)")
+    parser.add_argument("--switches", type=int, default=2, help="Number of switches (pairs of user/server side)")
+    parser.add_argument("--controller", default=f"{CONTROLLER_ADDR[0]}:{CONTROLLER_ADDR[1]}", help="Controller ip:port")
+    parser.add_argument("--bottleneck-mbps", type=float, default=BOTTLENECK_MBPS)
+    parser.add_argument("--buffer-ms", type=float, default=BUFFER_MS)
+    parser.add_argument("--video-mbps", type=float, default=VIDEO_MBPS, help="Offered video load per pair")
+    parser.add_argument("--video-flows", type=int, default=VIDEO_FLOWS)
+    parser.add_argument("--download-flows", type=int, default=DOWNLOAD_FLOWS)
+    parser.add_argument("--download-mbps", type=float, default=DOWNLOAD_MAX_MBPS, help="Per-flow download ceiling")
+    parser.add_argument("--tick", type=float, default=TICK, help="Fluid-model step (seconds)")
+    parser.add_argument("--table-size", type=int, default=FLOW_TABLE_SIZE)
+    parser.add_argument("--duration", type=float, default=0, help="Seconds (0: until Ctrl+C)")
+    args = parser.parse_args()
+    if args.switches < 2 or args.switches % 2:
+        parser.error("--switches must be an even number >= 2")
+
+    ip, _, port = args.controller.partition(':')
+    fleet = SimFleet(args.switches, (ip, int(port or CONTROLLER_ADDR[1])), args.bottleneck_mbps,
+                     args.buffer_ms, args.tick, args.table_size)
+    fleet.set_load(args.video_mbps, args.video_flows, args.download_flows, args.download_mbps)
+    print(f"[SIM] {args.switches} switches -> {args.controller}, "
+          f"bottleneck {args.bottleneck_mbps} Mbps / {args.buffer_ms} ms per pair")
+    try:
+        fleet.run(args.duration or None)
+    except KeyboardInterrupt:
+        print("\n[SIM] Stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# telemetry_store.py
+# Bounded telemetry history for the collector and the decision engine.
+#
+# Raw samples are folded, as they arrive, into 1 s / 1 min / 1 h rollups (min, max, mean, p95
+# and count per metric). Each tier is stored as append-only JSON-lines segments:
+#
+#   telemetry/<name>/<tier>/<segment start, UTC>.jsonl     {"t": bucket start (epoch s), "<metric>": {...}}
+#
+# Whole segments are deleted once they fall out of their tier's retention, so nothing is ever
+# rewritten and restarts simply keep appending. A rollup is written when its bucket closes;
+# the bucket still open when a process stops is lost (at most one bucket per tier).
+#
+# Range queries read the coarsest tier that still has enough resolution and reaches back far
+# enough, so a month-long dashboard reads ~720 hourly rows instead of 2.6 M samples.
+#
+# Usage: python telemetry_store.py network --since 30d [--metric video_mbps] [--points 500]
+
+import argparse
+import calendar
+import csv
+import json
+import math
+import os
+import time
+
+# --- Configuration ---
+TELEMETRY_DIR = "telemetry"
+# Tier name -> (resolution s, segment file span s, retention s)
+TIERS = {
+    "1s": (1, 3600, 86400),             # One day of per-second rollups, hourly files
+    "1m": (60, 86400, 30 * 86400),      # 30 days of per-minute rollups, daily files
+    "1h": (3600, 30 * 86400, 365 * 86400),  # One year of hourly rollups, 30-day files
+}
+MAX_POINTS = 500             # Default query resolution: at most ~this many rows per range
+CSV_MAX_BYTES = 50 * 2**20   # Raw CSV logs are rotated to <file>.1 beyond this size
+CSV_ROTATE_CHECK = 3600      # Rows between CSV size checks while running
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # First column of the CSV logs
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def prepare_csv(path, header, max_bytes=CSV_MAX_BYTES):
+    """
+    Keep appending to an existing CSV log; rotate it to <file>.1 once it is too large or was written
+    with another header (older column layout); write the header if new. Returns True if new.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'r', newline='') as f:
+            first = next(csv.reader(f), [])
+    except OSError:
+        size = 0
+        first = []
+    if size > max_bytes or (size and first != list(header)):
+        os.replace(path, path + ".1")
+        size = 0
+    if size == 0:
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerow(header)
+    return size == 0
+
+
+class CsvLog:
+    """
+    Appends rows to a CSV log (created by prepare_csv), re-checking its size every CSV_ROTATE_CHECK rows.
+    buffered=True keeps the rows in memory until write(), so an event-loop caller can do the file I/O
+    outside its handlers.
+    """
+
+    def __init__(self, path, header, buffered=False):
+        self.path = path
+        self.header = header
+        self.buffered = buffered
+        self.rows = []
+        self.count = 0
+
+    def append(self, row):
+        self.rows.append(row)
+        if not self.buffered:
+            self.write()
+
+    def write(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        if self.count // CSV_ROTATE_CHECK != (self.count + len(rows)) // CSV_ROTATE_CHECK:
+            prepare_csv(self.path, self.header)
+        self.count += len(rows)
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+def rollup(values):
+    values = sorted(values)
+    return {"min": values[0], "max": values[-1], "mean": round(sum(values) / len(values), 4),
+            "p95": percentile(values, 95), "n": len(values)}
+
+
+class Tier:
+    """One rollup resolution: the open bucket plus its segment files."""
+
+    def __init__(self, directory, name, resolution, segment, retention, buffered=False):
+        self.directory = directory
+        self.name = name
+        self.resolution = resolution
+        self.segment = segment
+        self.retention = retention
+        self.bucket = None   # Start of the open bucket
+        self.values = {}     # metric -> raw values in the open bucket
+        self.current_segment = None
+        self.buffered = buffered
+        self.unwritten = []  # (segment start, JSON line) of closed buckets not yet on disk
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, t, sample):
+        bucket = int(t // self.resolution) * self.resolution
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket > self.bucket:
+            self.flush()
+            self.bucket = bucket
+        # Late samples (clock step back) fold into the open bucket
+        for metric, value in sample.items():
+            self.values.setdefault(metric, []).append(value)
+
+    def flush(self):
+        if not self.values:
+            return
+        row = {"t": self.bucket}
+        for metric, values in self.values.items():
+            row[metric] = rollup(values)
+        self.values = {}
+        self.unwritten.append((self.bucket // self.segment * self.segment, json.dumps(row, separators=(',', ':'))))
+        if not self.buffered:
+            self.write()
+
+    def write(self):
+        """Append the closed buckets to their segment files."""
+        lines, self.unwritten = self.unwritten, []
+        for segment, line in lines:
+            if segment != self.current_segment:
+                self.current_segment = segment
+                self.prune(segment)
+            with open(self.segment_path(segment), 'a') as f:
+                f.write(line + "\n")
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(segment)) + ".jsonl")
+
+    def segments(self):
+        """[(segment start, path)] in time order."""
+        found = []
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".jsonl"):
+                start = calendar.timegm(time.strptime(entry[:-len(".jsonl")], "%Y%m%dT%H%M%SZ"))
+                found.append((start, os.path.join(self.directory, entry)))
+        return sorted(found)
+
+    def prune(self, now):
+        """Delete segments that lie entirely outside the retention window."""
+        for start, path in self.segments():
+            if start + self.segment <= now - self.retention:
+                os.remove(path)
+
+    def oldest(self):
+        """Bucket start of the first stored rollup, or None."""
+        for _, path in self.segments():
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        return json.loads(line)["t"]
+                    except ValueError:
+                        continue
+        return None
+
+    def read(self, start, end, metrics=None):
+        rows = []
+        for seg_start, path in self.segments():
+            if seg_start + self.segment <= start or seg_start >= end:
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from a killed process
+                    if start <= row["t"] < end:
+                        if metrics:
+                            row = {k: v for k, v in row.items() if k == "t" or k in metrics}
+                        rows.append(row)
+        return rows
+
+
+class TelemetryStore:
+    """Streams samples ({metric: number}) into every tier; answers range queries from the best one."""
+
+    def __init__(self, name, directory=TELEMETRY_DIR, retention=None, buffered=False):
+        retention = retention or {}
+        self.name = name
+        # buffered: closed buckets stay in memory until write() (see CsvLog)
+        self.tiers = [Tier(os.path.join(directory, name, tier), tier, res, seg, retention.get(tier, keep), buffered)
+                      for tier, (res, seg, keep) in TIERS.items()]
+        now = time.time()
+        for tier in self.tiers:
+            tier.prune(now)
+
+    def add(self, sample, t=None):
+        """Record one sample; non-numeric and missing (None) values are skipped."""
+        t = time.time() if t is None else t
+        numeric = {k: float(v) for k, v in sample.items()
+                   if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        if not numeric:
+            return
+        for tier in self.tiers:
+            tier.add(t, numeric)
+
+    def write(self):
+        """Write the closed buckets kept back by buffered=True."""
+        for tier in self.tiers:
+            tier.write()
+
+    def flush(self):
+        """Write the open buckets (only before a final shutdown: they are not reopened later)."""
+        for tier in self.tiers:
+            tier.flush()
+            tier.write()
+
+    def pick_tier(self, start, end, points=MAX_POINTS):
+        """Coarsest tier with at least `points` rows over the range that still holds `start`."""
+        step = max(1.0, (end - start) / points)
+        candidates = [t for t in self.tiers if t.resolution <= step] or self.tiers[:1]
+        oldest = {t.name: t.oldest() for t in candidates}
+        for tier in reversed(candidates):
+            if oldest[tier.name] is not None and oldest[tier.name] <= start:
+                return tier
+        # Nothing reaches back that far: the tier with the earliest data (finest on a tie)
+        stored = [t for t in candidates if oldest[t.name] is not None]
+        if not stored:
+            return candidates[0]
+        return min(stored, key=lambda t: (oldest[t.name], t.resolution))
+
+    def query(self, start, end=None, metrics=None, points=MAX_POINTS):
+        """Returns (tier name, rows) for [start, end) in epoch seconds."""
+        end = time.time() if end is None else end
+        tier = self.pick_tier(start, end, points)
+        return tier.name, tier.read(start, end, metrics)
+
+
+def parse_duration(text):
+    """'90s', '15m', '12h', '30d' -> seconds."""
+    return float(text[:-1]) * DURATION_UNITS[text[-1]] if text[-1] in DURATION_UNITS else float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query rolled-up telemetry (network, engine)")
+    parser.add_argument("name", help="Store name (network: collector, engine: decision engine)")
+    parser.add_argument("--since", default="1h", help="Range back from now, e.g. 90s, 15m, 12h, 30d")
+    parser.add_argument("--metric", action="append", help="Metric to print (repeatable; default: all)")
+    parser.add_argument("--points", type=int, default=MAX_POINTS, help="Target resolution (rows per range)")
+    parser.add_argument("--dir", default=TELEMETRY_DIR)
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.name, args.dir)
+    tier, rows = store.query(time.time() - parse_duration(args.since), metrics=args.metric, points=args.points)
+    print(f"[TELEMETRY] {args.name}: {len(rows)} rows from the {tier} tier")
+    for row in rows:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row.pop("t")))
+        cells = " | ".join(f"{m} {r['mean']:.2f} (min {r['min']:.2f}, p95 {r['p95']:.2f}, max {r['max']:.2f})"
+                           for m, r in sorted(row.items()))
+        print(f"{stamp} | {cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_qos_allocator.py
+# Edge cases of the water-filling allocator. Run: python -m pytest -q
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from qos_allocator import GUARANTEE_PER_PRIORITY, allocate, water_fill
+
+
+def test_infinite_demand_takes_what_the_others_leave():
+    alloc = water_fill([10.0], [[np.inf, 2.0]], [1.0, 1.0], [0.0, 0.0])
+    assert alloc[0] == pytest.approx([8.0, 2.0])
+
+
+def test_infinite_demands_split_by_weight():
+    alloc = water_fill([9.0], [[np.inf, np.inf]], [2.0, 1.0], [0.0, 0.0])
+    assert alloc[0] == pytest.approx([6.0, 3.0])
+
+
+def test_guarantees_above_capacity_are_scaled_down():
+    alloc = water_fill([10.0], [[np.inf, np.inf]], [1.0, 1.0], [8.0, 12.0])
+    assert alloc[0] == pytest.approx([4.0, 6.0])
+
+
+def test_zero_capacity_allocates_nothing():
+    alloc = water_fill([0.0], [[np.inf, 3.0]], [1.0, 1.0], [1.0, 1.0])
+    assert np.all(np.isfinite(alloc))
+    assert alloc[0] == pytest.approx([0.0, 0.0])
+
+
+def test_leftover_is_spread_by_weight():
+    alloc = water_fill([10.0], [[1.0, 1.0]], [3.0, 1.0], [0.0, 0.0])
+    assert alloc[0] == pytest.approx([1.0 + 6.0, 1.0 + 2.0])
+
+
+def test_demand_below_guarantee_keeps_the_guarantee():
+    alloc = water_fill([10.0], [[0.0, np.inf]], [1.0, 1.0], [2.0, 0.0])
+    assert alloc[0] == pytest.approx([2.0, 8.0])
+
+
+def test_rows_sum_to_capacity():
+    rng = np.random.default_rng(0)
+    capacity = rng.uniform(0, 100, size=200)
+    capacity[:5] = 0.0
+    demand = rng.uniform(0, 60, size=(200, 4))
+    demand[::3, 0] = np.inf
+    weight = rng.uniform(0.5, 5, size=(200, 4))
+    guarantee = rng.uniform(0, 30, size=(200, 4))
+    alloc = water_fill(capacity, demand, weight, guarantee)
+    assert alloc.shape == (200, 4)
+    assert np.all(alloc >= -1e-9)
+    assert alloc.sum(axis=1) == pytest.approx(capacity)
+
+
+def test_allocate_guarantees_by_priority():
+    # Both classes saturate: guarantee (priority %) first, the rest by priority weight
+    alloc = allocate([10.0], [[np.inf, np.inf]], [20, 10])
+    base = np.array([20, 10]) * GUARANTEE_PER_PRIORITY * 10.0
+    rest = 10.0 - base.sum()
+    assert alloc[0] == pytest.approx(base + rest * np.array([2, 1]) / 3)
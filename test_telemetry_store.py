@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_telemetry_store.py
+# CSV log rotation and tier selection of the telemetry store. Run: python -m pytest -q
+
+import csv
+import time
+
+from telemetry_store import TelemetryStore, prepare_csv
+
+HEADER = ["Timestamp", "Throughput (Mbps)"]
+
+
+def read_rows(path):
+    with open(path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_prepare_csv_rotates_on_old_header(tmp_path):
+    path = str(tmp_path / "log.csv")
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows([["Time", "Throughput (Mbps)"], ["12:00:00", "1.5"]])
+    assert prepare_csv(path, HEADER)
+    assert read_rows(path) == [HEADER]
+    assert read_rows(path + ".1")[0] == ["Time", "Throughput (Mbps)"]
+
+
+def test_prepare_csv_keeps_matching_header(tmp_path):
+    path = str(tmp_path / "log.csv")
+    prepare_csv(path, HEADER)
+    with open(path, 'a', newline='') as f:
+        csv.writer(f).writerow(["2026-01-01 12:00:00", "1.5"])
+    assert not prepare_csv(path, HEADER)
+    assert len(read_rows(path)) == 2
+    assert not (tmp_path / "log.csv.1").exists()
+
+
+def test_prepare_csv_rotates_on_size(tmp_path):
+    path = str(tmp_path / "log.csv")
+    prepare_csv(path, HEADER)
+    with open(path, 'a', newline='') as f:
+        csv.writer(f).writerows([["2026-01-01 12:00:00", "1.5"]] * 20)
+    assert prepare_csv(path, HEADER, max_bytes=100)
+    assert read_rows(path) == [HEADER]
+    assert len(read_rows(path + ".1")) == 21
+
+
+def test_pick_tier_for_range(tmp_path):
+    store = TelemetryStore("net", directory=str(tmp_path))
+    now = int(time.time())
+    first = now - 3 * 3600
+    for t in range(first, now, 5):
+        store.add({"throughput": 1.0}, t=t)
+    store.flush()
+    # Short range: per-second rows
+    assert store.pick_tier(now - 600, now).name == "1s"
+    # Two hours at 10 points: per-minute rows are fine enough and reach back far enough
+    name, rows = store.query(now - 2 * 3600, now, points=10)
+    assert name == "1m"
+    assert rows and all(row["t"] % 60 == 0 for row in rows)
+    # Far past all data: the tier with the earliest rollup
+    assert store.pick_tier(now - 30 * 86400, now, points=10).name == "1h"
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# trace_summary.py
+# Print per-stage latency percentiles from qos_trace.log.
+# Usage: python trace_summary.py [trace_log]
+
+import sys
+from qos_trace import TRACE_LOG_FILE, STAGES
+
+
+def load_traces(path):
+    """Return {trace_id: {stage: t_ns}} (first record of each stage wins)."""
+    traces = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3:
+                continue  # Partial line from a killed process
+            trace_id, stage, t_ns = parts
+            stages = traces.setdefault(trace_id, {})
+            if stage not in stages:
+                stages[stage] = int(t_ns)
+    return traces
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summarize(traces):
+    """Latency (ms) between consecutive stages that are present in a trace."""
+    hops = {}
+    for stages in traces.values():
+        present = [s for s in STAGES if s in stages]
+        for a, b in zip(present, present[1:]):
+            hops.setdefault((a, b), []).append((stages[b] - stages[a]) / 1e6)
+        # End-to-end: counters sampled -> meter applied
+        if "stats_request" in stages and "meter_mod" in stages:
+            hops.setdefault(("stats_request", "meter_mod"), []).append(
+                (stages["meter_mod"] - stages["stats_request"]) / 1e6)
+    return hops
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_FILE
+    try:
+        traces = load_traces(path)
+    except FileNotFoundError:
+        print(f"[ERROR] Trace log not found: {path}")
+        return
+
+    hops = summarize(traces)
+    order = {s: i for i, s in enumerate(STAGES)}
+    keys = sorted(hops, key=lambda k: (k == ("stats_request", "meter_mod"), order[k[0]], order[k[1]]))
+
+    print(f"Traces: {len(traces)}  ({path})")
+    print("-" * 86)
+    print(f"{'Stage':<34} | {'N':>6} | {'p50(ms)':>9} | {'p90(ms)':>9} | {'p99(ms)':>9} | {'max(ms)':>9}")
+    print("-" * 86)
+    for a, b in keys:
+        values = sorted(hops[(a, b)])
+        label = f"{a} -> {b}"
+        print(f"{label:<34} | {len(values):>6} | {percentile(values, 50):>9.2f} | "
+              f"{percentile(values, 90):>9.2f} | {percentile(values, 99):>9.2f} | {values[-1]:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,201 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
+import argparse
+import json
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from traffic_video import TokenBucket
 
 # --- Configuration ---
 # IP of h2 (Download User) in the Mininet topology
 TARGET_IP = "10.0.0.2"
 TARGET_PORT = 5002
 
+DEFAULT_FLOWS = 10         # Parallel connections (same as the former 'iperf -P 10')
+SEND_CHUNK = 256 * 1024    # Bytes per send() from the reused buffer
+SENDFILE_SIZE = 8 * 1024 * 1024  # Payload file for --sendfile, streamed repeatedly
+REPORT_INTERVAL = 1.0      # Seconds between per-flow goodput reports
+RECONNECT_DELAY = 1.0      # Seconds before reconnecting a dropped flow
+
+# --- Traffic profiles ---
+# constant: always sending
+# onoff:    exponential ON and OFF periods (mean --on / --off seconds)
+# pareto:   Pareto-distributed ON periods (heavy-tailed "file sizes", shape --alpha), exponential OFF
+PROFILES = ("constant", "onoff", "pareto")
+
+
+class DownloadFlow:
+    """
+    One persistent TCP connection. The socket stays open across OFF periods, so
+    there is no per-cycle connection setup (unlike re-spawning iperf every 5 seconds).
+    """
+
+    def __init__(self, flow_id, target, profile="constant", mean_on=5.0, mean_off=2.0,
+                 alpha=1.5, mbps=None, payload=None, sendfile_obj=None):
+        self.flow_id = flow_id
+        self.target = target
+        self.profile = profile
+        self.mean_on = mean_on
+        self.mean_off = mean_off
+        self.alpha = alpha
+        self.payload = payload            # Shared memoryview, never copied
+        self.sendfile_obj = sendfile_obj  # Shared payload file for socket.sendfile()
+        self.bucket = TokenBucket(mbps * 1e6 / 8, SEND_CHUNK * 2) if mbps else None
+        self.rng = random.Random(flow_id)
+
+        self.bytes_sent = 0       # Bytes accepted by the socket (goodput at the sender), read by the reporter
+        self.reconnects = 0
+        self.active = False
+        self.sock = None
+
+    def _on_period(self):
+        if self.profile == "onoff":
+            return self.rng.expovariate(1.0 / self.mean_on)
+        if self.profile == "pareto":
+            # Scale so the mean ON period is mean_on (alpha > 1)
+            xm = self.mean_on * (self.alpha - 1) / self.alpha
+            return xm * self.rng.paretovariate(self.alpha)
+        return float("inf")
+
+    def _off_period(self):
+        return self.rng.expovariate(1.0 / self.mean_off)
+
+    def _connect(self):
+        return socket.create_connection(self.target)
+
+    def _send_for(self, sock, seconds, stop_at, stop_event):
+        end = min(stop_at, time.monotonic() + seconds)
+        offset = 0
+        while not stop_event.is_set() and time.monotonic() < end:
+            if self.bucket:
+                # Wait on the event (not time.sleep) so a rate-capped flow stops at once
+                if stop_event.wait(self.bucket.delay(SEND_CHUNK)):
+                    break
+            if self.sendfile_obj is not None:
+                sent = sock.sendfile(self.sendfile_obj, offset, SEND_CHUNK)
+                offset = (offset + sent) % SENDFILE_SIZE
+            else:
+                sent = sock.send(self.payload)
+            if self.bucket:
+                self.bucket.consume(sent)  # send() may take less than a chunk: charge what went out
+            self.bytes_sent += sent
+
+    def stop(self):
+        """Unblock a send() stuck on a full socket buffer (called after stop_event is set)."""
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self, stop_at, stop_event):
+        while not stop_event.is_set() and time.monotonic() < stop_at:
+            try:
+                if self.sock is None:
+                    self.sock = self._connect()
+                self.active = True
+                self._send_for(self.sock, self._on_period(), stop_at, stop_event)
+                self.active = False
+                if self.profile != "constant":
+                    off = min(self._off_period(), max(0.0, stop_at - time.monotonic()))
+                    stop_event.wait(off)
+            except OSError as e:
+                self.active = False
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                if stop_event.is_set():
+                    break  # Socket shut down by stop()
+                self.reconnects += 1
+                print(f"[FLOW {self.flow_id}] {e} - reconnecting in {RECONNECT_DELAY}s")
+                stop_event.wait(RECONNECT_DELAY)
+        self.active = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def run_load(flows=DEFAULT_FLOWS, duration=30.0, profile="constant", mean_on=5.0, mean_off=2.0,
+             alpha=1.5, mbps=None, use_sendfile=False, target=(TARGET_IP, TARGET_PORT),
+             report=True, json_file=None):
+    """
+    Run `flows` persistent connections for `duration` seconds (None: until Ctrl+C).
+    Prints per-flow goodput every REPORT_INTERVAL and returns the final summary.
+    """
+    payload = memoryview(b'\0' * SEND_CHUNK)
+    sendfile_obj = None
+    if use_sendfile:
+        sendfile_obj = tempfile.TemporaryFile()
+        sendfile_obj.write(b'\0' * SENDFILE_SIZE)
+        sendfile_obj.flush()
+
+    workers = [DownloadFlow(i, target, profile, mean_on, mean_off, alpha, mbps, payload, sendfile_obj)
+               for i in range(flows)]
+    stop_event = threading.Event()
+    start = time.monotonic()
+    stop_at = start + duration if duration else float("inf")
+    threads = [threading.Thread(target=w.run, args=(stop_at, stop_event), daemon=True) for w in workers]
+    for t in threads:
+        t.start()
+
+    intervals = []
+    last = [0] * flows
+    try:
+        next_report = start + REPORT_INTERVAL
+        while time.monotonic() < stop_at and any(t.is_alive() for t in threads):
+            time.sleep(max(0.0, min(next_report, stop_at) - time.monotonic()))
+            now = time.monotonic()
+            rates = []
+            for i, w in enumerate(workers):
+                sent = w.bytes_sent
+                rates.append((sent - last[i]) * 8 / REPORT_INTERVAL / 1e6)
+                last[i] = sent
+            intervals.append(rates)
+            if report:
+                active = sum(1 for w in workers if w.active)
+                per_flow = " ".join(f"{r:5.2f}" for r in rates)
+                print(f"[{int(now - start):>4}s] Total {sum(rates):7.2f} Mbps | active {active:>3}/{flows} | {per_flow}")
+            next_report += REPORT_INTERVAL
+    except KeyboardInterrupt:
+        print("\n[STOP] Stopping download flows.")
+    finally:
+        # Tell every flow to stop (and unblock its send) before waiting for it
+        stop_event.set()
+        for w in workers:
+            w.stop()
+        for t in threads:
+            t.join(timeout=2)
+        if sendfile_obj is not None:
+            sendfile_obj.close()
+
+    elapsed = max(0.001, time.monotonic() - start)
+    summary = {
+        "target": f"{target[0]}:{target[1]}",
+        "profile": profile,
+        "flows": flows,
+        "duration_sec": round(elapsed, 2),
+        "total_goodput_mbps": round(sum(w.bytes_sent for w in workers) * 8 / elapsed / 1e6, 3),
+        "per_flow": [{
+            "flow_id": w.flow_id,
+            "goodput_mbps": round(w.bytes_sent * 8 / elapsed / 1e6, 3),
+            "bytes": w.bytes_sent,
+            "reconnects": w.reconnects,
+        } for w in workers],
+        "interval_total_mbps": [round(sum(r), 3) for r in intervals],
+    }
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+    print(f"[INFO] Average goodput: {summary['total_goodput_mbps']} Mbps over {flows} flows ({elapsed:.1f} sec)")
+    return summary
+
 
 def print_menu():
     print("\n===========================================")
@@ -40,10 +228,9 @@ def run_simulation():
                 if not dur.isdigit():
                     print("Please enter a number.")
                     continue
-                # Use -P 10 to create 10 parallel connections for aggressive bandwidth usage
-                print(f"\n[INFO] Starting aggressive download... ({dur} sec, 10 parallel connections)")
-                # -c: Client, -p: Port, -t: Time, -i: Interval, -P: Parallel streams
-                os.system(f"iperf -c {TARGET_IP} -p {TARGET_PORT} -t {dur} -P 10 -i 1")
+                # 10 persistent parallel connections for aggressive bandwidth usage
+                print(f"\n[INFO] Starting aggressive download... ({dur} sec, {DEFAULT_FLOWS} parallel connections)")
+                run_load(DEFAULT_FLOWS, float(dur))
 
             except KeyboardInterrupt:
                 print("\n\n[STOP] Stopping download.")
@@ -56,11 +243,8 @@ def run_simulation():
                 print(f"\n[INFO] Starting continuous download (max TCP speed)")
                 print("[INFO] Press Ctrl+C to stop and return to the menu.")
 
-                # Loop until user stops manually
-                while True:
-                    # Use -P 10 for multiple parallel flows
-                    cmd = f"iperf -c {TARGET_IP} -p {TARGET_PORT} -t 5 -P 10 -i 1"
-                    os.system(cmd)
+                # Connections stay open until the user stops (no restart, no slow-start per cycle)
+                run_load(DEFAULT_FLOWS, None)
 
             except KeyboardInterrupt:
                 print("\n\n[STOP] Continuous download stopped.")
@@ -73,5 +257,31 @@ def run_simulation():
         input("Press Enter to return to the menu...")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Download load generator (no arguments: interactive menu)")
+    parser.add_argument("--target", default=f"{TARGET_IP}:{TARGET_PORT}", help="Receiver ip:port")
+    parser.add_argument("--flows", type=int, default=DEFAULT_FLOWS, help="Persistent TCP connections")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds (0: until Ctrl+C)")
+    parser.add_argument("--profile", choices=PROFILES, default="constant")
+    parser.add_argument("--on", type=float, default=5.0, help="Mean ON period (onoff/pareto), seconds")
+    parser.add_argument("--off", type=float, default=2.0, help="Mean OFF period (onoff/pareto), seconds")
+    parser.add_argument("--alpha", type=float, default=1.5, help="Pareto shape (> 1)")
+    parser.add_argument("--mbps", type=float, default=None, help="Per-flow rate cap (default: max TCP speed)")
+    parser.add_argument("--sendfile", action="store_true", help="Send the payload with sendfile() instead of a reused buffer")
+    parser.add_argument("--json", default=None, help="Write the goodput summary to this file")
+    parser.add_argument("--quiet", action="store_true", help="No per-interval report")
+    args = parser.parse_args()
+    if args.alpha <= 1:
+        parser.error("--alpha must be > 1 (the Pareto ON period has no finite mean otherwise)")
+
+    ip, _, port = args.target.partition(':')
+    print(f"[INFO] {args.flows} flows -> {args.target}, profile={args.profile}, duration={args.duration or 'unlimited'}")
+    run_load(args.flows, args.duration or None, args.profile, args.on, args.off, args.alpha, args.mbps,
+             args.sendfile, (ip, int(port or TARGET_PORT)), not args.quiet, args.json)
+
+
 if __name__ == "__main__":
-    run_simulation()
+    if len(sys.argv) > 1:
+        main()
+    else:
+        run_simulation()
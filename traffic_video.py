@@ -1,4 +1,9 @@
+import argparse
+import heapq
+import multiprocessing
 import socket
+import struct
+import sys
 import time
 import math
 
@@ -6,6 +11,204 @@ import math
 TARGET_IP = "10.0.0.1"
 TARGET_PORT = 5001
 
+# --- Packet format ---
+# Every datagram starts with a 24-byte header so the receiver can measure loss, delay and jitter:
+#   magic(4s) | stream_id(H) | flags(H) | seq(I) | frame(I) | send_time_ns(Q, CLOCK_REALTIME)
+VIDEO_MAGIC = b'QVID'
+VIDEO_HEADER = struct.Struct('!4sHHIIQ')
+FLAG_FRAME_START = 0x1
+
+# Linux UDP GSO: one sendto() carries up to 64 datagrams, split by the kernel
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+BATCH_MAX_SEC = 0.001  # A batch leaves at line rate: keep it to ~1 ms of the configured rate
+
+
+class TokenBucket:
+    """Monotonic-clock token bucket (bytes). wait() blocks until nbytes may be sent."""
+
+    def __init__(self, rate_bytes, burst_bytes):
+        self.rate = rate_bytes
+        self.burst = burst_bytes
+        self.tokens = burst_bytes
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, nbytes):
+        """Seconds until nbytes are available (0 when they can be sent now)."""
+        self._refill(time.monotonic())
+        if self.tokens >= nbytes:
+            return 0.0
+        return (nbytes - self.tokens) / self.rate
+
+    def consume(self, nbytes):
+        self.tokens -= nbytes
+
+    def wait(self, nbytes):
+        d = self.delay(nbytes)
+        if d > 0:
+            time.sleep(d)
+            self._refill(time.monotonic())
+        self.consume(nbytes)
+
+
+class VideoStream:
+    """
+    One paced UDP video stream.
+    Packets are built in a preallocated buffer; only the header of each packet is
+    rewritten before a send, and slices are passed to the socket as memoryviews (no copies).
+    """
+
+    def __init__(self, sock, target, mbps, stream_id=0, fps=30, pkt_size=1200, use_gso=True):
+        self.sock = sock
+        self.target = target
+        self.stream_id = stream_id
+        self.pkt_size = max(VIDEO_HEADER.size, pkt_size)
+        self.fps = fps
+
+        rate_bytes = mbps * 1_000_000 / 8
+        self.pkts_per_frame = max(1, math.ceil(rate_bytes / fps / self.pkt_size))
+
+        # Batch size: one GSO super-datagram or a run of single sends, never more than one frame
+        # and never more than ~1 ms at the configured rate (the batch itself is not paced)
+        self.gso = use_gso and self._enable_gso()
+        self.batch = min(GSO_MAX_SEGMENTS, self.pkts_per_frame,
+                         max(1, int(rate_bytes * BATCH_MAX_SEC / self.pkt_size)))
+        if self.gso:
+            self.batch = min(self.batch, GSO_MAX_BYTES // self.pkt_size)
+
+        self.buf = bytearray(b'x' * (self.batch * self.pkt_size))
+        self.view = memoryview(self.buf)
+        # Two batches of burst: absorbs sleep overshoot without losing rate
+        self.bucket = TokenBucket(rate_bytes, 2 * self.batch * self.pkt_size)
+
+        self.seq = 0
+        self.pkts_sent = 0
+        self.bytes_sent = 0
+
+    def _enable_gso(self):
+        try:
+            self.sock.setsockopt(socket.SOL_UDP, UDP_SEGMENT, self.pkt_size)
+            return True
+        except OSError:
+            return False
+
+    def next_delay(self):
+        return self.bucket.delay(self.batch * self.pkt_size)
+
+    def send_batch(self):
+        """Stamp and send the next batch of packets. Returns the number of packets sent."""
+        n = self.batch
+        now_ns = time.time_ns()
+        for i in range(n):
+            seq = self.seq + i
+            frame, pos = divmod(seq, self.pkts_per_frame)
+            flags = FLAG_FRAME_START if pos == 0 else 0
+            VIDEO_HEADER.pack_into(self.buf, i * self.pkt_size, VIDEO_MAGIC, self.stream_id,
+                                   flags, seq & 0xffffffff, frame & 0xffffffff, now_ns)
+
+        size = n * self.pkt_size
+        try:
+            if self.gso:
+                self.sock.sendto(self.view[:size], self.target)
+            else:
+                for i in range(n):
+                    off = i * self.pkt_size
+                    self.sock.sendto(self.view[off:off + self.pkt_size], self.target)
+        except OSError as e:
+            if self.gso:
+                # GSO unsupported on this path (e.g. EIO from the device): fall back to single sends
+                print(f"[VIDEO] Stream {self.stream_id}: GSO send failed ({e}), using single sends")
+                self.gso = False
+                return 0
+            raise
+
+        self.bucket.consume(size)
+        self.seq += n
+        self.pkts_sent += n
+        self.bytes_sent += size
+        return n
+
+
+def run_streams(targets, mbps, duration, fps=30, pkt_size=1200, first_stream_id=0, use_gso=True):
+    """
+    Drive several streams from one process. The stream whose token bucket frees up
+    first is served next, so a single loop paces all of them.
+    targets: list of (ip, port), one stream each.
+    """
+    streams = []
+    for i, target in enumerate(targets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        streams.append(VideoStream(sock, target, mbps, first_stream_id + i, fps, pkt_size, use_gso))
+
+    start = time.monotonic()
+    end = start + duration
+    schedule = [(start, i) for i in range(len(streams))]
+    heapq.heapify(schedule)
+
+    while schedule:
+        due, i = heapq.heappop(schedule)
+        now = time.monotonic()
+        if now >= end:
+            break
+        if due > now:
+            time.sleep(due - now)
+
+        stream = streams[i]
+        wait = stream.next_delay()
+        if wait <= 0:
+            stream.send_batch()
+            wait = stream.next_delay()
+        heapq.heappush(schedule, (time.monotonic() + wait, i))
+
+    elapsed = max(0.001, time.monotonic() - start)
+    results = []
+    for stream in streams:
+        stream.sock.close()
+        results.append({
+            "stream_id": stream.stream_id,
+            "target": f"{stream.target[0]}:{stream.target[1]}",
+            "packets": stream.pkts_sent,
+            "mbps": round(stream.bytes_sent * 8 / elapsed / 1e6, 2),
+            "gso": stream.gso,
+        })
+    return results
+
+
+def _worker(targets, mbps, duration, fps, pkt_size, first_stream_id, use_gso, queue):
+    queue.put(run_streams(targets, mbps, duration, fps, pkt_size, first_stream_id, use_gso))
+
+
+def run_fanout(targets, mbps, duration, procs=1, fps=30, pkt_size=1200, use_gso=True):
+    """Spread the streams over `procs` processes (one Python loop tops out well below 1 Gbps)."""
+    procs = max(1, min(procs, len(targets)))
+    if procs == 1:
+        return run_streams(targets, mbps, duration, fps, pkt_size, 0, use_gso)
+
+    queue = multiprocessing.Queue()
+    workers = []
+    per_proc = math.ceil(len(targets) / procs)
+    for p in range(procs):
+        chunk = targets[p * per_proc:(p + 1) * per_proc]
+        if not chunk:
+            continue
+        w = multiprocessing.Process(target=_worker, args=(chunk, mbps, duration, fps, pkt_size,
+                                                          p * per_proc, use_gso, queue))
+        w.start()
+        workers.append(w)
+
+    results = []
+    for _ in workers:
+        results.extend(queue.get())
+    for w in workers:
+        w.join()
+    return sorted(results, key=lambda r: r["stream_id"])
+
 
 def send_video_like_udp(mbps, duration, fps=30, pkt_size=1200):
     """
@@ -13,32 +216,15 @@ def send_video_like_udp(mbps, duration, fps=30, pkt_size=1200):
     Ensures the stream completes cleanly within the given duration (seconds).
     """
     duration = int(duration)
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    payload = b'x' * pkt_size
-
-    bytes_per_sec = mbps * 1_000_000 / 8
-    bytes_per_frame = bytes_per_sec / fps
-    pkts_per_frame = math.ceil(bytes_per_frame / pkt_size)
-
-    total_frames = int(duration * fps)
+    pkts_per_frame = math.ceil(mbps * 1_000_000 / 8 / fps / pkt_size)
 
     print(f"\n[VIDEO] Start Streaming: {mbps} Mbps for {duration} sec")
     print(f"[VIDEO] FPS={fps}, Packet={pkt_size}B, Packets/Frame={pkts_per_frame}")
     print("------------------------------------------------------------")
 
-    for frame in range(total_frames):
-        frame_start = time.time()
-
-        for _ in range(pkts_per_frame):
-            sock.sendto(payload, (TARGET_IP, TARGET_PORT))
-
-        elapsed = time.time() - frame_start
-        sleep_time = max(0, (1.0 / fps) - elapsed)
-        time.sleep(sleep_time)
+    results = run_streams([(TARGET_IP, TARGET_PORT)], mbps, duration, fps, pkt_size)
 
-    print("[VIDEO] Streaming Finished.\n")
-    sock.close()
+    print(f"[VIDEO] Streaming Finished. Achieved {results[0]['mbps']} Mbps ({results[0]['packets']} packets).\n")
 
 
 def print_menu():
@@ -97,5 +283,38 @@ def run_simulation():
         print("[INFO] Streaming finished → returning to menu.\n")
 
 
+def parse_target(value):
+    ip, _, port = value.partition(':')
+    return ip, int(port or TARGET_PORT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paced UDP video traffic generator (no arguments: interactive menu)")
+    parser.add_argument("--target", action="append", type=parse_target,
+                        help=f"Receiver ip[:port], repeatable (default {TARGET_IP}:{TARGET_PORT})")
+    parser.add_argument("--mbps", type=float, default=6, help="Bitrate per stream (Mbps)")
+    parser.add_argument("--streams", type=int, default=1, help="Streams per target")
+    parser.add_argument("--procs", type=int, default=1, help="Sender processes")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--pkt-size", type=int, default=1200)
+    parser.add_argument("--no-gso", action="store_true", help="Disable UDP GSO batching")
+    args = parser.parse_args()
+
+    targets = (args.target or [(TARGET_IP, TARGET_PORT)]) * args.streams
+    print(f"[VIDEO] {len(targets)} streams x {args.mbps} Mbps, {args.procs} process(es), {args.duration} sec")
+    results = run_fanout(targets, args.mbps, args.duration, args.procs, args.fps, args.pkt_size, not args.no_gso)
+
+    total = 0.0
+    for r in results:
+        total += r["mbps"]
+        print(f"[VIDEO] stream {r['stream_id']:>3} -> {r['target']:<18} {r['mbps']:>8.2f} Mbps  "
+              f"{r['packets']:>9} pkts  gso={r['gso']}")
+    print(f"[VIDEO] Total: {total:.2f} Mbps")
+
+
 if __name__ == "__main__":
-    run_simulation()
+    if len(sys.argv) > 1:
+        main()
+    else:
+        run_simulation()
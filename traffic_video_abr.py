@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import socket
+import struct
+import sys
+import threading
 import time
 
 # --- Configuration ---
@@ -18,81 +22,257 @@ QUALITIES = [
     ("1080p (FHD)",  8_000_000)   # 8 Mbps (max)
 ]
 
+# --- Segment format ---
+# Each segment on the TCP stream starts with a 32-byte header, followed by payload_len bytes,
+# so the receiver (video_qoe_probe.py) can follow playback and measure stalls:
+#   magic(4s) | player_id(H) | quality_idx(H) | seq(I) | media_ms(I) | payload_len(I) | reserved(I) | send_time_ns(Q)
+ABR_MAGIC = b'QABR'
+ABR_HEADER = struct.Struct('!4sHHIIIIQ')
 
-def run_abr_simulation(duration_sec=60):
-    print(f"\n[ABR] Connecting to Video Receiver at {TARGET_IP}:{TARGET_PORT} (TCP)...")
 
-    try:
-        # Create and connect TCP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((TARGET_IP, TARGET_PORT))
-    except Exception as e:
-        print(f"[ERROR] Connection Failed: {e}")
-        print("Tip: Ensure 'iperf -s -p 5001' is running on host h1 (without UDP -u option).")
-        return
+# --- Player model ---
+SEGMENT_SEC = 2.0        # Media duration per segment
+MAX_BUFFER_SEC = 30.0    # Player stops fetching above this buffer level
+RESERVOIR_SEC = 5.0      # Buffer-based selection: below this, always the lowest rung
+CUSHION_SEC = 15.0       # ... and from reservoir + cushion upwards, the highest rung
+THROUGHPUT_SAFETY = 0.9  # Only pick rungs below 90% of the estimated throughput
+SNDBUF_BYTES = 128 * 1024  # Small send buffer so sendall() timing follows the network
 
-    print("[ABR] Connection Established. Starting Adaptive Streaming...")
-    print("------------------------------------------------------------------")
-    print(f"{'Time':<8} | {'Quality':<12} | {'Bitrate':<10} | {'TxTime':<8} | {'Status'}")
-    print("------------------------------------------------------------------")
 
-    start_time = time.time()
-    current_idx = 3  # Start by attempting the highest quality (1080p)
+class ThroughputEstimator:
+    """Harmonic mean over the last N segment downloads plus an EWMA; estimate() takes the lower one."""
+
+    def __init__(self, window=5, alpha=0.3):
+        self.samples = []
+        self.window = window
+        self.alpha = alpha
+        self.ewma = None
+
+    def add(self, bits, seconds):
+        bps = bits / max(0.001, seconds)
+        self.samples.append(bps)
+        if len(self.samples) > self.window:
+            self.samples.pop(0)
+        self.ewma = bps if self.ewma is None else self.alpha * bps + (1 - self.alpha) * self.ewma
+
+    def harmonic_mean(self):
+        if not self.samples:
+            return None
+        return len(self.samples) / sum(1.0 / s for s in self.samples)
+
+    def estimate(self):
+        hm = self.harmonic_mean()
+        if hm is None:
+            return None
+        return min(hm, self.ewma)
+
+
+def select_rung(buffer_sec, throughput_bps):
+    """
+    Buffer-based selection (BBA-style): the buffer level between the reservoir and
+    reservoir + cushion maps linearly onto the rungs. The result may be at most one
+    rung above the buffer's choice and never above what the measured throughput sustains.
+    """
+    if throughput_bps is None:
+        return 0
+
+    top = len(QUALITIES) - 1
+    if buffer_sec <= RESERVOIR_SEC:
+        buffer_idx = 0
+    elif buffer_sec >= RESERVOIR_SEC + CUSHION_SEC:
+        buffer_idx = top
+    else:
+        buffer_idx = int((buffer_sec - RESERVOIR_SEC) / CUSHION_SEC * (top + 1))
+
+    rate_idx = 0
+    for idx, (_, bitrate) in enumerate(QUALITIES):
+        if bitrate <= throughput_bps * THROUGHPUT_SAFETY:
+            rate_idx = idx
 
-    # Simulation loop for the specified duration
-    while (time.time() - start_time) < duration_sec:
-        quality_name, bitrate = QUALITIES[current_idx]
+    return min(rate_idx, buffer_idx + 1)
 
-        # 1. Calculate the payload size for one second of video (bytes)
-        # TCP streams data regardless of packet boundaries
-        chunk_size = int(bitrate / 8)
-        payload = b'x' * chunk_size
 
-        # 2. Transmit and measure time
-        chunk_start = time.time()
+class AbrPlayer:
+    """
+    Simulated ABR client: fetches segments over one TCP connection, keeps a playback buffer
+    that drains in real time, and records rebuffering (stall) events.
+    """
+
+    def __init__(self, player_id=0, target=(TARGET_IP, TARGET_PORT), segment_sec=SEGMENT_SEC, verbose=True):
+        self.player_id = player_id
+        self.target = target
+        self.segment_sec = segment_sec
+        self.verbose = verbose
+
+        # One preallocated segment buffer, sized for the top rung; segments are slices of it
+        self.buf = bytearray(b'x' * (ABR_HEADER.size + int(QUALITIES[-1][1] * segment_sec / 8)))
+        self.view = memoryview(self.buf)
+        self.estimator = ThroughputEstimator()
+
+        self.buffer_sec = 0.0
+        self.playing = False
+        self.quality_idx = 0
+        self.seq = 0
+
+        # Session statistics
+        self.rebuffer_events = 0
+        self.stall_sec = 0.0
+        self.startup_sec = None
+        self.switches = 0
+        self.bits_played = 0.0
+        self.segments = 0
+
+    def log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def fetch_segment(self, sock, quality_idx):
+        """Send one segment from the preallocated buffer. Returns the transfer time (seconds)."""
+        bitrate = QUALITIES[quality_idx][1]
+        payload_len = int(bitrate * self.segment_sec / 8)
+        ABR_HEADER.pack_into(self.buf, 0, ABR_MAGIC, self.player_id, quality_idx, self.seq,
+                             int(self.segment_sec * 1000), payload_len, 0, time.time_ns())
+        start = time.monotonic()
+        sock.sendall(self.view[:ABR_HEADER.size + payload_len])
+        self.seq += 1
+        return time.monotonic() - start
+
+    def play(self, duration_sec, start_time=None):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF_BYTES)
+            sock.connect(self.target)
+        except Exception as e:
+            print(f"[ERROR] Player {self.player_id}: Connection Failed: {e}")
+            return self.summary(0)
+
+        session_start = start_time or time.monotonic()
         try:
-            sock.sendall(payload)  # Blocks until buffer is accepted (reflects network speed)
-        except BrokenPipeError:
-            print("[ERROR] Connection closed by remote host.")
-            break
-
-        chunk_end = time.time()
-        tx_time = chunk_end - chunk_start
-
-        # 3. ABR decision logic (quality adjustment)
-        status = "Stable"
-
-        # (A) Congestion: sending 1 second of video takes longer than 1 second -> risk of buffering
-        if tx_time > 1.0:
-            if current_idx > 0:
-                current_idx -= 1
-                status = "DOWNGRADE (Congestion)"
-            else:
-                status = "Buffering (Min Quality)"
-
-        # (B) Plenty of headroom: sending 1 second of video in under 0.8 seconds -> safe to upgrade
-        elif tx_time < 0.8:
-            if current_idx < len(QUALITIES) - 1:
-                current_idx += 1
-                status = "UPGRADE (Clear)"
-
-        # Log output
-        elapsed_total = int(time.time() - start_time)
-        print(f"{elapsed_total}s      | {quality_name:<12} | {bitrate/1e6:.1f}M      | {tx_time:.2f}s    | {status}")
-
-        # 4. Pacing: if we sent too fast, sleep the remainder to mimic real-time playback
-        # Example: if 1 second of video sent in 0.5 sec, rest for 0.5 sec (TCP flow control)
-        sleep_time = max(0, 1.0 - tx_time)
-        time.sleep(sleep_time)
+            while (time.monotonic() - session_start) < duration_sec:
+                # 1. Pick the rung for the next segment
+                new_idx = select_rung(self.buffer_sec, self.estimator.estimate())
+                if new_idx != self.quality_idx and self.segments > 0:
+                    self.switches += 1
+                    status = "UPGRADE" if new_idx > self.quality_idx else "DOWNGRADE"
+                else:
+                    status = "Stable"
+                self.quality_idx = new_idx
+                quality_name, bitrate = QUALITIES[new_idx]
+
+                # 2. Download it; playback keeps draining the buffer meanwhile
+                try:
+                    tx_time = self.fetch_segment(sock, new_idx)
+                except (BrokenPipeError, ConnectionResetError):
+                    print(f"[ERROR] Player {self.player_id}: Connection closed by remote host.")
+                    break
+                self.estimator.add(bitrate * self.segment_sec, tx_time)
+
+                if self.playing:
+                    if tx_time > self.buffer_sec:
+                        # Buffer ran dry before the segment arrived: rebuffering
+                        stall = tx_time - self.buffer_sec
+                        self.rebuffer_events += 1
+                        self.stall_sec += stall
+                        self.bits_played += self.buffer_sec * bitrate
+                        self.buffer_sec = 0.0
+                        status = f"REBUFFER {stall:.2f}s"
+                    else:
+                        self.buffer_sec -= tx_time
+                        self.bits_played += tx_time * bitrate
+                else:
+                    self.playing = True
+                    self.startup_sec = time.monotonic() - session_start
 
+                self.buffer_sec += self.segment_sec
+                self.segments += 1
+
+                elapsed_total = int(time.monotonic() - session_start)
+                self.log(f"P{self.player_id:<3} {elapsed_total}s      | {quality_name:<12} | {bitrate/1e6:.1f}M      | "
+                         f"{tx_time:.2f}s    | Buf {self.buffer_sec:5.1f}s | {status}")
+
+                # 3. Buffer full: idle (while playing) until there is room for one more segment
+                excess = self.buffer_sec - (MAX_BUFFER_SEC - self.segment_sec)
+                if excess > 0:
+                    time.sleep(excess)
+                    self.buffer_sec -= excess
+                    self.bits_played += excess * bitrate
+        finally:
+            sock.close()
+
+        return self.summary(time.monotonic() - session_start)
+
+    def summary(self, elapsed):
+        played = max(0.001, elapsed - self.stall_sec)
+        return {
+            "player_id": self.player_id,
+            "segments": self.segments,
+            "avg_bitrate_mbps": round(self.bits_played / played / 1e6, 2),
+            "rebuffer_events": self.rebuffer_events,
+            "stall_sec": round(self.stall_sec, 2),
+            "startup_sec": round(self.startup_sec, 2) if self.startup_sec is not None else None,
+            "quality_switches": self.switches,
+        }
+
+
+def run_players(num_players, duration_sec, target=(TARGET_IP, TARGET_PORT), segment_sec=SEGMENT_SEC):
+    """Run several players concurrently (one thread and connection each)."""
+    players = [AbrPlayer(i, target, segment_sec, verbose=(num_players == 1)) for i in range(num_players)]
+    results = [None] * num_players
+    start = time.monotonic()
+
+    def worker(i):
+        results[i] = players[i].play(duration_sec, start)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(num_players)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def print_results(results):
+    print("------------------------------------------------------------------")
+    print(f"{'Player':<7} | {'Segs':>5} | {'AvgRate':>8} | {'Rebuf':>5} | {'Stall':>7} | {'Startup':>7} | {'Switch':>6}")
+    for r in results:
+        startup = f"{r['startup_sec']:.2f}s" if r['startup_sec'] is not None else "-"
+        print(f"{r['player_id']:<7} | {r['segments']:>5} | {r['avg_bitrate_mbps']:>7.2f}M | "
+              f"{r['rebuffer_events']:>5} | {r['stall_sec']:>6.2f}s | {startup:>7} | {r['quality_switches']:>6}")
+
+
+def run_abr_simulation(duration_sec=60):
+    print(f"\n[ABR] Connecting to Video Receiver at {TARGET_IP}:{TARGET_PORT} (TCP)...")
+    print("[ABR] Starting Adaptive Streaming (buffer-based player model)...")
+    print("------------------------------------------------------------------")
+    print(f"{'Player':<4} {'Time':<8} | {'Quality':<12} | {'Bitrate':<10} | {'TxTime':<8} | {'Buffer':<10} | {'Status'}")
+    print("------------------------------------------------------------------")
+
+    results = run_players(1, duration_sec)
+    print_results(results)
     print("\n[ABR] Streaming Finished.")
-    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ABR video client model (no arguments: interactive prompt)")
+    parser.add_argument("--players", type=int, default=1, help="Concurrent simulated players")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds")
+    parser.add_argument("--segment-sec", type=float, default=SEGMENT_SEC)
+    parser.add_argument("--target", default=f"{TARGET_IP}:{TARGET_PORT}", help="Receiver ip:port")
+    args = parser.parse_args()
+
+    ip, _, port = args.target.partition(':')
+    print(f"[ABR] {args.players} player(s) -> {args.target}, {args.duration} sec, {args.segment_sec}s segments")
+    results = run_players(args.players, args.duration, (ip, int(port or TARGET_PORT)), args.segment_sec)
+    print_results(results)
 
 
 if __name__ == "__main__":
-    try:
-        dur = input("Enter playback duration (seconds) (default 60): ")
-        dur = int(dur) if dur.strip() else 60
-        run_abr_simulation(dur)
-    except KeyboardInterrupt:
-        print("\n[STOP] User interrupted.")
+    if len(sys.argv) > 1:
+        main()
+    else:
+        try:
+            dur = input("Enter playback duration (seconds) (default 60): ")
+            dur = int(dur) if dur.strip() else 60
+            run_abr_simulation(dur)
+        except KeyboardInterrupt:
+            print("\n[STOP] User interrupted.")
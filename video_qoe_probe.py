@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# video_qoe_probe.py
+# Receiver-side QoE probe for the video user (h1), replacing `nc -lk -p 5001 > /dev/null`.
+#  - UDP (traffic_video.py): true loss from sequence numbers, one-way delay, RFC 3550 jitter
+#  - TCP (traffic_video_abr.py): segment arrivals drive a playback buffer -> stall time, rebuffer events
+# A QoE snapshot is written every second to latest_qoe.json (read by current_network.py)
+# and optionally POSTed to the decision engine (/qoe).
+
+import argparse
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from traffic_video import VIDEO_HEADER, VIDEO_MAGIC
+from traffic_video_abr import ABR_HEADER, ABR_MAGIC
+
+# --- Configuration ---
+LISTEN_PORT = 5001
+QOE_JSON_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "latest_qoe.json")
+REPORT_INTERVAL = 1.0  # seconds
+STREAM_IDLE_REPORTS = 5  # Forget UDP streams silent for this many reports
+
+RECV_BATCH = 64                              # Datagrams (or GRO super-datagrams) drained per wake-up
+RECV_BUF_SIZE = 65536                        # One GRO super-datagram
+TCP_BUF_SIZE = 256 * 1024
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)    # Linux UDP receive offload (coalesced datagrams)
+GRO_CMSG_SPACE = socket.CMSG_SPACE(4)
+
+
+class UdpStreamStats:
+    """Per-stream counters for one interval plus running jitter."""
+
+    def __init__(self, seq):
+        self.max_seq = seq - 1
+        self.interval_base = seq - 1   # max_seq at the start of the interval
+        self.received = 0
+        self.reordered = 0
+        self.bytes = 0
+        self.owd_sum = 0
+        self.owd_min = None
+        self.owd_max = 0
+        self.last_transit = None
+        self.jitter_ns = 0.0
+        self.idle = 0  # Consecutive reports without packets
+
+    def on_packet(self, seq, send_ns, recv_ns, size):
+        if seq > self.max_seq:
+            self.max_seq = seq
+        else:
+            self.reordered += 1
+        self.received += 1
+        self.bytes += size
+
+        transit = recv_ns - send_ns
+        self.owd_sum += transit
+        if self.owd_min is None or transit < self.owd_min:
+            self.owd_min = transit
+        if transit > self.owd_max:
+            self.owd_max = transit
+
+        # RFC 3550 interarrival jitter
+        if self.last_transit is not None:
+            self.jitter_ns += (abs(transit - self.last_transit) - self.jitter_ns) / 16.0
+        self.last_transit = transit
+
+    def report(self, interval):
+        expected = self.max_seq - self.interval_base
+        self.idle = self.idle + 1 if self.received == 0 else 0
+        lost = max(0, expected - self.received)
+        row = {
+            "received": self.received,
+            "expected": expected,
+            "loss_percent": round(100.0 * lost / expected, 2) if expected > 0 else 0.0,
+            "mbps": round(self.bytes * 8 / interval / 1e6, 3),
+            "owd_ms": round(self.owd_sum / self.received / 1e6, 3) if self.received else None,
+            "owd_max_ms": round(self.owd_max / 1e6, 3) if self.received else None,
+            "jitter_ms": round(self.jitter_ns / 1e6, 3),
+            "reordered": self.reordered,
+        }
+        self.interval_base = self.max_seq
+        self.received = 0
+        self.reordered = 0
+        self.bytes = 0
+        self.owd_sum = 0
+        self.owd_min = None
+        self.owd_max = 0
+        return row
+
+
+class AbrSession:
+    """
+    One ABR TCP connection. Segment arrivals fill a playback buffer which drains
+    in real time once playback has started; an empty buffer is a stall.
+    """
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.lock = threading.Lock()
+        self.framed = None          # False for legacy senders without segment headers
+        self.player_id = None
+        self.quality_idx = None
+        self.segments = 0
+        self.bytes = 0
+
+        self.buffer_ms = 0.0
+        self.playing = False
+        self.stalled = False
+        self.started = False
+        self.last = time.monotonic()
+        self.stall_ms = 0.0         # Stall time in the current interval
+        self.stall_ms_total = 0.0
+        self.rebuffer_events = 0
+        self.closed = False
+
+    def _advance(self, now):
+        """Drain the buffer up to `now`, entering a stall if it runs dry."""
+        elapsed_ms = (now - self.last) * 1000.0
+        self.last = now
+        if self.stalled:
+            self.stall_ms += elapsed_ms
+            self.stall_ms_total += elapsed_ms
+        elif self.playing:
+            if elapsed_ms >= self.buffer_ms:
+                stall = elapsed_ms - self.buffer_ms
+                self.buffer_ms = 0.0
+                self.playing = False
+                self.stalled = True
+                self.rebuffer_events += 1
+                self.stall_ms += stall
+                self.stall_ms_total += stall
+            else:
+                self.buffer_ms -= elapsed_ms
+
+    def on_segment(self, player_id, quality_idx, media_ms):
+        with self.lock:
+            now = time.monotonic()
+            self._advance(now)
+            self.player_id = player_id
+            self.quality_idx = quality_idx
+            self.segments += 1
+            self.buffer_ms += media_ms
+            # Start (or resume) once one segment is buffered
+            if not self.playing and self.buffer_ms >= media_ms:
+                self.playing = True
+                self.stalled = False
+                self.started = True
+
+    def report(self, interval):
+        with self.lock:
+            self._advance(time.monotonic())
+            row = {
+                "peer": self.peer,
+                "player_id": self.player_id,
+                "quality_idx": self.quality_idx,
+                "mbps": round(self.bytes * 8 / interval / 1e6, 3),
+                "buffer_sec": round(self.buffer_ms / 1000.0, 2),
+                "stall_sec": round(self.stall_ms / 1000.0, 3),
+                "stall_sec_total": round(self.stall_ms_total / 1000.0, 3),
+                "rebuffer_events": self.rebuffer_events,
+                "framed": self.framed,
+            }
+            self.stall_ms = 0.0
+            self.bytes = 0
+            return row
+
+    def serve(self, conn):
+        """Read the stream with one reusable buffer, parsing only segment headers."""
+        buf = bytearray(TCP_BUF_SIZE)
+        view = memoryview(buf)
+        header = bytearray()
+        remaining = 0  # Payload bytes left in the current segment
+        try:
+            while True:
+                n = conn.recv_into(buf)
+                if n == 0:
+                    break
+                with self.lock:  # Read and reset by the reporter thread
+                    self.bytes += n
+                if self.framed is False:
+                    continue
+
+                pos = 0
+                while pos < n:
+                    if remaining:
+                        step = min(remaining, n - pos)
+                        remaining -= step
+                        pos += step
+                        continue
+                    take = min(ABR_HEADER.size - len(header), n - pos)
+                    header += view[pos:pos + take]
+                    pos += take
+                    if len(header) < ABR_HEADER.size:
+                        break
+                    magic, player_id, quality_idx, seq, media_ms, payload_len, _, send_ns = ABR_HEADER.unpack(header)
+                    header.clear()
+                    if magic != ABR_MAGIC:
+                        self.framed = False  # Legacy sender: count bytes only
+                        break
+                    self.framed = True
+                    remaining = payload_len
+                    self.on_segment(player_id, quality_idx, media_ms)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+            self.closed = True
+
+
+class QoEProbe:
+    def __init__(self, port=LISTEN_PORT, out_file=QOE_JSON_FILE, engine_url=None):
+        self.port = port
+        self.out_file = out_file
+        self.engine_url = engine_url
+        self.udp_streams = {}   # (src ip, stream id) -> UdpStreamStats
+        self.abr_sessions = []
+        self.other_bytes = 0    # Datagrams without a video header
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.udp.bind(('0.0.0.0', port))
+        self.udp.setblocking(False)
+        try:
+            self.udp.setsockopt(socket.SOL_UDP, UDP_GRO, 1)
+            self.gro = True
+        except OSError:
+            self.gro = False
+
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(('0.0.0.0', port))
+        self.tcp.listen(16)
+        self.tcp.setblocking(False)
+
+        # Preallocated receive buffer, reused for every datagram
+        self.buf = bytearray(RECV_BUF_SIZE)
+        self.view = memoryview(self.buf)
+
+    def _on_datagram(self, src, data_len, seg_size, recv_ns):
+        for off in range(0, data_len, seg_size):
+            size = min(seg_size, data_len - off)
+            if size < VIDEO_HEADER.size:
+                self.other_bytes += size
+                continue
+            magic, stream_id, flags, seq, frame, send_ns = VIDEO_HEADER.unpack_from(self.buf, off)
+            if magic != VIDEO_MAGIC:
+                self.other_bytes += size
+                continue
+            key = (src, stream_id)
+            stats = self.udp_streams.get(key)
+            if stats is None:
+                stats = self.udp_streams[key] = UdpStreamStats(seq)
+            stats.on_packet(seq, send_ns, recv_ns, size)
+
+    def drain_udp(self):
+        """Receive up to RECV_BATCH datagrams without blocking (recvmmsg-style batching)."""
+        for _ in range(RECV_BATCH):
+            try:
+                if self.gro:
+                    n, ancdata, _, addr = self.udp.recvmsg_into([self.buf], GRO_CMSG_SPACE)
+                    seg_size = n
+                    for level, ctype, cdata in ancdata:
+                        if level == socket.SOL_UDP and ctype == UDP_GRO:
+                            seg_size = struct.unpack('i', cdata[:4])[0]
+                else:
+                    n, addr = self.udp.recvfrom_into(self.buf)
+                    seg_size = n
+            except (BlockingIOError, InterruptedError):
+                return
+            self._on_datagram(addr[0], n, max(1, seg_size), time.time_ns())
+
+    def accept_tcp(self):
+        try:
+            conn, addr = self.tcp.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(True)
+        session = AbrSession(f"{addr[0]}:{addr[1]}")
+        self.abr_sessions.append(session)
+        threading.Thread(target=session.serve, args=(conn,), daemon=True).start()
+
+    def build_report(self, interval):
+        streams = []
+        expected = 0
+        received = 0
+        owd = []
+        jitter = 0.0
+        goodput = 0.0
+        for (src, stream_id), stats in list(self.udp_streams.items()):
+            row = stats.report(interval)
+            row.update({"src": src, "stream_id": stream_id})
+            streams.append(row)
+            expected += row["expected"]
+            received += min(row["received"], row["expected"])
+            goodput += row["mbps"]
+            if row["owd_ms"] is not None:
+                owd.append(row["owd_ms"])
+            jitter = max(jitter, row["jitter_ms"])
+            if stats.idle >= STREAM_IDLE_REPORTS:
+                del self.udp_streams[(src, stream_id)]
+
+        players = []
+        stall = 0.0
+        rebuffers = 0
+        for session in list(self.abr_sessions):
+            row = session.report(interval)
+            players.append(row)
+            stall += row["stall_sec"]
+            rebuffers += row["rebuffer_events"]
+            goodput += row["mbps"]
+        self.abr_sessions = [s for s in self.abr_sessions if not s.closed]
+
+        loss = 100.0 * (expected - received) / expected if expected > 0 else 0.0
+        return {
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "time": time.time(),
+            "video_loss_percent": round(loss, 2),
+            "owd_ms": round(sum(owd) / len(owd), 3) if owd else None,
+            "jitter_ms": round(jitter, 3),
+            "goodput_mbps": round(goodput, 3),
+            "stall_sec": round(stall, 3),
+            "rebuffer_events": rebuffers,
+            "udp_streams": streams,
+            "abr_players": players,
+        }
+
+    def publish(self, report):
+        # Write-then-rename so readers never see a partial file
+        tmp_file = self.out_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_file, self.out_file)
+
+        if self.engine_url:
+            try:
+                requests.post(self.engine_url, json=report, timeout=0.5)
+            except Exception as e:
+                print(f"[QOE] Engine push failed: {e}")
+
+    def run(self):
+        print(f"[QOE] Listening on UDP/TCP {self.port} (GRO={'on' if self.gro else 'off'}) -> {self.out_file}")
+        poller = select.poll()
+        poller.register(self.udp, select.POLLIN)
+        poller.register(self.tcp, select.POLLIN)
+        udp_fd = self.udp.fileno()
+
+        last_report = time.monotonic()
+        while True:
+            timeout_ms = max(0, int((last_report + REPORT_INTERVAL - time.monotonic()) * 1000))
+            for fd, _ in poller.poll(timeout_ms):
+                if fd == udp_fd:
+                    self.drain_udp()
+                else:
+                    self.accept_tcp()
+
+            now = time.monotonic()
+            if now - last_report >= REPORT_INTERVAL:
+                report = self.build_report(now - last_report)
+                last_report = now
+                self.publish(report)
+                print(f"[QOE {report['timestamp']}] Loss:{report['video_loss_percent']}% | "
+                      f"OWD:{report['owd_ms']}ms | Jitter:{report['jitter_ms']}ms | "
+                      f"Stall:{report['stall_sec']}s | Goodput:{report['goodput_mbps']}Mbps")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver-side video QoE probe")
+    parser.add_argument("--port", type=int, default=LISTEN_PORT)
+    parser.add_argument("--out", default=QOE_JSON_FILE, help="QoE snapshot file (read by current_network.py)")
+    parser.add_argument("--engine-url", default=None, help="Also POST snapshots here, e.g. http://10.0.0.254:5000/qoe")
+    args = parser.parse_args()
+
+    try:
+        QoEProbe(args.port, args.out, args.engine_url).run()
+    except KeyboardInterrupt:
+        print("\n[QOE] Stopped.")
+
+
+if __name__ == "__main__":
+    main()